@@ -0,0 +1,113 @@
+"""Startup time of lightweight icekube commands.
+
+Each command's imports are profiled in a fresh interpreter with
+`python -X importtime`, taking the fastest of several runs. Exits non-zero
+when a command exceeds its budget, or imports a module only needed by
+commands talking to a cluster or by another command.
+
+The budget covers every import a command makes before it starts work,
+including the neo4j driver for commands talking to neo4j, whose share is
+reported alongside.
+
+    python benchmarks/import_time.py [--runs 5] [--budget-ms 150]
+"""
+
+import argparse
+import subprocess
+import sys
+from typing import Dict, List, Set, Tuple
+
+# Modules imported by each command, in addition to icekube.cli
+COMMANDS: Dict[str, List[str]] = {
+    "--help": [],
+    "purge": ["icekube.neo4j", "neo4j"],
+    "attack-path": ["icekube.scheduler", "neo4j"],
+    "query": ["icekube.queries", "neo4j"],
+    "export": ["icekube.export", "neo4j"],
+}
+
+# Packages the lightweight commands should not import before starting work
+HEAVY = ["kubernetes", "pydantic", "tqdm", "icekube.models", "icekube.kube"]
+
+# Modules only the commands listing them should import
+LAZY = ["icekube.export"]
+
+# Third party packages only the commands listing them should import, whose
+# share of the import time is reported
+EXTERNAL = ["neo4j"]
+
+
+def import_times(code: str) -> List[Tuple[str, int]]:
+    """Name and cumulative microseconds of every import made running code."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        times.append((name.rstrip(), int(cumulative)))
+    return times
+
+
+# Imported by the interpreter itself (site, encodings, .pth hooks) before any
+# command code runs, so not counted against the budget
+STARTUP = {name.strip() for name, _ in import_times("pass")}
+
+
+def profile(modules: List[str]) -> Tuple[float, float, Set[str]]:
+    """Import time, that of EXTERNAL within it, in milliseconds, and modules."""
+    code = "; ".join(f"import {x}" for x in ["icekube.cli", *modules])
+
+    total = 0
+    external = 0
+    imported = set()
+    for name, cumulative in import_times(code):
+        imported.add(name.strip())
+        # Only count top level imports, their cumulative time includes nested
+        if not name.startswith("  ") and name.strip() not in STARTUP:
+            total += cumulative
+        # Included in the cumulative time of whichever module imported it
+        if name.strip() in EXTERNAL:
+            external += cumulative
+
+    return total / 1000, external / 1000, imported
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=150.0)
+    args = parser.parse_args()
+
+    failed = False
+    for command, modules in COMMANDS.items():
+        runs = [profile(modules) for _ in range(args.runs)]
+        elapsed = min(x[0] for x in runs)
+        external = min(x[1] for x in runs)
+        heavy = sorted(
+            {x for x in runs[0][2] for y in HEAVY if x == y or x.startswith(f"{y}.")},
+        )
+        heavy += [x for x in LAZY if x in runs[0][2] and x not in modules]
+        heavy += [x for x in EXTERNAL if x in runs[0][2] and x not in modules]
+
+        status = "ok"
+        if elapsed > args.budget_ms:
+            status = f"over budget of {args.budget_ms:.0f}ms"
+            failed = True
+        if heavy:
+            status = f"imports {', '.join(heavy[:3])}"
+            failed = True
+
+        print(f"{command:<12} {elapsed:7.1f}ms  ({external:5.1f}ms driver)  {status}")
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,3 +0,0 @@
-import urllib3
-
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
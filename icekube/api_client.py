@@ -0,0 +1,67 @@
+from __future__ import annotations
+
+import logging
+import threading
+from typing import List, Optional, Tuple
+
+import urllib3
+from icekube.config import config
+from icekube.ratelimit import get_rate_limiter
+from icekube.sessions import session
+from kubernetes import client
+
+logger = logging.getLogger(__name__)
+
+# Set here rather than on import of icekube, so commands not talking to a
+# cluster don't import urllib3
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+shared_client_lock = threading.Lock()
+
+
+def api_client() -> client.ApiClient:
+    """The ApiClient shared by every Kubernetes request to the session's cluster.
+
+    Its connection pool is sized to the request concurrency, and responses
+    are requested gzip compressed. The kube config must already be loaded.
+    """
+    current = session()
+
+    with shared_client_lock:
+        if current.api_client is None:
+            configuration = (
+                current.configuration or client.Configuration.get_default_copy()
+            )
+            configuration.connection_pool_maxsize = max(
+                config["kube"]["concurrency"],
+                configuration.connection_pool_maxsize or 0,
+            )
+            current.api_client = client.ApiClient(configuration)
+            current.api_client.set_default_header("Accept-Encoding", "gzip")
+
+    return current.api_client
+
+
+def get_raw(
+    path: str,
+    query_params: Optional[List[Tuple[str, str]]] = None,
+    accept: str = "application/json",
+) -> bytes:
+    """GET a path, returning the decompressed body without deserialising it.
+
+    Requests are rate limited and retried, see `get_rate_limiter`.
+    """
+
+    def get() -> bytes:
+        resp = api_client().call_api(
+            path,
+            "GET",
+            query_params=query_params or [],
+            header_params={"Accept": accept},
+            auth_settings=["BearerToken"],
+            _preload_content=False,
+            _return_http_data_only=True,
+        )
+        return bytes(resp.data)
+
+    return get_rate_limiter().call(get)
@@ -1,6 +1,8 @@
 # flake8: noqa
 
-from typing import List
+from typing import Dict, List
+
+from icekube.capabilities import capability_predicate
 
 WORKLOAD_TYPES = [
     "ReplicationController",
@@ -83,11 +85,11 @@ attack_paths = {
     "CAN_IMPERSONATE": "MATCH (src)-[:GRANTS_IMPERSONATE]->(dest)",
     # Pod breakout
     "IS_PRIVILEGED": "MATCH (src:Pod {privileged: true})<-[:HOSTS_POD]-(dest:Node)",
-    "CAN_CGROUP_BREAKOUT": 'MATCH (src:Pod)<-[:HOSTS_POD]-(dest:Node) WHERE "SYS_ADMIN" in src.capabilities',
-    "CAN_LOAD_KERNEL_MODULES": 'MATCH (src:Pod)<-[:HOSTS_POD]-(dest:Node) WHERE "SYS_MODULE" in src.capabilities',
+    "CAN_CGROUP_BREAKOUT": f"MATCH (src:Pod)<-[:HOSTS_POD]-(dest:Node) WHERE {capability_predicate('src', 'SYS_ADMIN')}",
+    "CAN_LOAD_KERNEL_MODULES": f"MATCH (src:Pod)<-[:HOSTS_POD]-(dest:Node) WHERE {capability_predicate('src', 'SYS_MODULE')}",
     "CAN_ACCESS_DANGEROUS_HOST_PATH": "MATCH (src:Pod {dangerous_host_path: true})<-[:HOSTS_POD]-(dest:Node)",
-    "CAN_NSENTER_HOST": 'MATCH (src:Pod {hostPID: true})<-[:HOSTS_POD]-(dest:Node) WHERE all(x in ["SYS_ADMIN", "SYS_PTRACE"] WHERE x in src.capabilities)',
-    "CAN_ACCESS_HOST_FD": 'MATCH (src:Pod)<-[:HOSTS_POD]-(dest:Node) WHERE "DAC_READ_SEARCH" in src.capabilities',
+    "CAN_NSENTER_HOST": f"MATCH (src:Pod {{hostPID: true}})<-[:HOSTS_POD]-(dest:Node) WHERE {capability_predicate('src', 'SYS_ADMIN', 'SYS_PTRACE')}",
+    "CAN_ACCESS_HOST_FD": f"MATCH (src:Pod)<-[:HOSTS_POD]-(dest:Node) WHERE {capability_predicate('src', 'DAC_READ_SEARCH')}",
     # Can jump to pods running on node
     "ACCESS_POD": "MATCH (src:Node)-[:HOSTS_POD]->(dest:Pod)",
     # Can exec into pods on a node
@@ -124,3 +126,98 @@ attack_paths = {
         """,
     ],
 }
+
+# Rules reading the attack paths of other rules, which must complete before
+# they run, see `task_dependencies`. A rule matching on the `attack_path`
+# property of any relationship depends on ANY_ATTACK_PATH, and runs after
+# every rule not itself depending on it.
+ANY_ATTACK_PATH = "*"
+
+attack_path_dependencies: Dict[str, List[str]] = {
+    "RBAC_ESCALATE_TO": ["GRANTS_PERMISSION"],
+    "AZURE_POD_IDENTITY_EXCEPTION": [ANY_ATTACK_PATH],
+}
+
+# Variants of the rules above which fan out to every member of a set of
+# resources. Rather than an edge per member, these target a single scope node
+# and are used when `scoped_targets` is enabled:
+#   - (:Cluster) - every resource within the cluster
+#   - (:Namespace) - every resource within the namespace
+#   - (:Scope {name: 'subjects'}) - every User, Group and ServiceAccount
+# Scoped edges are tagged with `scoped: true`, and expanded when paths are read,
+# at every hop, see `target_scopes` and `scope_members`
+scoped_attack_paths = {
+    "RBAC_ESCALATE_TO": [
+        # RoleBindings
+        """
+        MATCH (src:RoleBinding)-[:GRANTS_ESCALATE]->(role)-[:WITHIN_NAMESPACE]->(dest:Namespace)
+        WHERE (role:Role OR role:ClusterRole) AND (src)-[:GRANTS_PERMISSION]->(role)
+        """,
+        # ClusterRoleBindings
+        """
+        MATCH (src:ClusterRoleBinding)-[:GRANTS_ESCALATE]->(role:ClusterRole), (dest:Cluster)
+        WHERE (src)-[:GRANTS_PERMISSION]->(role)
+        """,
+    ],
+    "GENERATE_CLIENT_CERTIFICATE": """
+        MATCH (src)-[:GRANTS_CERTIFICATESIGNINGREQUESTS_CREATE]->(cluster:Cluster), (dest:Scope {
+          name: "subjects"
+        })
+        WHERE (src)-[:HAS_CSR_APPROVAL]->(cluster) AND (src)-[:GRANTS_APPROVE]->(:Signer {
+          name: "kubernetes.io/kube-apiserver-client"
+        })
+        """,
+}
+
+
+def target_scopes(target: str = "target", scope: str = "scope") -> str:
+    """Cypher subquery binding `scope` to `target` and each scope containing it.
+
+    Paths to a target should be searched for up to any of these nodes, so that
+    scoped attack paths are expanded at read time.
+    """
+    return f"""
+        CALL {{
+            WITH {target} RETURN {target} AS {scope}
+            UNION
+            WITH {target} MATCH ({scope}:Cluster)
+            WHERE coalesce({scope}.cluster, '') = coalesce({target}.cluster, '')
+            AND coalesce({scope}.build, '') = coalesce({target}.build, '')
+            RETURN {scope}
+            UNION
+            WITH {target} MATCH ({target})-[:WITHIN_NAMESPACE]->({scope}:Namespace) RETURN {scope}
+            UNION
+            WITH {target} MATCH ({scope}:Scope {{name: "subjects"}})
+            WHERE ({target}:User OR {target}:Group OR {target}:ServiceAccount)
+            AND coalesce({scope}.cluster, '') = coalesce({target}.cluster, '')
+            AND coalesce({scope}.build, '') = coalesce({target}.build, '')
+            RETURN {scope}
+        }}
+        """
+
+
+def scope_members(scope: str = "scope", member: str = "member") -> str:
+    """Cypher subquery binding `member` to each resource within `scope`.
+
+    The reverse of `target_scopes`, so that paths through a scoped attack path
+    continue from each member of its scope.
+    """
+    return f"""
+        CALL {{
+            WITH {scope} WITH {scope} WHERE {scope}:Cluster
+            MATCH ({member}:Resource)
+            WHERE coalesce({member}.cluster, '') = coalesce({scope}.cluster, '')
+            AND coalesce({member}.build, '') = coalesce({scope}.build, '')
+            RETURN {member}
+            UNION
+            WITH {scope} MATCH ({member})-[:WITHIN_NAMESPACE]->({scope}:Namespace)
+            RETURN {member}
+            UNION
+            WITH {scope} WITH {scope} WHERE {scope}:Scope AND {scope}.name = "subjects"
+            MATCH ({member})
+            WHERE ({member}:User OR {member}:Group OR {member}:ServiceAccount)
+            AND coalesce({member}.cluster, '') = coalesce({scope}.cluster, '')
+            AND coalesce({member}.build, '') = coalesce({scope}.build, '')
+            RETURN {member}
+        }}
+        """
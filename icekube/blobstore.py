@@ -0,0 +1,267 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import threading
+import zlib
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from icekube.config import config
+
+logger = logging.getLogger(__name__)
+
+# SQLite limits the number of variables in a single statement
+BATCH_SIZE = 500
+
+# zlib only makes use of the last 32KB of a preset dictionary
+MAX_TEMPLATE_SIZE = 32 * 1024
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS templates "
+    "(id INTEGER PRIMARY KEY, key TEXT UNIQUE NOT NULL, data BLOB NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS blobs "
+    "(hash TEXT PRIMARY KEY, template INTEGER, data BLOB NOT NULL)",
+]
+
+
+def template_key(raw: str) -> Optional[str]:
+    """Key grouping near identical objects, e.g. the replicas of a ReplicaSet.
+
+    Objects sharing a key are compressed against the first one stored.
+    """
+    try:
+        metadata = json.loads(raw).get("metadata") or {}
+    except (ValueError, AttributeError):
+        return None
+
+    for owner in metadata.get("ownerReferences") or []:
+        if owner.get("uid"):
+            return f"owner:{owner['uid']}"
+
+    if metadata.get("generateName"):
+        namespace = metadata.get("namespace", "")
+        return f"generate:{namespace}/{metadata['generateName']}"
+
+    return None
+
+
+class BlobStore:
+    """Content addressed, compressed store for the raw JSON of resources.
+
+    Payloads are keyed by their SHA-256, so identical objects are stored once,
+    and similar objects are compressed with a shared preset dictionary.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.templates: Dict[int, bytes] = {}
+        self.template_ids: Dict[str, int] = {}
+
+        # Only imported with a blob store, as most commands don't use one
+        import sqlite3
+
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        for statement in SCHEMA:
+            self.connection.execute(statement)
+        self.connection.commit()
+
+        self.load_templates()
+
+    def load_templates(self) -> None:
+        self.templates = {}
+        self.template_ids = {}
+        for id, key, data in self.connection.execute(
+            "SELECT id, key, data FROM templates",
+        ):
+            self.template_ids[key] = id
+            self.templates[id] = data
+
+    def template(self, raw: str) -> Optional[int]:
+        key = template_key(raw)
+        if key is None:
+            return None
+
+        if key not in self.template_ids:
+            data = raw.encode()[-MAX_TEMPLATE_SIZE:]
+            cursor = self.connection.execute(
+                "INSERT INTO templates (key, data) VALUES (?, ?)",
+                (key, data),
+            )
+            id = cursor.lastrowid
+            assert id is not None
+            self.template_ids[key] = id
+            self.templates[id] = data
+
+        return self.template_ids[key]
+
+    def put(self, raw: str) -> str:
+        return self.put_many([raw])[0]
+
+    def put_many(self, raws: List[str]) -> List[str]:
+        """Store a batch of payloads in one transaction, returning their hashes.
+
+        Only payloads not already stored are compressed.
+        """
+        digests = [hashlib.sha256(x.encode()).hexdigest() for x in raws]
+
+        with self.lock:
+            existing = self.existing(digests)
+            rows = []
+            for raw, digest in zip(raws, digests):
+                if digest in existing:
+                    continue
+                existing.add(digest)
+
+                template = self.template(raw)
+                if template is None:
+                    compressor = zlib.compressobj(level=9)
+                else:
+                    compressor = zlib.compressobj(
+                        level=9,
+                        zdict=self.templates[template],
+                    )
+                data = compressor.compress(raw.encode()) + compressor.flush()
+                rows.append((digest, template, data))
+
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO blobs (hash, template, data) VALUES (?, ?, ?)",
+                rows,
+            )
+            self.connection.commit()
+
+        return digests
+
+    def existing(self, digests: List[str]) -> Set[str]:
+        found: Set[str] = set()
+        for idx in range(0, len(digests), BATCH_SIZE):
+            batch = digests[idx : idx + BATCH_SIZE]
+            found.update(
+                x
+                for x, in self.connection.execute(
+                    "SELECT hash FROM blobs WHERE hash IN "
+                    f"({', '.join('?' for _ in batch)})",
+                    batch,
+                )
+            )
+        return found
+
+    def get(self, digest: str) -> Optional[str]:
+        return self.get_many([digest]).get(digest)
+
+    def get_many(self, digests: Iterable[str]) -> Dict[str, str]:
+        wanted = list(set(digests))
+        results: Dict[str, str] = {}
+
+        with self.lock:
+            for idx in range(0, len(wanted), BATCH_SIZE):
+                batch = wanted[idx : idx + BATCH_SIZE]
+                rows = self.connection.execute(
+                    "SELECT hash, template, data FROM blobs WHERE hash IN "
+                    f"({', '.join('?' for _ in batch)})",
+                    batch,
+                )
+                for digest, template, data in rows:
+                    if template is None:
+                        decompressor = zlib.decompressobj()
+                    else:
+                        decompressor = zlib.decompressobj(
+                            zdict=self.templates[template],
+                        )
+                    raw = decompressor.decompress(data) + decompressor.flush()
+                    results[digest] = raw.decode()
+
+        missing = [x for x in wanted if x not in results]
+        if missing:
+            logger.warning(f"Missing {len(missing)} raw payloads from blob store")
+
+        return results
+
+    def prune(self, referenced: Iterable[str]) -> int:
+        """Delete payloads, and templates, no longer referenced by any node.
+
+        `referenced` is streamed into a temporary table, a batch at a time.
+        Payloads stored since pruning started are always kept.
+        """
+        with self.lock:
+            (watermark,) = self.connection.execute(
+                "SELECT coalesce(max(rowid), 0) FROM blobs",
+            ).fetchone()
+            self.connection.execute(
+                "CREATE TEMP TABLE IF NOT EXISTS referenced (hash TEXT PRIMARY KEY)",
+            )
+            self.connection.execute("DELETE FROM referenced")
+
+        batch: List[str] = []
+        for digest in referenced:
+            batch.append(digest)
+            if len(batch) >= BATCH_SIZE:
+                self.reference(batch)
+                batch = []
+        self.reference(batch)
+
+        with self.lock:
+            removed = self.connection.execute(
+                "DELETE FROM blobs WHERE rowid <= ? "
+                "AND hash NOT IN (SELECT hash FROM referenced)",
+                (watermark,),
+            ).rowcount
+            self.connection.execute(
+                "DELETE FROM templates WHERE id NOT IN "
+                "(SELECT template FROM blobs WHERE template IS NOT NULL)",
+            )
+            self.connection.execute("DROP TABLE referenced")
+            self.connection.commit()
+            self.load_templates()
+
+        return removed
+
+    def reference(self, digests: List[str]) -> None:
+        with self.lock:
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO referenced (hash) VALUES (?)",
+                [(x,) for x in digests],
+            )
+
+    def clear(self) -> None:
+        with self.lock:
+            self.connection.execute("DELETE FROM blobs")
+            self.connection.execute("DELETE FROM templates")
+            self.connection.commit()
+            self.templates = {}
+            self.template_ids = {}
+
+
+blob_store: Optional[BlobStore] = None
+
+
+def get_blob_store() -> Optional[BlobStore]:
+    """The configured blob store, or None when raw JSON is kept in neo4j."""
+    global blob_store
+
+    path = config["graph"]["blob_store"]
+    if not path:
+        return None
+
+    if blob_store is None or blob_store.path != path:
+        blob_store = BlobStore(path)
+
+    return blob_store
+
+
+def resolve_raw(records: List[Dict[str, Any]]) -> None:
+    """Replace the raw hashes of a batch of node properties with their JSON."""
+    store = get_blob_store()
+    digests = [x["raw_hash"] for x in records if x.get("raw_hash")]
+
+    if store is None or not digests:
+        return
+
+    blobs = store.get_many(digests)
+    for record in records:
+        digest = record.pop("raw_hash", None)
+        if digest and digest in blobs:
+            record["raw"] = blobs[digest]
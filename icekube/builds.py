@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+import logging
+from typing import Any, Dict, List, Optional, cast
+from uuid import uuid4
+
+from icekube.config import config
+from icekube.neo4j import (
+    RESOURCE_LABEL,
+    count_matches,
+    delete_batched,
+    get_driver,
+    prune_blobs,
+)
+
+logger = logging.getLogger(__name__)
+
+# Labels of the nodes written within a build
+BUILD_LABELS = [RESOURCE_LABEL, "Identity"]
+
+
+class BuildSwitchFailed(Exception):
+    pass
+
+
+def build_pointers() -> Dict[str, Any]:
+    """The build being served, the build being written and every build kept."""
+    with get_driver().session() as session:
+        result = session.run(
+            "MATCH (m:Meta {name: 'graph'}) RETURN m.serving_build AS serving, "
+            "m.pending_build AS pending, coalesce(m.builds, []) AS builds",
+        ).single()
+
+    if not result:
+        return {"serving": None, "pending": None, "builds": []}
+    return cast(Dict[str, Any], result.data())
+
+
+def current_build() -> Optional[str]:
+    """Build nodes are written to and read from, with blue/green builds.
+
+    Unless a run has started a new build, this is the build being served.
+    """
+    if not config["graph"]["blue_green"]:
+        return None
+
+    if config["graph"]["build"] is None:
+        # Empty once looked up with nothing served, so it is looked up once
+        config["graph"]["build"] = build_pointers()["serving"] or ""
+
+    return config["graph"]["build"] or None
+
+
+def start_build(resume: bool = False) -> str:
+    """Start a build for a run to write, while the serving build is read.
+
+    Resuming continues the pending build of a failed run. Otherwise it is
+    abandoned, and removed by `collect_garbage`.
+    """
+    pending = build_pointers()["pending"]
+    build = cast(str, pending) if resume and pending else uuid4().hex
+
+    with get_driver().session() as session:
+        session.run(
+            "MERGE (m:Meta {name: 'graph'}) SET m.pending_build = $build, "
+            "m.builds = [x IN coalesce(m.builds, []) WHERE x <> $build] + $build",
+            build=build,
+        ).consume()
+
+    config["graph"]["build"] = build
+    logger.info(f"Writing build {build}")
+    return build
+
+
+def switch_build(build: str) -> None:
+    """Serve a completed build, switching every reader in one transaction."""
+    with get_driver().session() as session:
+        # The generation is changed alongside, invalidating cached query
+        # results, see `new_generation`
+        result = session.run(
+            "MATCH (m:Meta {name: 'graph'}) WHERE m.pending_build = $build "
+            "SET m.serving_build = $build, m.pending_build = null, "
+            "m.generation = $generation RETURN m",
+            build=build,
+            generation=uuid4().hex,
+        ).single()
+
+    if result is None:
+        raise BuildSwitchFailed(
+            f"Build {build} is no longer pending, as another run has started",
+        )
+    logger.info(f"Serving build {build}")
+
+
+def collect_garbage() -> List[str]:
+    """Delete every build neither served nor pending, in bounded batches.
+
+    Raw JSON in the blob store no longer referenced by any node is removed.
+
+    Readers are already served another build, so are never blocked by this.
+    It runs in the foreground, as the process would otherwise exit before it
+    completes, and can be left to a later `icekube gc`.
+    """
+    from tqdm import tqdm
+
+    pointers = build_pointers()
+    stale = [
+        x
+        for x in pointers["builds"]
+        if x not in [pointers["serving"], pointers["pending"]]
+    ]
+
+    for build in stale:
+        matches = [f"MATCH (x:{x} {{build: $build}})" for x in BUILD_LABELS]
+        total = sum(count_matches(x, "x", build=build) for x in matches)
+
+        print(f"Removing build {build}")
+        with tqdm(total=total) as progress:
+            for match in matches:
+                # Relationships first, so no transaction detaches a node with
+                # many of them
+                delete_batched(match + "-[r]->()", "r", build=build)
+                delete_batched(match, "x", detach=True, progress=progress, build=build)
+        print("")
+
+        with get_driver().session() as session:
+            session.run(
+                "MATCH (m:Meta {name: 'graph'}) "
+                "SET m.builds = [x IN m.builds WHERE x <> $build]",
+                build=build,
+            ).consume()
+
+    # Including raw JSON of nodes rewritten within the builds kept
+    prune_blobs()
+
+    return stale
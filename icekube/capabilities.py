@@ -0,0 +1,69 @@
+from __future__ import annotations
+
+from typing import Iterable
+
+CAPABILITIES = [
+    "AUDIT_CONTROL",
+    "AUDIT_READ",
+    "AUDIT_WRITE",
+    "BLOCK_SUSPEND",
+    "BPF",
+    "CHECKPOINT_RESTORE",
+    "CHOWN",
+    "DAC_OVERRIDE",
+    "DAC_READ_SEARCH",
+    "FOWNER",
+    "FSETID",
+    "IPC_LOCK",
+    "IPC_OWNER",
+    "KILL",
+    "LEASE",
+    "LINUX_IMMUTABLE",
+    "MAC_ADMIN",
+    "MAC_OVERRIDE",
+    "MKNOD",
+    "NET_ADMIN",
+    "NET_BIND_SERVICE",
+    "NET_BROADCAST",
+    "NET_RAW",
+    "PERFMON",
+    "SETFCAP",
+    "SETGID",
+    "SETPCAP",
+    "SETUID",
+    "SYSLOG",
+    "SYS_ADMIN",
+    "SYS_BOOT",
+    "SYS_CHROOT",
+    "SYS_MODULE",
+    "SYS_NICE",
+    "SYS_PACCT",
+    "SYS_PTRACE",
+    "SYS_RAWIO",
+    "SYS_RESOURCE",
+    "SYS_TIME",
+    "SYS_TTY_CONFIG",
+    "WAKE_ALARM",
+]
+
+
+# Bit of each capability within a pod's `capability_mask`
+CAPABILITY_BITS = {capability: 1 << idx for idx, capability in enumerate(CAPABILITIES)}
+
+
+def capability_mask(capabilities: Iterable[str]) -> int:
+    mask = 0
+    for capability in capabilities:
+        mask |= CAPABILITY_BITS.get(capability, 0)
+    return mask
+
+
+def capability_predicate(var: str, *capabilities: str) -> str:
+    """Cypher predicate for a pod having every one of the capabilities.
+
+    Cypher has no bitwise operators, so each bit of `capability_mask` is
+    tested with integer division.
+    """
+    return " AND ".join(
+        f"{var}.capability_mask / {CAPABILITY_BITS[x]} % 2 = 1" for x in capabilities
+    )
@@ -0,0 +1,138 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+import tempfile
+import weakref
+from pathlib import Path
+from threading import Lock
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple, cast
+
+from icekube.sessions import current_cluster
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHECKPOINT = "~/.cache/icekube/checkpoint.json"
+
+
+class CheckpointMismatch(Exception):
+    pass
+
+
+class Checkpoint:
+    """Steps of a run completed so far, appended to a state file as they complete.
+
+    Steps are recorded by stage and key, within the cluster being enumerated,
+    so a resumed run skips them. Relationships deferred until every node
+    exists are kept in a file alongside the state. Without a path, progress
+    is only kept in memory, for runs which are not resumable, and deferred
+    relationships in a temporary file.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        run: Optional[Dict[str, Any]] = None,
+        resume: bool = False,
+    ):
+        self.path = Path(path).expanduser() if path else None
+        self.run = run or {}
+        self.lock = Lock()
+        self.completed: Set[str] = set()
+        self.spool: Optional[Path] = None
+
+        if self.path is None:
+            fd, spool = tempfile.mkstemp(prefix="icekube-deferred-")
+            os.close(fd)
+            self.spool = Path(spool)
+            # Removed with the checkpoint, should the run never clear it
+            weakref.finalize(self, self.spool.unlink, missing_ok=True)
+            return
+
+        if resume and self.path.exists():
+            self.load()
+            logger.info(f"Resuming from {len(self.completed)} completed steps")
+        else:
+            self.clear()
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.path.write_text(json.dumps(self.run) + "\n")
+
+    def load(self) -> None:
+        with open(cast(Path, self.path)) as fs:
+            run = json.loads(fs.readline())
+            if run != self.run:
+                raise CheckpointMismatch(
+                    f"Checkpoint {self.path} is for a different run: {run}",
+                )
+
+            for line in fs:
+                # A step being recorded when the run failed may be incomplete
+                if line.endswith("\n"):
+                    self.completed.add(json.loads(line))
+
+    @property
+    def deferred_path(self) -> Path:
+        if self.path is None:
+            return cast(Path, self.spool)
+        return self.path.with_name(self.path.name + ".deferred")
+
+    def key(self, stage: str, key: str) -> str:
+        return f"{current_cluster() or ''}|{stage}|{key}"
+
+    def done(self, stage: str, key: str = "") -> bool:
+        with self.lock:
+            return self.key(stage, key) in self.completed
+
+    def complete(self, stage: str, key: str = "") -> None:
+        with self.lock:
+            step = self.key(stage, key)
+            self.completed.add(step)
+
+            # Appended, so recording a step doesn't grow with those before it
+            if self.path is not None:
+                with open(self.path, "a") as fs:
+                    fs.write(json.dumps(step) + "\n")
+
+    def add_deferred(self, commands: Iterable[Tuple[str, Dict[str, Any]]]) -> None:
+        with self.lock, open(self.deferred_path, "a") as fs:
+            for cmd, kwargs in commands:
+                fs.write(json.dumps([current_cluster(), cmd, kwargs]) + "\n")
+
+    def deferred(self, chunk_size: int) -> Iterator[List[Tuple[str, Dict[str, Any]]]]:
+        """Deferred relationships recorded for the cluster being enumerated.
+
+        They are read a line at a time, and yielded in chunks of `chunk_size`,
+        so only one chunk is held in memory.
+        """
+        if not self.deferred_path.exists():
+            return
+
+        cluster = current_cluster()
+        chunk: List[Tuple[str, Dict[str, Any]]] = []
+        with open(self.deferred_path) as fs:
+            for line in fs:
+                # Only other clusters may be appending, as this one reads
+                if not line.endswith("\n"):
+                    continue
+                line_cluster, cmd, kwargs = json.loads(line)
+                if line_cluster != cluster:
+                    continue
+                chunk.append((cmd, kwargs))
+                if len(chunk) >= chunk_size:
+                    yield chunk
+                    chunk = []
+        if chunk:
+            yield chunk
+
+    def clear(self) -> None:
+        """Remove the state of a run, once it has completed."""
+        self.completed = set()
+        for path in [self.path, self.deferred_path]:
+            if path is not None and path.exists():
+                path.unlink()
+
+
+def task_key(task: Any) -> str:
+    """Key of an ingest task, see `icekube.kube.ListTask`."""
+    return str(getattr(task, "key", task))
@@ -1,31 +1,95 @@
 import json
 import logging
+from fnmatch import fnmatch
 from pathlib import Path
-from typing import Iterator, List, Optional, cast
+from typing import Any, Dict, List, Optional
 
 import typer
+from icekube.checkpoint import DEFAULT_CHECKPOINT, Checkpoint
 from icekube.config import config
-from icekube.icekube import (
-    create_indices,
-    enumerate_resource_kind,
-    generate_relationships,
-    purge_neo4j,
-    remove_attack_paths,
-    setup_attack_paths,
-)
-from icekube.kube import (
-    APIResource,
-    Resource,
-    all_resources,
-    metadata_download,
-)
+from icekube.formats import EXPORT_FORMATS, FORMATS, QUERY_TYPES
 from icekube.log_config import build_logger
-from tqdm import tqdm
+from icekube.profiles import PROFILES
 
+# Modules importing the kubernetes client or the models are imported by the
+# commands using them, so other commands start quickly. See
+# benchmarks/import_time.py
 app = typer.Typer()
 
 IGNORE_DEFAULT = "events,componentstatuses"
 
+CONTEXTS_HELP = (
+    "Kubeconfig contexts to enumerate concurrently into one graph, "
+    "comma-delimited and supporting globs"
+)
+
+
+def resolve_contexts(contexts: str) -> List[str]:
+    from icekube.kube import context_clusters
+
+    clusters = context_clusters()
+    available = list(clusters)
+    resolved: List[str] = []
+
+    for pattern in contexts.split(","):
+        matches = [x for x in available if fnmatch(x, pattern)]
+        if not matches:
+            raise typer.BadParameter(
+                f"No kubeconfig contexts match {pattern}",
+                param_hint="--contexts",
+            )
+        resolved += [x for x in matches if x not in resolved]
+
+    # Sessions, and so node identifiers and checkpoints, are keyed by cluster
+    seen: Dict[str, str] = {}
+    for context in resolved:
+        cluster = clusters[context]
+        if cluster in seen:
+            raise typer.BadParameter(
+                f"Contexts {seen[cluster]} and {context} both use cluster "
+                f"{cluster}, only one context per cluster can be enumerated",
+                param_hint="--contexts",
+            )
+        seen[cluster] = context
+
+    return resolved
+
+
+def require_build(command: str) -> None:
+    """Refuse to write nodes with --blue-green outside of the build of a run."""
+    if config["graph"]["blue_green"]:
+        raise typer.BadParameter(
+            f"`{command}` would write outside of a build, use `icekube "
+            "--blue-green run` to write a new build",
+            param_hint="--blue-green",
+        )
+
+
+def enumerate_graph(
+    ignore: str,
+    contexts: Optional[str],
+    checkpoint: Optional[Checkpoint] = None,
+) -> None:
+    from icekube.icekube import (
+        enumerate_clusters,
+        enumerate_resource_kind,
+        generate_relationships,
+    )
+    from icekube.indices import create_indices
+
+    if contexts:
+        config["graph"]["multi_cluster"] = True
+        enumerate_clusters(
+            resolve_contexts(contexts),
+            ignore.split(","),
+            checkpoint=checkpoint,
+        )
+        return
+
+    create_indices()
+    enumerate_resource_kind(ignore.split(","), checkpoint)
+    generate_relationships(checkpoint=checkpoint)
+
 
 @app.command()
 def run(
@@ -33,9 +97,53 @@ def run(
         IGNORE_DEFAULT,
         help="Names of resource types to ignore",
     ),
+    contexts: Optional[str] = typer.Option(None, help=CONTEXTS_HELP),
+    resume: bool = typer.Option(
+        False,
+        help="Continue a failed run from its checkpoint, skipping completed "
+        "list calls, relationships and attack path rules",
+    ),
+    checkpoint_file: str = typer.Option(
+        DEFAULT_CHECKPOINT,
+        show_default=True,
+        help="File recording the progress of the run",
+    ),
+    collect_builds: bool = typer.Option(
+        True,
+        help="With --blue-green, remove builds no longer served once the run "
+        "completes",
+    ),
 ):
-    enumerate(ignore)
-    attack_path()
+    from icekube.builds import collect_garbage, start_build, switch_build
+    from icekube.scheduler import remove_attack_paths, setup_attack_paths
+
+    run_key: Dict[str, Any] = {
+        "url": config["neo4j"]["url"],
+        "contexts": contexts,
+        "ignore": ignore,
+    }
+    build = None
+    if config["graph"]["blue_green"]:
+        # Queries are served the previous build until this one completes
+        build = start_build(resume)
+        run_key["build"] = build
+
+    checkpoint = Checkpoint(checkpoint_file, run_key, resume)
+
+    enumerate_graph(ignore, contexts, checkpoint)
+    # A new build has no attack paths to remove
+    if build is None:
+        remove_attack_paths(checkpoint)
+    setup_attack_paths(checkpoint)
+
+    if build is not None:
+        switch_build(build)
+    checkpoint.clear()
+
+    # Once switched, so readers are served the new build while old ones are
+    # removed. With --no-collect-builds, removal is left to `icekube gc`
+    if build is not None and collect_builds:
+        collect_garbage()
 
 
 @app.command()
@@ -44,33 +152,215 @@ def enumerate(
         IGNORE_DEFAULT,
         help="Names of resource types to ignore",
     ),
+    contexts: Optional[str] = typer.Option(None, help=CONTEXTS_HELP),
 ):
+    require_build("enumerate")
+    enumerate_graph(ignore, contexts)
+
+
+@app.command()
+def indices(
+    check: bool = typer.Option(
+        True,
+        help="Check that the statements icekube runs are index backed",
+    ),
+):
+    from icekube.indices import create_indices, unindexed_statements
+
     create_indices()
-    enumerate_resource_kind(ignore.split(","))
-    generate_relationships()
+
+    if not check:
+        return
+
+    unindexed = unindexed_statements()
+    for cmd in unindexed:
+        print(f"Not index backed: {cmd}")
+    if unindexed:
+        raise typer.Exit(1)
 
 
 @app.command()
-def relationships():
-    generate_relationships()
+def relationships(
+    full: bool = typer.Option(
+        True,
+        help="Generate relationships for every resource, not only those "
+        "changed since relationships were last generated",
+    ),
+):
+    from icekube.icekube import generate_relationships
+
+    require_build("relationships")
+    generate_relationships(full=full)
 
 
 @app.command()
 def attack_path():
+    from icekube.scheduler import remove_attack_paths, setup_attack_paths
+
     remove_attack_paths()
     setup_attack_paths()
 
 
+@app.command()
+def query(
+    query_type: str = typer.Argument(
+        ...,
+        help=f"One of: {', '.join(QUERY_TYPES)}",
+    ),
+    source: Optional[str] = typer.Option(
+        None,
+        help="Source nodes, as Kind, Kind/name or Kind/namespace/name, where "
+        "* matches any name or namespace",
+    ),
+    target: Optional[str] = typer.Option(None, help="Target nodes, as --source"),
+    cluster: Optional[str] = typer.Option(
+        None,
+        help="Only match nodes of this cluster, when enumerated with --contexts",
+    ),
+    max_hops: int = typer.Option(6, show_default=True),
+    limit: int = typer.Option(
+        1000,
+        show_default=True,
+        help="Maximum number of paths, or nodes found",
+    ),
+    output_format: str = typer.Option(
+        "table",
+        "--format",
+        show_default=True,
+        help=f"One of: {', '.join(FORMATS)}",
+    ),
+    cache: bool = typer.Option(
+        True,
+        show_default=True,
+        help="Cache results until attack paths are next generated",
+    ),
+    cache_dir: str = typer.Option("~/.cache/icekube/queries", show_default=True),
+):
+    from icekube.queries import Selector, cached_query, format_result
+
+    if query_type not in QUERY_TYPES:
+        raise typer.BadParameter(f"Unknown query type {query_type}")
+    if output_format not in FORMATS:
+        raise typer.BadParameter(
+            f"Unknown format {output_format}",
+            param_hint="--format",
+        )
+
+    try:
+        result = cached_query(
+            query_type,
+            Selector.parse(source) if source else None,
+            Selector.parse(target) if target else None,
+            cluster,
+            max_hops,
+            limit,
+            cache_dir if cache else None,
+        )
+    except ValueError as e:
+        raise typer.BadParameter(str(e))
+
+    print(format_result(result, output_format))
+
+
+@app.command()
+def export(
+    output_format: str = typer.Option(
+        "jsonl",
+        "--format",
+        show_default=True,
+        help=f"One of: {', '.join(EXPORT_FORMATS)}",
+    ),
+    output: str = typer.Option(
+        "-",
+        "--output",
+        "-o",
+        show_default=True,
+        help="File to write, or - for stdout",
+    ),
+    namespace: Optional[List[str]] = typer.Option(
+        None,
+        help="Only export edges from or to resources in this namespace, can be "
+        "repeated",
+    ),
+    source: Optional[str] = typer.Option(
+        None,
+        help="Only export attack paths from these subjects, as Kind, Kind/name "
+        "or Kind/namespace/name, where * matches any name or namespace",
+    ),
+    target: Optional[str] = typer.Option(
+        None,
+        help="Only export attack paths to these targets, as --source",
+    ),
+    cluster: Optional[str] = typer.Option(
+        None,
+        help="Only export edges of this cluster, when enumerated with --contexts",
+    ),
+    max_hops: int = typer.Option(6, show_default=True),
+    limit: int = typer.Option(
+        1000000,
+        show_default=True,
+        help="Maximum number of nodes found from --source or --target",
+    ),
+):
+    from icekube.export import ExportError, attack_path_edges, export_edges
+    from icekube.queries import Selector
+
+    if output_format not in EXPORT_FORMATS:
+        raise typer.BadParameter(
+            f"Unknown format {output_format}",
+            param_hint="--format",
+        )
+
+    try:
+        edges = attack_path_edges(
+            namespace,
+            Selector.parse(source) if source else None,
+            Selector.parse(target) if target else None,
+            cluster,
+            max_hops,
+            limit,
+        )
+        count = export_edges(edges, output_format, output)
+    except (ValueError, ExportError) as e:
+        raise typer.BadParameter(str(e))
+
+    typer.echo(f"Exported {count} attack path edges", err=True)
+
+
 @app.command()
 def purge():
+    from icekube.neo4j import purge_neo4j
+
     purge_neo4j()
 
 
+@app.command()
+def gc():
+    from icekube.builds import collect_garbage
+
+    removed = collect_garbage()
+    print(f"Removed {len(removed)} builds no longer served")
+
+
+def write_resource_file(file: Path, objects: List[Dict[str, Any]]) -> None:
+    from icekube.snapshot import object_key
+
+    # Ordered by key, so snapshots can be diffed with a linear merge
+    objects.sort(key=object_key)
+    with open(file, "w") as fs:
+        fs.write(json.dumps(objects, indent=4, default=str))
+
+
 @app.command()
 def download(output_dir: str):
+    from icekube.kube import all_resources, metadata_download
+
     path = Path(output_dir)
     path.mkdir(exist_ok=True)
 
+    # Downloads are loaded back in later, so should be complete
+    config["enumeration"]["full_objects"] = True
+
     resources = all_resources()
     metadata = metadata_download()
 
@@ -84,8 +374,7 @@ def download(output_dir: str):
         if current_type is None:
             current_type = resource.resource_definition_name
         elif current_type != resource.resource_definition_name:
-            with open(path / f"{current_type}.json", "w") as fs:
-                fs.write(json.dumps(current_group, indent=4, default=str))
+            write_resource_file(path / f"{current_type}.json", current_group)
             current_group = []
             current_type = resource.resource_definition_name
 
@@ -93,65 +382,60 @@ def download(output_dir: str):
             current_group.append(json.loads(resource.raw))
 
     if current_type:
-        with open(path / f"{current_type}.json", "w") as fs:
-            fs.write(json.dumps(current_group, indent=4, default=str))
+        write_resource_file(path / f"{current_type}.json", current_group)
 
 
 @app.command()
 def load(input_dir: str, attack_paths: bool = True):
-    path = Path(input_dir)
-    metadata = json.load(open(path / "_metadata.json"))
-
-    from icekube import kube
-    from icekube import icekube
-
-    kube.kube_version = lambda: cast(str, metadata["kube_version"])
-    kube.context_name = lambda: cast(str, metadata["context_name"])
-    kube.api_versions = lambda: cast(List[str], metadata["api_versions"])
-    kube.preferred_versions = metadata["preferred_versions"]
-    kube.api_resources = lambda: cast(
-        List[APIResource],
-        [APIResource(**x) for x in metadata["api_resources"]],
-    )
+    from icekube.snapshot import use_snapshot
 
-    icekube.api_resources = kube.api_resources
-    icekube.context_name = kube.context_name
-    icekube.kube_version = kube.kube_version
-
-    def all_resources(
-        preferred_versions_only: bool = True,
-        ignore: Optional[List[str]] = None,
-    ) -> Iterator[Resource]:
-        print("Loading files from disk")
-
-        for file in tqdm(path.glob("*")):
-            if file.name == "_metadata.json":
-                continue
-            try:
-                # If downloaded via kubectl get -A
-                data = json.load(open(file))["items"]
-            except TypeError:
-                # If downloaded via icekube download
-                data = json.load(open(file))
-
-            for resource in data:
-                yield Resource(
-                    apiVersion=resource["apiVersion"],
-                    kind=resource["kind"],
-                    name=resource["metadata"]["name"],
-                    namespace=resource["metadata"].get("namespace"),
-                    plural=file.name.split(".")[0],
-                    raw=json.dumps(resource, default=str),
-                )
-        print("")
-
-    kube.all_resources = all_resources
-    icekube.all_resources = all_resources
+    use_snapshot(Path(input_dir))
 
     if attack_paths:
-        run(IGNORE_DEFAULT)
+        run(IGNORE_DEFAULT, None, False, DEFAULT_CHECKPOINT, True)
     else:
-        enumerate(IGNORE_DEFAULT)
+        enumerate(IGNORE_DEFAULT, None)
+
+
+@app.command()
+def diff(
+    snapshot_a: str,
+    snapshot_b: str,
+    attack_paths: bool = typer.Option(
+        False,
+        help="Also find the attack paths added and removed, loading both "
+        "snapshots into neo4j",
+    ),
+    hops: int = typer.Option(
+        3,
+        show_default=True,
+        help="Distance from a changed object within which attack paths are compared",
+    ),
+    keep_graph: bool = typer.Option(
+        False,
+        help="Keep the snapshots loaded for the attack path diff in neo4j",
+    ),
+    output: Optional[str] = typer.Option(
+        None,
+        help="Write the JSON report to this file rather than stdout",
+    ),
+):
+    from icekube.diff import diff_report
+
+    report = diff_report(
+        Path(snapshot_a),
+        Path(snapshot_b),
+        attack_paths,
+        hops,
+        keep_graph,
+    )
+    data = json.dumps(report, indent=2, default=str)
+
+    if output:
+        with open(output, "w") as fs:
+            fs.write(data)
+    else:
+        print(data)
 
 
 @app.callback()
@@ -160,12 +444,162 @@ def callback(
     neo4j_user: str = typer.Option("neo4j", show_default=True),
     neo4j_password: str = typer.Option("neo4j", show_default=True),
     neo4j_encrypted: bool = typer.Option(False, show_default=True),
+    neo4j_fetch_size: int = typer.Option(
+        1000,
+        show_default=True,
+        help="Number of records to stream from neo4j at a time",
+    ),
+    scoped_targets: bool = typer.Option(
+        False,
+        show_default=True,
+        help="Target scope nodes instead of every member for fan-out attack paths",
+    ),
+    blob_store: Optional[str] = typer.Option(
+        None,
+        show_default=True,
+        help="Store raw resource JSON in this SQLite file instead of neo4j",
+    ),
+    blue_green: bool = typer.Option(
+        False,
+        help="Write each run to a new build of the graph, served to queries "
+        "once the run completes",
+    ),
+    delete_batch_size: int = typer.Option(
+        10000,
+        show_default=True,
+        help="Number of nodes or relationships deleted per neo4j transaction",
+    ),
+    profile: str = typer.Option(
+        "full",
+        show_default=True,
+        help=f"Resource kinds to enumerate, one of: {', '.join(PROFILES)}",
+    ),
+    namespace: Optional[List[str]] = typer.Option(
+        None,
+        help="Only enumerate namespaces matching this glob, can be repeated",
+    ),
+    exclude_namespace: Optional[List[str]] = typer.Option(
+        None,
+        help="Skip namespaces matching this glob, can be repeated",
+    ),
+    label_selector: Optional[str] = typer.Option(
+        None,
+        help="Label selector passed to every list call",
+    ),
+    full_objects: bool = typer.Option(
+        False,
+        show_default=True,
+        help="Fetch complete objects for every kind, rather than only the "
+        "fields used",
+    ),
+    discovery_cache: bool = typer.Option(
+        True,
+        show_default=True,
+        help="Cache API discovery on disk, revalidating it on each run",
+    ),
+    discovery_cache_dir: str = typer.Option(
+        "~/.cache/icekube/discovery",
+        show_default=True,
+    ),
+    kube_concurrency: int = typer.Option(
+        16,
+        show_default=True,
+        help="Number of concurrent Kubernetes API requests",
+    ),
+    kube_qps: float = typer.Option(
+        50.0,
+        show_default=True,
+        help="Average Kubernetes API requests per second, 0 for no limit",
+    ),
+    kube_burst: int = typer.Option(
+        100,
+        show_default=True,
+        help="Kubernetes API requests allowed in a burst above --kube-qps",
+    ),
+    kube_max_retries: int = typer.Option(
+        5,
+        show_default=True,
+        help="Retries for throttled or failed Kubernetes API requests",
+    ),
+    ingest_pipeline: bool = typer.Option(
+        True,
+        show_default=True,
+        help="Fetch, parse and write resources concurrently",
+    ),
+    fetchers: int = typer.Option(
+        8,
+        show_default=True,
+        help="Number of threads listing resources when pipelined",
+    ),
+    parsers: int = typer.Option(
+        2,
+        show_default=True,
+        help="Number of threads building resources when pipelined",
+    ),
+    writers: int = typer.Option(
+        4,
+        show_default=True,
+        help="Number of threads writing resources to neo4j when pipelined",
+    ),
+    ingest_queue_size: int = typer.Option(
+        32,
+        show_default=True,
+        help="Number of responses, or batches, queued between pipeline stages",
+    ),
+    write_batch_size: int = typer.Option(
+        500,
+        show_default=True,
+        help="Number of resources written per neo4j transaction",
+    ),
+    parse_processes: int = typer.Option(
+        0,
+        show_default=True,
+        help="Number of worker processes building models while ingesting and "
+        "generating relationships, or 0 to build them in threads",
+    ),
+    attack_path_workers: int = typer.Option(
+        4,
+        show_default=True,
+        help="Number of attack path queries to run concurrently",
+    ),
+    attack_path_chunk_size: int = typer.Option(
+        10000,
+        show_default=True,
+        help="Number of source nodes handled per attack path transaction",
+    ),
     verbose: int = typer.Option(0, "--verbose", "-v", count=True),
 ):
     config["neo4j"]["url"] = neo4j_url
     config["neo4j"]["username"] = neo4j_user
     config["neo4j"]["password"] = neo4j_password
     config["neo4j"]["encrypted"] = neo4j_encrypted
+    config["neo4j"]["fetch_size"] = neo4j_fetch_size
+    config["graph"]["scoped_targets"] = scoped_targets
+    config["graph"]["blob_store"] = blob_store
+    config["graph"]["blue_green"] = blue_green
+    config["graph"]["delete_batch_size"] = delete_batch_size
+    if profile not in PROFILES:
+        raise typer.BadParameter(f"Unknown profile {profile}", param_hint="--profile")
+    config["enumeration"]["profile"] = profile
+    config["enumeration"]["namespaces"] = namespace or []
+    config["enumeration"]["exclude_namespaces"] = exclude_namespace or []
+    config["enumeration"]["label_selector"] = label_selector
+    config["enumeration"]["full_objects"] = full_objects
+    config["discovery"]["cache"] = discovery_cache
+    config["discovery"]["cache_dir"] = discovery_cache_dir
+    config["kube"]["concurrency"] = kube_concurrency
+    config["kube"]["qps"] = kube_qps
+    config["kube"]["burst"] = kube_burst
+    config["kube"]["max_retries"] = kube_max_retries
+    config["ingest"]["pipeline"] = ingest_pipeline
+    config["ingest"]["fetchers"] = fetchers
+    config["ingest"]["parsers"] = parsers
+    config["ingest"]["writers"] = writers
+    config["ingest"]["queue_size"] = ingest_queue_size
+    config["ingest"]["batch_size"] = write_batch_size
+    config["ingest"]["processes"] = parse_processes
+    config["attack_paths"]["workers"] = attack_path_workers
+    config["attack_paths"]["chunk_size"] = attack_path_chunk_size
 
     verbosity_levels = {
         0: logging.ERROR,
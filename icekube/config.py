@@ -1,4 +1,4 @@
-from typing import TypedDict
+from typing import List, Optional, TypedDict
 
 
 class Neo4j(TypedDict):
@@ -6,10 +6,61 @@ class Neo4j(TypedDict):
     username: str
     password: str
     encrypted: bool
+    fetch_size: int
+
+
+class AttackPaths(TypedDict):
+    workers: int
+    chunk_size: int
+
+
+class Graph(TypedDict):
+    scoped_targets: bool
+    multi_cluster: bool
+    blob_store: Optional[str]
+    delete_batch_size: int
+    blue_green: bool
+    build: Optional[str]
+
+
+class Enumeration(TypedDict):
+    profile: str
+    namespaces: List[str]
+    exclude_namespaces: List[str]
+    label_selector: Optional[str]
+    full_objects: bool
+
+
+class Discovery(TypedDict):
+    cache: bool
+    cache_dir: str
+
+
+class Kube(TypedDict):
+    concurrency: int
+    qps: float
+    burst: int
+    max_retries: int
+
+
+class Ingest(TypedDict):
+    pipeline: bool
+    fetchers: int
+    parsers: int
+    writers: int
+    queue_size: int
+    batch_size: int
+    processes: int
 
 
 class Config(TypedDict):
     neo4j: Neo4j
+    attack_paths: AttackPaths
+    graph: Graph
+    enumeration: Enumeration
+    discovery: Discovery
+    kube: Kube
+    ingest: Ingest
 
 
 config: Config = {
@@ -18,5 +69,44 @@ config: Config = {
         "username": "neo4j",
         "password": "neo4j",
         "encrypted": False,
+        "fetch_size": 1000,
+    },
+    "attack_paths": {
+        "workers": 4,
+        "chunk_size": 10000,
+    },
+    "graph": {
+        "scoped_targets": False,
+        "multi_cluster": False,
+        "blob_store": None,
+        "delete_batch_size": 10000,
+        "blue_green": False,
+        "build": None,
+    },
+    "enumeration": {
+        "profile": "full",
+        "namespaces": [],
+        "exclude_namespaces": [],
+        "label_selector": None,
+        "full_objects": False,
+    },
+    "discovery": {
+        "cache": True,
+        "cache_dir": "~/.cache/icekube/discovery",
+    },
+    "kube": {
+        "concurrency": 16,
+        "qps": 50.0,
+        "burst": 100,
+        "max_retries": 5,
+    },
+    "ingest": {
+        "pipeline": True,
+        "fetchers": 8,
+        "parsers": 2,
+        "writers": 4,
+        "queue_size": 32,
+        "batch_size": 500,
+        "processes": 0,
     },
 }
@@ -0,0 +1,329 @@
+from __future__ import annotations
+
+import logging
+from contextvars import copy_context
+from pathlib import Path
+from typing import (
+    Any,
+    Dict,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+    cast,
+)
+
+from icekube.config import config
+from icekube.icekube import enumerate_resource_kind, generate_relationships
+from icekube.indices import create_indices
+from icekube.neo4j import RESOURCE_LABEL, delete_batched, get_driver, prune_blobs
+from icekube.scheduler import read_relationships, rule_tasks, run_attack_paths
+from icekube.sessions import ClusterSession, current_session
+from icekube.snapshot import (
+    included,
+    is_download,
+    object_key,
+    read_objects,
+    snapshot_files,
+    use_snapshot,
+)
+from icekube.utils import content_hash, normalise
+
+logger = logging.getLogger(__name__)
+
+# Key, content hash, apiVersion and kind of an object within a resource file
+Entry = Tuple[Tuple[str, str], str, str, str]
+
+# Properties identifying the ends of an attack path, regardless of cluster
+ENDPOINT_PROPERTIES = ["apiVersion", "kind", "namespace", "name"]
+
+# Relationships to every resource of a namespace or cluster, which would
+# reach the whole graph within a couple of hops
+HUB_RELATIONSHIPS = ["WITHIN_CLUSTER", "WITHIN_NAMESPACE"]
+
+
+class ObjectChange(NamedTuple):
+    change: str
+    resourceType: str
+    apiVersion: str
+    kind: str
+    namespace: Optional[str]
+    name: str
+
+
+class AttackPathChange(NamedTuple):
+    change: str
+    relationship: str
+    source: Dict[str, Optional[str]]
+    target: Dict[str, Optional[str]]
+
+
+def object_entries(file: Optional[Path]) -> Iterator[Entry]:
+    """Compact entries for the objects in a resource file, ordered by key.
+
+    Downloads are written in key order, so are decoded, hashed and yielded
+    an object at a time. Files from kubectl are read in full by
+    `read_objects` regardless, so their entries are sorted in memory.
+    """
+    if file is None:
+        return iter([])
+
+    entries = (
+        (object_key(obj), content_hash(normalise(obj)), obj["apiVersion"], obj["kind"])
+        for obj in read_objects(file)
+        if included(obj)
+    )
+    if not is_download(file):
+        return iter(sorted(entries))
+    return in_order(file, entries)
+
+
+def in_order(file: Path, entries: Iterator[Entry]) -> Iterator[Entry]:
+    """Entries of a download, failing should one not be in key order."""
+    previous = None
+    for entry in entries:
+        if previous is not None and entry[0] < previous:
+            raise ValueError(
+                f"{file} is not ordered by namespace and name, download it again",
+            )
+        previous = entry[0]
+        yield entry
+
+
+def merge(a: Iterator[Entry], b: Iterator[Entry]) -> Iterator[Tuple[str, Entry]]:
+    """Merge two ordered streams of entries, yielding each change between them."""
+    x = next(a, None)
+    y = next(b, None)
+
+    while x is not None or y is not None:
+        if y is None or (x is not None and x[0] < y[0]):
+            yield "removed", cast(Entry, x)
+            x = next(a, None)
+        elif x is None or y[0] < x[0]:
+            yield "added", y
+            y = next(b, None)
+        else:
+            if x[1] != y[1]:
+                yield "modified", y
+            x = next(a, None)
+            y = next(b, None)
+
+
+def diff_objects(a: Path, b: Path) -> Iterator[ObjectChange]:
+    """Objects added, removed or modified between two snapshots."""
+    a_files = snapshot_files(a)
+    b_files = snapshot_files(b)
+
+    for resource_type in sorted(set(a_files) | set(b_files)):
+        entries = merge(
+            object_entries(a_files.get(resource_type)),
+            object_entries(b_files.get(resource_type)),
+        )
+        for change, ((namespace, name), _, api_version, kind) in entries:
+            yield ObjectChange(
+                change,
+                resource_type,
+                api_version,
+                kind,
+                namespace or None,
+                name,
+            )
+
+
+def clear_cluster(cluster: str) -> None:
+    delete_batched(
+        f"MATCH (x:{RESOURCE_LABEL} {{cluster: $cluster}})",
+        "x",
+        detach=True,
+        cluster=cluster,
+    )
+    prune_blobs()
+
+
+def load_snapshot(path: Path, cluster: str) -> None:
+    """Load a snapshot into the graph, with `cluster` in its identifiers."""
+    current_session.set(ClusterSession(name=cluster))
+    use_snapshot(path)
+
+    create_indices()
+    enumerate_resource_kind()
+    generate_relationships()
+
+
+def traversed_relationships() -> List[str]:
+    """Relationship types read by attack path rules, other than hub ones."""
+    types: Set[str] = set()
+    for task in rule_tasks():
+        types.update(read_relationships(task))
+    return sorted(types - set(HUB_RELATIONSHIPS))
+
+
+def affected_sources(
+    changes: List[ObjectChange],
+    clusters: Tuple[str, str],
+    hops: int,
+) -> List[int]:
+    """Nodes within `hops` of a changed object, in either snapshot.
+
+    Only attack paths from these nodes can differ between the snapshots. Each
+    is returned from both snapshots, matched by ENDPOINT_PROPERTIES, wherever
+    it was found.
+    Only relationships read by attack path rules are followed, and hub
+    relationships only from a changed object to its namespace, so that rules
+    matching through the namespace, such as CREATE_POD_WITH_SA, are covered
+    without reaching every resource within it.
+    """
+    a, b = clusters
+    params = [
+        {**change._asdict(), "cluster": cluster}
+        for change in changes
+        for cluster in {"added": [b], "removed": [a], "modified": [a, b]}[change.change]
+    ]
+
+    with get_driver().session() as session:
+        result = session.run(
+            "UNWIND $changes AS c "
+            "MATCH (x:Resource {apiVersion: c.apiVersion, kind: c.kind, "
+            "name: c.name, cluster: c.cluster}) "
+            "WHERE coalesce(x.namespace, '') = coalesce(c.namespace, '') "
+            "OPTIONAL MATCH (x)-[:WITHIN_NAMESPACE]->(ns:Namespace) "
+            "UNWIND [x, ns] AS s WITH s WHERE s IS NOT NULL "
+            f"MATCH (s)-[:{'|'.join(traversed_relationships())}*0..{hops}]-(n) "
+            "RETURN DISTINCT n.apiVersion AS apiVersion, n.kind AS kind, "
+            "n.namespace AS namespace, n.name AS name",
+            changes=params,
+        )
+        keys = [x.data() for x in result]
+
+        # The same resources in both snapshots, so that their unchanged attack
+        # paths are generated, and compared, on each side
+        result = session.run(
+            "UNWIND $keys AS k "
+            "MATCH (n:Resource {apiVersion: k.apiVersion, kind: k.kind, "
+            "name: k.name}) "
+            "WHERE n.cluster IN $clusters "
+            "AND coalesce(n.namespace, '') = coalesce(k.namespace, '') "
+            "RETURN DISTINCT id(n) AS id",
+            keys=keys,
+            clusters=list(clusters),
+        )
+        return [x["id"] for x in result]
+
+
+def attack_path_edges(
+    ids: List[int],
+) -> Dict[str, Dict[Tuple[Any, ...], AttackPathChange]]:
+    """Attack paths from the given nodes, keyed by cluster then by endpoints."""
+    properties = ", ".join(f".{x}" for x in ENDPOINT_PROPERTIES)
+    edges: Dict[str, Dict[Tuple[Any, ...], AttackPathChange]] = {}
+
+    with get_driver().session(fetch_size=config["neo4j"]["fetch_size"]) as session:
+        result = session.run(
+            "UNWIND $ids AS id MATCH (src) WHERE id(src) = id "
+            "MATCH (src)-[r]->(dest) WHERE EXISTS (r.attack_path) "
+            "RETURN src.cluster AS cluster, type(r) AS relationship, "
+            f"src {{ {properties} }} AS source, dest {{ {properties} }} AS target",
+            ids=ids,
+        )
+        for record in result:
+            source = dict(record["source"])
+            target = dict(record["target"])
+            key = (
+                record["relationship"],
+                tuple(source.get(x) for x in ENDPOINT_PROPERTIES),
+                tuple(target.get(x) for x in ENDPOINT_PROPERTIES),
+            )
+            edges.setdefault(record["cluster"], {})[key] = AttackPathChange(
+                "",
+                record["relationship"],
+                source,
+                target,
+            )
+
+    return edges
+
+
+def diff_attack_paths(
+    a: Path,
+    b: Path,
+    changes: List[ObjectChange],
+    hops: int = 3,
+    keep_graph: bool = False,
+) -> List[AttackPathChange]:
+    """Attack paths added and removed between two snapshots.
+
+    Both snapshots are loaded into the graph as separate clusters, but attack
+    paths are only generated and compared for the subgraph within `hops` of a
+    changed object. Rules matching targets without a path to them, such as
+    GENERATE_CLIENT_CERTIFICATE, are only re-evaluated for those sources.
+    """
+    if not changes:
+        return []
+
+    with get_driver().session() as session:
+        if session.run(
+            "MATCH (x:Resource) WHERE NOT EXISTS (x.cluster) RETURN x LIMIT 1",
+        ).single():
+            raise Exception(
+                "Diffing attack paths needs an empty graph, or one enumerated "
+                "with --contexts",
+            )
+
+    config["graph"]["multi_cluster"] = True
+    clusters = (f"diff:a:{a.resolve().name}", f"diff:b:{b.resolve().name}")
+
+    try:
+        for path, cluster in zip([a, b], clusters):
+            clear_cluster(cluster)
+            copy_context().run(load_snapshot, path, cluster)
+
+        ids = affected_sources(changes, clusters, hops)
+        logger.info(f"Generating attack paths for {len(ids)} affected nodes")
+        run_attack_paths(source_ids=ids)
+
+        edges = attack_path_edges(ids)
+    finally:
+        if not keep_graph:
+            for cluster in clusters:
+                clear_cluster(cluster)
+
+    before = edges.get(clusters[0], {})
+    after = edges.get(clusters[1], {})
+
+    delta = [x._replace(change="added") for k, x in after.items() if k not in before]
+    delta += [x._replace(change="removed") for k, x in before.items() if k not in after]
+    return delta
+
+
+def diff_report(
+    a: Path,
+    b: Path,
+    attack_paths: bool = False,
+    hops: int = 3,
+    keep_graph: bool = False,
+) -> Dict[str, Any]:
+    changes = list(diff_objects(a, b))
+
+    report: Dict[str, Any] = {
+        "a": str(a),
+        "b": str(b),
+        "summary": {
+            change: len([x for x in changes if x.change == change])
+            for change in ["added", "removed", "modified"]
+        },
+        "objects": [x._asdict() for x in changes],
+    }
+
+    if attack_paths:
+        delta = diff_attack_paths(a, b, changes, hops, keep_graph)
+        report["summary"]["attack_paths_added"] = len(
+            [x for x in delta if x.change == "added"],
+        )
+        report["summary"]["attack_paths_removed"] = len(
+            [x for x in delta if x.change == "removed"],
+        )
+        report["attack_paths"] = [x._asdict() for x in delta]
+
+    return report
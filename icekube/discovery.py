@@ -0,0 +1,211 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from icekube.api_client import api_client
+from icekube.config import config
+from icekube.ratelimit import get_rate_limiter
+from icekube.sessions import bound
+from kubernetes.client.exceptions import ApiException
+
+logger = logging.getLogger(__name__)
+
+AGGREGATED_ACCEPT = ",".join(
+    [
+        "application/json;g=apidiscovery.k8s.io;v=v2;as=APIGroupDiscoveryList",
+        "application/json;g=apidiscovery.k8s.io;v=v2beta1;as=APIGroupDiscoveryList",
+        "application/json",
+    ],
+)
+
+
+class Discovery(NamedTuple):
+    # Group versions, e.g. v1 or apps/v1
+    versions: List[str]
+    preferred_versions: Dict[str, str]
+    # APIResourceList style resources, with their groupVersion
+    resources: List[Dict[str, Any]]
+
+
+class DiscoveryCache:
+    """Discovery responses on disk, keyed by cluster and server version.
+
+    Responses are revalidated with their ETag, when the server provides one.
+    """
+
+    def __init__(self, host: str, version: str):
+        self.path: Optional[Path] = None
+        self.entries: Dict[str, Dict[str, Any]] = {}
+
+        if not config["discovery"]["cache"]:
+            return
+
+        key = hashlib.sha256(f"{host}|{version}".encode()).hexdigest()[:32]
+        self.path = Path(config["discovery"]["cache_dir"]).expanduser() / f"{key}.json"
+        try:
+            self.entries = json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def etag(self, path: str) -> Optional[str]:
+        return self.entries.get(path, {}).get("etag")
+
+    def body(self, path: str) -> Any:
+        return self.entries[path]["body"]
+
+    def store(self, path: str, etag: Optional[str], body: Any) -> None:
+        if etag:
+            self.entries[path] = {"etag": etag, "body": body}
+
+    def save(self) -> None:
+        if self.path is None:
+            return
+
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.path.write_text(json.dumps(self.entries))
+        except OSError:
+            logger.warning(f"Unable to write discovery cache {self.path}")
+
+
+def request(
+    cache: DiscoveryCache,
+    path: str,
+    accept: str = "application/json",
+) -> Any:
+    headers = {"Accept": accept}
+    key = f"{path} {accept}"
+    etag = cache.etag(key)
+    if etag:
+        headers["If-None-Match"] = etag
+
+    def get() -> Tuple[bytes, Dict[str, str]]:
+        resp, _, resp_headers = api_client().call_api(
+            path,
+            "GET",
+            header_params=headers,
+            auth_settings=["BearerToken"],
+            _preload_content=False,
+        )
+        return resp.data, resp_headers
+
+    try:
+        data, resp_headers = get_rate_limiter().call(get)
+    except ApiException as e:
+        if e.status == 304:
+            logger.debug(f"Discovery cache hit for {path}")
+            return cache.body(key)
+        raise
+
+    body = json.loads(data)
+    cache.store(key, resp_headers.get("ETag"), body)
+    return body
+
+
+def aggregated_resources(
+    items: List[Dict[str, Any]],
+    discovery: Discovery,
+) -> None:
+    """Fill discovery from APIGroupDiscovery items, most preferred version first."""
+    for group in items:
+        name = group.get("metadata", {}).get("name", "")
+        versions = group.get("versions") or []
+
+        if name and versions:
+            discovery.preferred_versions[name] = versions[0]["version"]
+
+        for version in versions:
+            group_version = (
+                f"{name}/{version['version']}" if name else version["version"]
+            )
+            discovery.versions.append(group_version)
+
+            for resource in version.get("resources") or []:
+                namespaced = resource.get("scope") == "Namespaced"
+                kind = (resource.get("responseKind") or {}).get("kind", "")
+                discovery.resources.append(
+                    {
+                        "name": resource["resource"],
+                        "namespaced": namespaced,
+                        "kind": kind,
+                        "verbs": resource.get("verbs") or [],
+                        "groupVersion": group_version,
+                    },
+                )
+                for sub in resource.get("subresources") or []:
+                    discovery.resources.append(
+                        {
+                            "name": f"{resource['resource']}/{sub['subresource']}",
+                            "namespaced": namespaced,
+                            "kind": (sub.get("responseKind") or {}).get("kind", kind),
+                            "verbs": sub.get("verbs") or [],
+                            "groupVersion": group_version,
+                        },
+                    )
+
+
+def discover_aggregated(
+    cache: DiscoveryCache,
+) -> Optional[Discovery]:
+    discovery = Discovery([], {}, [])
+
+    for path in ["/api", "/apis"]:
+        body = request(cache, path, AGGREGATED_ACCEPT)
+        if body.get("kind") != "APIGroupDiscoveryList":
+            return None
+        aggregated_resources(body.get("items") or [], discovery)
+
+    return discovery
+
+
+def discover_per_group(
+    cache: DiscoveryCache,
+) -> Discovery:
+    discovery = Discovery([], {}, [])
+
+    for version in request(cache, "/api").get("versions", []):
+        discovery.versions.append(version)
+
+    for group in request(cache, "/apis").get("groups", []):
+        discovery.preferred_versions[group["name"]] = group["preferredVersion"][
+            "version"
+        ]
+        for version in group.get("versions", []):
+            discovery.versions.append(version["groupVersion"])
+
+    def fetch(group_version: str) -> List[Dict[str, Any]]:
+        prefix = "/apis" if "/" in group_version else "/api"
+        try:
+            body = request(cache, f"{prefix}/{group_version}")
+        except ApiException:
+            logger.error(f"Failed to discover resources for {group_version}")
+            return []
+        return [{**x, "groupVersion": group_version} for x in body.get("resources", [])]
+
+    with ThreadPoolExecutor(max_workers=config["kube"]["concurrency"]) as exc:
+        for resources in exc.map(bound(fetch), discovery.versions):
+            discovery.resources.extend(resources)
+
+    return discovery
+
+
+def discover(host: str, version: str) -> Discovery:
+    """Discover the group versions and resources served by a cluster.
+
+    Aggregated discovery is used when the server supports it, otherwise each
+    group version is requested in parallel.
+    """
+    cache = DiscoveryCache(host, version)
+
+    discovery = discover_aggregated(cache)
+    if discovery is None:
+        logger.info("Aggregated discovery unavailable, discovering per group")
+        discovery = discover_per_group(cache)
+
+    cache.save()
+    return discovery
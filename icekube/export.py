@@ -0,0 +1,312 @@
+from __future__ import annotations
+
+import csv
+import html
+import json
+import logging
+import sys
+from contextlib import contextmanager
+from typing import (
+    IO,
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+)
+
+from icekube.attack_paths import attack_paths, target_scopes
+from icekube.builds import current_build
+from icekube.config import config
+from icekube.neo4j import get_driver
+from icekube.queries import NODE_PROPERTIES, Selector, expand, start_nodes
+
+logger = logging.getLogger(__name__)
+
+# Columns of each exported attack path edge
+COLUMNS = (
+    ["source_id", *[f"source_{x}" for x in NODE_PROPERTIES]]
+    + ["type", "scoped"]
+    + ["target_id", *[f"target_{x}" for x in NODE_PROPERTIES]]
+)
+
+RETURN_EDGE = (
+    "RETURN id(src) AS source_id, "
+    + "".join(f"src.{x} AS source_{x}, " for x in NODE_PROPERTIES)
+    + "type(r) AS type, coalesce(r.scoped, false) AS scoped, id(dest) AS target_id, "
+    + ", ".join(f"dest.{x} AS target_{x}" for x in NODE_PROPERTIES)
+)
+
+
+class ExportError(Exception):
+    pass
+
+
+def edge_conditions(
+    namespaces: List[str],
+    cluster: Optional[str],
+) -> List[str]:
+    conditions = []
+    if current_build():
+        conditions.append("src.build = $build")
+    if cluster:
+        conditions.append("src.cluster = $cluster")
+    if namespaces:
+        conditions.append(
+            "(src.namespace IN $namespaces OR dest.namespace IN $namespaces)",
+        )
+    return conditions
+
+
+def subgraph_nodes(
+    source: Optional[Selector],
+    target: Optional[Selector],
+    cluster: Optional[str],
+    max_hops: int,
+    limit: int,
+) -> Set[int]:
+    """Nodes on attack paths from `source`, to `target`, or between both."""
+    nodes: Optional[Set[int]] = None
+
+    for selector, inbound in [(source, False), (target, True)]:
+        if selector is None:
+            continue
+
+        start = start_nodes(selector, cluster, inbound)
+        distances, _, truncated = expand(start, inbound, max_hops, limit)
+        if truncated:
+            logger.warning(f"Only exporting the first {limit} nodes from {selector}")
+        nodes = set(distances) if nodes is None else nodes & set(distances)
+
+    return nodes or set()
+
+
+def id_chunks(ids: Set[int], chunk_size: int) -> Iterator[List[int]]:
+    """Ids in ascending ranges of up to `chunk_size`, see `node_id_chunks`."""
+    ordered = sorted(ids)
+    for idx in range(0, len(ordered), chunk_size):
+        yield ordered[idx : idx + chunk_size]
+
+
+def node_scopes(session: Any, nodes: Set[int]) -> Set[int]:
+    """Scopes containing any of `nodes`, the targets of their scoped edges."""
+    cmd = (
+        "UNWIND $ids AS id MATCH (target) WHERE id(target) = id "
+        + target_scopes("target", "scope")
+        + "WITH target, scope WHERE scope <> target "
+        "RETURN DISTINCT id(scope) AS id"
+    )
+
+    scopes: Set[int] = set()
+    for chunk in id_chunks(nodes, config["neo4j"]["fetch_size"]):
+        scopes.update(x["id"] for x in session.run(cmd, {"ids": chunk}))
+    return scopes
+
+
+def graph_edges(
+    session: Any,
+    namespaces: List[str],
+    cluster: Optional[str],
+) -> Iterator[Dict[str, Any]]:
+    kwargs: Dict[str, Any] = {
+        "build": current_build(),
+        "cluster": cluster,
+        "namespaces": namespaces,
+    }
+    where = " AND ".join(
+        ["EXISTS (r.attack_path)", *edge_conditions(namespaces, cluster)],
+    )
+
+    # Typed, so each type is found through its attack_path index
+    for relationship in sorted(attack_paths):
+        cmd = f"MATCH (src)-[r:{relationship}]->(dest) WHERE {where} {RETURN_EDGE}"
+        logger.debug(f"Starting neo4j query: {cmd}")
+        for record in session.run(cmd, kwargs):
+            yield record.data()
+
+
+def subgraph_edges(
+    session: Any,
+    nodes: Set[int],
+    namespaces: List[str],
+    cluster: Optional[str],
+) -> Iterator[Dict[str, Any]]:
+    """Edges between `nodes`, read from ranges of source ids.
+
+    Scoped edges target a scope rather than the nodes within it, so are kept
+    when the scope contains any of `nodes`.
+    """
+    scopes = node_scopes(session, nodes)
+    kwargs: Dict[str, Any] = {
+        "build": current_build(),
+        "cluster": cluster,
+        "namespaces": namespaces,
+    }
+    where = " AND ".join(["r.attack_path = 1", *edge_conditions(namespaces, cluster)])
+    cmd = (
+        "UNWIND $ids AS id MATCH (src) WHERE id(src) = id "
+        f"MATCH (src)-[r]->(dest) WHERE {where} {RETURN_EDGE}"
+    )
+
+    for chunk in id_chunks(nodes, config["neo4j"]["fetch_size"]):
+        logger.debug(f"Starting neo4j query: {cmd}, {len(chunk)} source nodes")
+        for record in session.run(cmd, {**kwargs, "ids": chunk}):
+            edge = record.data()
+            target = edge["target_id"]
+            if target in nodes or (edge["scoped"] and target in scopes):
+                yield edge
+
+
+def attack_path_edges(
+    namespaces: Optional[List[str]] = None,
+    source: Optional[Selector] = None,
+    target: Optional[Selector] = None,
+    cluster: Optional[str] = None,
+    max_hops: int = 6,
+    limit: int = 1000000,
+) -> Iterator[Dict[str, Any]]:
+    """Stream attack path edges, each with the properties of its endpoints.
+
+    Every edge is exported, or only those within `namespaces`, or on attack
+    paths from `source` and to `target` within `max_hops`. Edges are read in
+    batches of `fetch_size`, so are never held in memory at once. Only the ids
+    of the nodes on the selected attack paths are.
+    """
+    namespaces = namespaces or []
+
+    with get_driver().session(fetch_size=config["neo4j"]["fetch_size"]) as session:
+        if source is None and target is None:
+            yield from graph_edges(session, namespaces, cluster)
+            return
+
+        nodes = subgraph_nodes(source, target, cluster, max_hops, limit)
+        yield from subgraph_edges(session, nodes, namespaces, cluster)
+
+
+def write_jsonl(edges: Iterable[Dict[str, Any]], fs: IO[str]) -> int:
+    count = 0
+    for edge in edges:
+        fs.write(json.dumps(edge) + "\n")
+        count += 1
+    return count
+
+
+def write_csv(edges: Iterable[Dict[str, Any]], fs: IO[str]) -> int:
+    writer = csv.DictWriter(fs, COLUMNS)
+    writer.writeheader()
+
+    count = 0
+    for edge in edges:
+        writer.writerow(edge)
+        count += 1
+    return count
+
+
+def write_graphml(edges: Iterable[Dict[str, Any]], fs: IO[str]) -> int:
+    """Write edges as GraphML, each node written before its first edge."""
+
+    def data(key: str, value: Any) -> str:
+        if value is None:
+            return ""
+        if isinstance(value, bool):
+            value = str(value).lower()
+        # As xml.sax.saxutils.escape, which imports urllib.request
+        return f'<data key="{key}">{html.escape(str(value), quote=False)}</data>'
+
+    fs.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+    fs.write('<graphml xmlns="http://graphml.graphdrawing.org/xmlns">\n')
+    for key in NODE_PROPERTIES:
+        fs.write(
+            f'  <key id="{key}" for="node" attr.name="{key}" attr.type="string"/>\n',
+        )
+    fs.write('  <key id="type" for="edge" attr.name="type" attr.type="string"/>\n')
+    fs.write(
+        '  <key id="scoped" for="edge" attr.name="scoped" attr.type="boolean"/>\n',
+    )
+    fs.write('  <graph id="icekube" edgedefault="directed">\n')
+
+    # Only node ids are kept, to write each node once
+    written: Set[int] = set()
+    count = 0
+    for edge in edges:
+        for end in ["source", "target"]:
+            node = edge[f"{end}_id"]
+            if node in written:
+                continue
+            written.add(node)
+            properties = "".join(data(x, edge[f"{end}_{x}"]) for x in NODE_PROPERTIES)
+            fs.write(f'    <node id="n{node}">{properties}</node>\n')
+
+        fs.write(
+            f'    <edge source="n{edge["source_id"]}" target="n{edge["target_id"]}">'
+            f'{data("type", edge["type"])}{data("scoped", edge["scoped"])}</edge>\n',
+        )
+        count += 1
+
+    fs.write("  </graph>\n</graphml>\n")
+    return count
+
+
+def write_parquet(edges: Iterable[Dict[str, Any]], path: str) -> int:
+    """Write edges to a Parquet file, a row group for each `fetch_size` edges."""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ExportError("Exporting to parquet requires pyarrow, pip install pyarrow")
+
+    types = {"source_id": pa.int64(), "target_id": pa.int64(), "scoped": pa.bool_()}
+    schema = pa.schema([(x, types.get(x, pa.string())) for x in COLUMNS])
+    batch_size = config["neo4j"]["fetch_size"]
+
+    count = 0
+    with pq.ParquetWriter(path, schema) as writer:
+        batch: List[Dict[str, Any]] = []
+        for edge in edges:
+            batch.append(edge)
+            if len(batch) >= batch_size:
+                writer.write_table(pa.Table.from_pylist(batch, schema))
+                count += len(batch)
+                batch = []
+        if batch:
+            writer.write_table(pa.Table.from_pylist(batch, schema))
+            count += len(batch)
+    return count
+
+
+@contextmanager
+def open_output(output: str) -> Iterator[IO[str]]:
+    if output == "-":
+        yield sys.stdout
+        return
+
+    with open(output, "w", newline="") as fs:
+        yield fs
+
+
+TEXT_WRITERS: Dict[str, Callable[[Iterable[Dict[str, Any]], IO[str]], int]] = {
+    "jsonl": write_jsonl,
+    "csv": write_csv,
+    "graphml": write_graphml,
+}
+
+
+def export_edges(
+    edges: Iterable[Dict[str, Any]],
+    output_format: str,
+    output: str = "-",
+) -> int:
+    """Write edges from `attack_path_edges` to a file, or stdout with `-`."""
+    if output_format == "parquet":
+        if output == "-":
+            raise ExportError("Exporting to parquet requires an output file")
+        return write_parquet(edges, output)
+
+    if output_format not in TEXT_WRITERS:
+        raise ExportError(f"Unknown export format: {output_format}")
+
+    with open_output(output) as fs:
+        return TEXT_WRITERS[output_format](edges, fs)
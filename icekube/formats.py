@@ -0,0 +1,9 @@
+"""Choices of the query and export commands.
+
+Kept apart from `icekube.queries` and `icekube.export`, so the CLI can list
+them without importing either.
+"""
+
+QUERY_TYPES = ["shortest", "reachable", "blast-radius"]
+FORMATS = ["table", "json", "dot"]
+EXPORT_FORMATS = ["jsonl", "csv", "graphml", "parquet"]
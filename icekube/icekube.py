@@ -1,152 +1,705 @@
 import logging
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import closing
+from contextvars import copy_context
 from functools import partial
-from typing import List, Optional
+from threading import Lock
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Type,
+    Union,
+    cast,
+)
 
-from icekube.attack_paths import attack_paths
+from icekube.blobstore import get_blob_store
+from icekube.builds import current_build
+from icekube.checkpoint import Checkpoint, task_key
+from icekube.config import config
+from icekube.indices import create_indices
 from icekube.kube import (
-    all_resources,
-    api_resources,
     context_name,
+    fetch_task,
     kube_version,
+    list_tasks,
+    parse_task,
+)
+from icekube.models import Cluster, Scope, Signer
+from icekube.models.base import RELATIONSHIP, Resource, ResourceRecord
+from icekube.neo4j import (
+    cluster_filter,
+    create,
+    delete_batched,
+    existing_hashes,
+    find,
+    find_batches,
+    find_props,
+    get,
+    get_driver,
+    load_resources,
+    lookup_key,
+    node_hash,
 )
-from icekube.models import Cluster, Signer
-from icekube.models.base import Resource
-from icekube.neo4j import create, find, get, get_driver
-from neo4j import BoltDriver
+from icekube.parsing import bounded_map, parse_hashed, process_pool
+from icekube.pipeline import Pipeline, TaskFailed
+from icekube.sessions import ClusterSession, bound, current_session
+from neo4j import BoltDriver, Transaction
 from tqdm import tqdm
 
 logger = logging.getLogger(__name__)
 
+schema_lock = Lock()
 
-def create_indices():
-    for resource in api_resources():
-        if "list" not in resource.verbs:
-            continue
 
-        kind = resource.kind
-        namespace = resource.namespaced
+def _write(tx: Transaction, commands: List[Tuple[str, Dict[str, Any]]]) -> None:
+    for cmd, kwargs in commands:
+        tx.run(cmd, kwargs).consume()
+
 
-        cmd = f"CREATE INDEX {kind.lower()} IF NOT EXISTS "
-        cmd += f"FOR (n:{kind}) ON (n.name"
-        if namespace:
-            cmd += ", n.namespace"
-        cmd += ")"
+def write_resources(
+    resources: List[Tuple[Union[Resource, ResourceRecord], str]],
+) -> None:
+    """Write resources, with their content hashes, in a single transaction.
 
-        with get_driver().session() as session:
-            session.run(cmd)
+    With a blob store, raw JSON of the batch is stored in one transaction too.
+    """
+    raw_hashes: List[Optional[str]] = [None] * len(resources)
+    store = get_blob_store()
+    if store:
+        idx = [i for i, (x, _) in enumerate(resources) if x.raw]
+        digests = store.put_many([cast(str, resources[i][0].raw) for i in idx])
+        for i, digest in zip(idx, digests):
+            raw_hashes[i] = digest
+
+    commands = [
+        create(resource, digest=digest, raw_hash=raw_hash)
+        for (resource, digest), raw_hash in zip(resources, raw_hashes)
+    ]
+
+    with get_driver().session() as session:
+        # write_transaction retries transient errors such as deadlocks
+        session.write_transaction(_write, commands)
 
 
 def enumerate_resource_kind(
     ignore: Optional[List[str]] = None,
+    checkpoint: Optional[Checkpoint] = None,
 ):
+    """Write every resource to the graph, skipping those already up to date.
+
+    The content hashes of existing nodes are fetched up front, so ingesting
+    the same resources again writes nothing. Unless disabled, resources are
+    fetched, parsed and written concurrently, see `Pipeline`.
+
+    Each list call completed is recorded in `checkpoint`, and skipped when
+    resuming. List calls failing other than as forbidden or not found are left
+    out of it, and fail the run once every other call has been made.
+    """
     if ignore is None:
         ignore = []
+    if checkpoint is None:
+        checkpoint = Checkpoint()
+    if checkpoint.done("enumerate"):
+        logger.info("Resources already enumerated, skipping")
+        return
 
-    with get_driver().session() as session:
-        cluster = Cluster(name=context_name(), version=kube_version())
-        cmd, kwargs = create(cluster)
-        session.run(cmd, **kwargs)
-
-        signers = [
-            "kubernetes.io/kube-apiserver-client",
-            "kubernetes.io/kube-apiserver-client-kubelet",
-            "kubernetes.io/kubelet-serving",
-            "kubernetes.io/legacy-unknown",
-        ]
-        for signer in signers:
-            s = Signer(name=signer)
-            cmd, kwargs = create(s)
-            session.run(cmd, **kwargs)
+    def complete(task: Any) -> None:
+        cast(Checkpoint, checkpoint).complete("enumerate", task_key(task))
+
+    existing = existing_hashes()
+    skipped = 0
+    skipped_lock = Lock()
+
+    def unchanged(
+        hashed: Iterable[Tuple[Union[Resource, ResourceRecord], str]],
+    ) -> Iterator[Tuple[Union[Resource, ResourceRecord], str]]:
+        nonlocal skipped
+
+        for resource, digest in hashed:
+            if digest in existing:
+                with skipped_lock:
+                    skipped += 1
+                continue
+            yield resource, digest
+
+    def changed(
+        resources: Iterable[Union[Resource, ResourceRecord]],
+    ) -> Iterator[Tuple[Union[Resource, ResourceRecord], str]]:
+        return unchanged((x, node_hash(x.db_labels)) for x in resources)
+
+    signers = [
+        "kubernetes.io/kube-apiserver-client",
+        "kubernetes.io/kube-apiserver-client-kubelet",
+        "kubernetes.io/kubelet-serving",
+        "kubernetes.io/legacy-unknown",
+    ]
+    virtual: List[Resource] = [
+        Cluster(name=context_name(), version=kube_version()),
+        *[Signer(name=signer) for signer in signers],
+    ]
+    if config["graph"]["scoped_targets"]:
+        virtual.append(Scope(name="subjects"))
+    write_resources(list(changed(virtual)))
 
-        for resource in all_resources(ignore=ignore):
-            cmd, kwargs = create(resource)
-            session.run(cmd, **kwargs)
+    ingest = config["ingest"]
+    tasks = [
+        x
+        for x in list_tasks(ignore=ignore)
+        if not checkpoint.done("enumerate", task_key(x))
+    ]
+
+    if ingest["pipeline"]:
+        parse: Any = lambda task, body: changed(parse_task(task, body))  # noqa: E731
+        parsers = ingest["parsers"]
+
+        if ingest["processes"]:
+            pool = process_pool(ingest["processes"])
+            # Parser threads wait on a worker process each, so need at least
+            # as many to keep every process busy
+            parsers = max(parsers, ingest["processes"])
+            parse = lambda task, body: unchanged(  # noqa: E731
+                pool.submit(parse_hashed, parse_task, task, body).result(),
+            )
+
+        print("Enumerating Kubernetes resources")
+        pipeline = Pipeline(
+            fetch_task,
+            parse,
+            write_resources,
+            ingest["fetchers"],
+            parsers,
+            ingest["writers"],
+            ingest["queue_size"],
+            ingest["batch_size"],
+            complete,
+        )
+        try:
+            pipeline.run(tasks)
+        finally:
+            # Parser threads wait on each task they submit, so none are queued
+            if ingest["processes"]:
+                pool.shutdown()
+        print("")
+        failed = len(pipeline.incomplete)
+    else:
+        print("Enumerating Kubernetes resources")
+        failed = 0
+        for task in tqdm(tasks):
+            try:
+                body = fetch_task(task)
+            except TaskFailed:
+                failed += 1
+                continue
+            if body is not None:
+                batch: List[Tuple[Union[Resource, ResourceRecord], str]] = []
+                for item in changed(parse_task(task, body)):
+                    batch.append(item)
+                    if len(batch) >= ingest["batch_size"]:
+                        write_resources(batch)
+                        batch = []
+                write_resources(batch)
+            complete(task)
+        print("")
+
+    if failed:
+        raise Exception(
+            f"{failed} list calls failed, run again with --resume to retry them",
+        )
+
+    checkpoint.complete("enumerate")
+    logger.info(f"Skipped {skipped} unchanged resources")
+
+
+# Kinds whose relationships are generated first, in order. Every other kind
+# is handled in a final stage
+RELATIONSHIP_STAGES: List[List[str]] = [
+    ["Cluster", "Namespace"],
+    ["Role", "ClusterRole"],
+    ["RoleBinding", "ClusterRoleBinding"],
+]
+
+# Deferred relationships run between each checkpoint
+DEFERRED_CHUNK_SIZE = 1000
+
+# Nodes first created by a relationship have their own relationships
+# generated after every stage, see `mocked_relationships`
+MARK_MOCKED = "ON CREATE SET {prefix}.relationships_mocked = true "
+
+
+def relationship_query(relationship: RELATIONSHIP) -> Tuple[str, Dict[str, Any]]:
+    source, relationship_type, target = relationship
+    # Keep query matched nodes within the cluster and build being written
+    scope = cluster_filter()
+
+    def within(var: str) -> str:
+        return " AND ".join(f"{var}.{key} = ${key}" for key in scope)
+
+    if isinstance(source, tuple):
+        src_cmd = source[0].format(prefix="src")
+        src_kwargs = {f"src_{key}": value for key, value in source[1].items()}
+        if scope:
+            src_cmd += f"WITH src WHERE {within('src')} "
+            src_kwargs.update(scope)
+    else:
+        src_cmd, src_kwargs = get(source, prefix="src")
+        src_cmd += MARK_MOCKED.format(prefix="src")
+
+    if isinstance(target, tuple):
+        dst_cmd = target[0].format(prefix="dst")
+        dst_kwargs = {f"dst_{key}": value for key, value in target[1].items()}
+        if scope:
+            dst_cmd += f"WITH src, dst WHERE {within('dst')} "
+            dst_kwargs.update(scope)
+    else:
+        dst_cmd, dst_kwargs = get(target, prefix="dst")
+        dst_cmd += MARK_MOCKED.format(prefix="dst")
+
+    cmd = src_cmd + "WITH src " + dst_cmd
+
+    if isinstance(relationship_type, str):
+        relationship_type = [relationship_type]
+    cmd += "".join(f"MERGE (src)-[:{x}]->(dst) " for x in relationship_type)
+
+    return cmd, {**src_kwargs, **dst_kwargs}
+
+
+def relationship_commands(
+    resource: Resource,
+    initial: bool = False,
+    full: bool = True,
+) -> List[Tuple[str, Dict[str, Any], bool]]:
+    """Queries generating a resource's relationships.
+
+    Each query is returned with whether it is matched through a query.
+    """
+    logger.info(f"Generating relationships for {resource}")
+    commands = []
+
+    for relationship in resource.relationships(initial):
+        source, _, target = relationship
+        matched = isinstance(source, tuple) or isinstance(target, tuple)
+
+        # Other relationships only depend on the resource itself, so are
+        # already in the graph for unchanged resources
+        if not (full or resource.relationships_pending or matched):
+            continue
+
+        cmd, kwargs = relationship_query(relationship)
+        commands.append((cmd, kwargs, matched))
+
+    return commands
+
+
+def run_relationships(
+    session: Any,
+    commands: List[Tuple[str, Dict[str, Any], bool]],
+    deferred: Optional[List[Tuple[str, Dict[str, Any]]]] = None,
+) -> None:
+    for cmd, kwargs, matched in commands:
+        # Relationships matched through a query can only be generated once
+        # every node, including those created by other relationships,
+        # exists.
+        if deferred is not None and matched:
+            deferred.append((cmd, kwargs))
+            continue
+
+        logger.debug(f"Starting neo4j query: {cmd}, {kwargs}")
+        session.run(cmd, kwargs)
 
 
 def relationship_generator(
     driver: BoltDriver,
     initial: bool,
     resource: Resource,
+    deferred: Optional[List[Tuple[str, Dict[str, Any]]]] = None,
+    full: bool = True,
 ):
     with driver.session() as session:
-        logger.info(f"Generating relationships for {resource}")
-        for source, relationship, target in resource.relationships(initial):
-            if isinstance(source, Resource):
-                src_cmd, src_kwargs = get(source, prefix="src")
-            else:
-                src_cmd = source[0].format(prefix="src")
-                src_kwargs = {f"src_{key}": value for key, value in source[1].items()}
+        run_relationships(
+            session,
+            relationship_commands(resource, initial, full),
+            deferred,
+        )
 
-            if isinstance(target, Resource):
-                dst_cmd, dst_kwargs = get(target, prefix="dst")
-            else:
-                dst_cmd = target[0].format(prefix="dst")
-                dst_kwargs = {f"dst_{key}": value for key, value in target[1].items()}
 
-            cmd = src_cmd + "WITH src " + dst_cmd
+def batch_lookups(
+    batch: List[Dict[str, Any]],
+    found: Dict[Tuple[Any, ...], Optional[Dict[str, Any]]],
+) -> Dict[Tuple[Any, ...], Dict[str, Any]]:
+    """Resources looked up building the models of a batch, see `lookups`.
 
-            if isinstance(relationship, str):
-                relationship = [relationship]
-            cmd += "".join(f"MERGE (src)-[:{x}]->(dst) " for x in relationship)
+    Each is found once in `found`, shared between batches.
+    """
+    lookups = {}
 
-            kwargs = {**src_kwargs, **dst_kwargs}
-            logger.debug(f"Starting neo4j query: {cmd}, {kwargs}")
-            session.run(cmd, kwargs)
+    for props in batch:
+        kind_class = Resource.get_kind_class(props.get("apiVersion", ""), props["kind"])
+        for resource, kwargs in kind_class.lookups(props):
+            key = lookup_key(resource, **kwargs)
+            if key not in found:
+                found[key] = find_props(resource, **kwargs)  # type: ignore[arg-type]
+            result = found[key]
+            if result is not None:
+                lookups[key] = result
 
+    return lookups
 
-def generate_relationships(threaded: bool = False) -> None:
-    logger.info("Generating relationships")
-    logger.info("Fetching resources from neo4j")
-    driver = get_driver()
-    resources = find()
-    logger.info("Fetched resources from neo4j")
-    generator = partial(relationship_generator, driver, True)
 
-    if threaded:
-        with ThreadPoolExecutor() as exc:
-            exc.map(generator, resources)
-    else:
-        print("First pass for relationships")
-        for resource in tqdm(resources):
-            generator(resource)
-        print("")
+def batch_relationships(
+    resource: Optional[Type[Resource]],
+    batch: List[Dict[str, Any]],
+    lookups: Dict[Tuple[Any, ...], Dict[str, Any]],
+    full: bool = True,
+) -> List[Tuple[str, Dict[str, Any], bool]]:
+    """Relationship queries for a batch from `find_batches`, in a worker."""
+    current_session.get().lookups = lookups
+    return [
+        command
+        for x in load_resources(resource, batch)
+        for command in relationship_commands(x, False, full)
+    ]
 
-    # Do a second loop across relationships to handle objects created as part
-    # of other relationships
 
-    resources = find()
-    generator = partial(relationship_generator, driver, False)
+def remaining_kinds(exclude: List[str]) -> List[str]:
+    kwargs = cluster_filter()
+    labels = ", ".join(f"{key}: ${key}" for key in kwargs)
 
-    if threaded:
-        with ThreadPoolExecutor() as exc:
-            exc.map(generator, resources)
-    else:
-        print("Second pass for relationships")
-        for resource in tqdm(resources):
-            generator(resource)
-        print("")
+    with get_driver().session() as session:
+        result = session.run(
+            f"MATCH (x:Resource {{ {labels} }}) WHERE NOT x.kind IN $exclude "
+            "RETURN DISTINCT x.kind AS kind",
+            {**kwargs, "exclude": exclude},
+        )
+        return sorted(x["kind"] for x in result)
+
+
+def relationship_stage_kinds() -> (
+    Iterator[List[Tuple[str, Optional[Type[Resource]], Dict[str, Any]]]]
+):
+    """The kinds in each stage, with the model and properties to find them by.
 
+    Kinds outside RELATIONSHIP_STAGES are found by their kind in a final
+    stage, so that each can be checkpointed.
+    """
+    processed: List[str] = []
 
-def remove_attack_paths() -> None:
+    for stage in RELATIONSHIP_STAGES:
+        yield [(kind, Resource.get_kind_class("", kind), {}) for kind in stage]
+        processed += stage
+
+    yield [(kind, None, {"kind": kind}) for kind in remaining_kinds(processed)]
+
+
+def match_pending() -> Tuple[str, Dict[str, str]]:
+    """Match nodes written since relationships were last generated."""
+    kwargs = cluster_filter()
+    labels = ["relationships_pending: true"] + [f"{key}: ${key}" for key in kwargs]
+    return f"MATCH (x:Resource {{ {', '.join(labels)} }}) ", kwargs
+
+
+def pending_relationships() -> bool:
+    cmd, kwargs = match_pending()
+
+    with get_driver().session() as session:
+        return session.run(cmd + "RETURN x LIMIT 1", kwargs).single() is not None
+
+
+def clear_stale_relationships() -> None:
+    """Delete the relationships of resources written since the last run.
+
+    Relationships are only MERGEd, so those of a changed resource which no
+    longer apply would otherwise remain. Either end may have generated a
+    relationship, so the other end is marked pending too, and generates its
+    own again. Attack paths are left to `remove_attack_paths`.
+
+    Resources deleted from the cluster are not removed from the graph, use a
+    new build, or purge, for that.
+    """
+    cmd, kwargs = match_pending()
+    params: Dict[str, Any] = {**kwargs}
+
+    # Mark the other ends apart from pending nodes until every relationship
+    # is deleted, so their own relationships are kept
+    delete_batched(
+        cmd + "MATCH (x)-[r]-(y:Resource) WHERE NOT EXISTS (r.attack_path) ",
+        "r",
+        carry=["y"],
+        update="SET y.relationships_stale = true",
+        **params,
+    )
+
+    labels = ", ".join(["relationships_stale: true"] + [f"{x}: ${x}" for x in kwargs])
     with get_driver().session() as session:
-        session.run("MATCH ()-[r]-() WHERE EXISTS (r.attack_path) DELETE r")
+        session.run(
+            f"MATCH (x:Resource {{ {labels} }}) "
+            "SET x.relationships_pending = true REMOVE x.relationships_stale",
+            kwargs,
+        ).consume()
+
+
+def mocked_relationships(
+    driver: BoltDriver,
+    deferred: List[Tuple[str, Dict[str, Any]]],
+) -> None:
+    """Generate the relationships of nodes created by other relationships.
+
+    Such nodes, say the ServiceAccount of a Pod which was not enumerated, are
+    created after their kind's stage may have run, so are found by the mark
+    left on creation. Their relationships may in turn create nodes, which
+    are handled in a later batch.
+    """
+    kwargs = cluster_filter()
+    labels = ["relationships_mocked: true"] + [f"{key}: ${key}" for key in kwargs]
+    cmd = (
+        f"MATCH (x:Resource {{ {', '.join(labels)} }}) "
+        "RETURN x, id(x) AS id LIMIT $limit"
+    )
+    params = {**kwargs, "limit": config["neo4j"]["fetch_size"]}
+
+    while True:
+        with driver.session() as session:
+            batch = [(x["id"], dict(x["x"])) for x in session.run(cmd, params)]
+        if not batch:
+            return
+
+        for resource in load_resources(None, [x for _, x in batch]):
+            relationship_generator(driver, False, resource, deferred)
+
+        # Only unmarked once generated, so resuming a failed run generates
+        # them again
+        with driver.session() as session:
+            session.run(
+                "MATCH (x) WHERE id(x) IN $ids REMOVE x.relationships_mocked",
+                ids=[x for x, _ in batch],
+            ).consume()
+
+
+def clear_pending_relationships() -> None:
+    cmd, kwargs = match_pending()
+
+    with get_driver().session() as session:
+        session.run(cmd + "REMOVE x.relationships_pending", kwargs).consume()
+
+
+def process_relationships(
+    pool: ProcessPoolExecutor,
+    processes: int,
+    resource: Optional[Type[Resource]],
+    kwargs: Dict[str, Any],
+    deferred: List[Tuple[str, Dict[str, Any]]],
+    full: bool = False,
+) -> None:
+    """Model resources and build their relationship queries in processes.
+
+    Batches of properties, and the resources their models look up, are read
+    in this process and sent to the workers, which return the queries to run.
+    """
+    found: Dict[Tuple[Any, ...], Optional[Dict[str, Any]]] = {}
+    batches = (
+        (resource, batch, batch_lookups(batch, found), full)
+        for batch in find_batches(resource, hydrate=False, **kwargs)
+    )
+
+    results = bounded_map(pool, batch_relationships, batches, processes * 2)
+
+    # Closed on failure, cancelling the batches still queued
+    with get_driver().session() as session, closing(results):
+        for commands in tqdm(results):
+            run_relationships(session, commands, deferred)
+
+
+def run_deferred(driver: BoltDriver, checkpoint: Checkpoint) -> None:
+    """Run the deferred relationships, a checkpointed chunk at a time.
 
+    Chunks are keyed by the index of their first command, so those completed
+    are skipped when resuming.
+    """
+    idx = 0
+    with driver.session() as session, tqdm() as progress:
+        for chunk in checkpoint.deferred(DEFERRED_CHUNK_SIZE):
+            if not checkpoint.done("deferred", str(idx)):
+                for cmd, kwargs in chunk:
+                    logger.debug(f"Starting neo4j query: {cmd}, {kwargs}")
+                    session.run(cmd, kwargs)
+                checkpoint.complete("deferred", str(idx))
+            idx += len(chunk)
+            progress.update(len(chunk))
 
-def setup_attack_paths() -> None:
-    print("Generating attack paths")
-    for relationship, query in tqdm(attack_paths.items()):
-        with get_driver().session() as session:
-            if isinstance(query, str):
-                query = [query]
-            for q in query:
-                cmd = q + f" MERGE (src)-[:{relationship} {{ attack_path: 1 }}]->(dest)"
 
-                session.run(cmd)
+def generate_relationships(
+    threaded: bool = False,
+    full: bool = False,
+    processes: Optional[int] = None,
+    checkpoint: Optional[Checkpoint] = None,
+) -> None:
+    """Generate relationships in a single pass over every resource.
+
+    Resources are read back and modelled once, in the order of
+    RELATIONSHIP_STAGES, generating their full set of relationships. Those
+    matched through a query are deferred until all other relationships, and
+    so all nodes, exist. Nodes first created by a relationship then have
+    their own relationships generated, see `mocked_relationships`.
+
+    Resources written since relationships were last generated first have
+    their existing relationships deleted, see `clear_stale_relationships`.
+    Unless `full`, only they have all of their relationships generated.
+    Others only have those matched through a query, which may now match new
+    nodes, and nothing is generated when no resource changed.
+
+    With `processes`, by default `config["ingest"]["processes"]`, models are
+    built in that many worker processes rather than this one.
+
+    Each kind, and each chunk of deferred relationships, completed is
+    recorded in `checkpoint` and skipped when resuming.
+    """
+    if checkpoint is None:
+        checkpoint = Checkpoint()
+    if checkpoint.done("relationships"):
+        logger.info("Relationships already generated, skipping")
+        return
+    if not full and not pending_relationships():
+        logger.info("No resources changed, skipping relationships")
+        return
+
+    logger.info("Generating relationships")
+    driver = get_driver()
+
+    if processes is None:
+        processes = config["ingest"]["processes"]
+    pool = process_pool(processes) if processes else None
+
+    if not checkpoint.done("relationships", "stale"):
+        clear_stale_relationships()
+        checkpoint.complete("relationships", "stale")
+
+    print("Generating relationships")
+    try:
+        for stage in relationship_stage_kinds():
+            for kind, resource, kwargs in stage:
+                if checkpoint.done("relationships", kind):
+                    continue
+
+                deferred: List[Tuple[str, Dict[str, Any]]] = []
+                generator = partial(
+                    relationship_generator,
+                    driver,
+                    False,
+                    deferred=deferred,
+                    full=full,
+                )
+
+                if pool:
+                    process_relationships(
+                        pool,
+                        processes,
+                        resource,
+                        kwargs,
+                        deferred,
+                        full,
+                    )
+                elif threaded:
+                    with ThreadPoolExecutor() as exc:
+                        exc.map(
+                            bound(generator),
+                            find(resource, hydrate=False, **kwargs),
+                        )
+                else:
+                    for x in tqdm(find(resource, hydrate=False, **kwargs)):
+                        generator(x)
+
+                checkpoint.add_deferred(deferred)
+                checkpoint.complete("relationships", kind)
+    finally:
+        if pool:
+            pool.shutdown()
+    print("")
+
+    if not checkpoint.done("relationships", "mocked"):
+        deferred = []
+        mocked_relationships(driver, deferred)
+        checkpoint.add_deferred(deferred)
+        checkpoint.complete("relationships", "mocked")
+
+    print("Generating query based relationships")
+    run_deferred(driver, checkpoint)
     print("")
 
+    clear_pending_relationships()
+    checkpoint.complete("relationships")
+
+
+def enumerate_cluster(
+    context: str,
+    ignore: Optional[List[str]] = None,
+    checkpoint: Optional[Checkpoint] = None,
+) -> None:
+    """Enumerate a kubeconfig context, within its own cluster session."""
+    current = ClusterSession(context)
+    current_session.set(current)
+    current.name = context_name()
+
+    # The kinds served differ between clusters, but schema changes must not
+    # run concurrently
+    with schema_lock:
+        create_indices()
+
+    logger.info(f"Enumerating context {context} as cluster {current.name}")
+    enumerate_resource_kind(ignore, checkpoint)
+    generate_relationships(checkpoint=checkpoint)
+
+
+def enumerate_clusters(
+    contexts: List[str],
+    ignore: Optional[List[str]] = None,
+    workers: Optional[int] = None,
+    checkpoint: Optional[Checkpoint] = None,
+) -> None:
+    """Enumerate several clusters concurrently into one graph.
+
+    Each cluster has its own client, discovery and rate limiter, and is added
+    to the unique identifiers of its nodes. Users and Groups shared between
+    clusters are then linked through Identity nodes.
+    """
+    with ThreadPoolExecutor(max_workers=workers or len(contexts)) as exc:
+        futures = [
+            exc.submit(
+                copy_context().run,
+                enumerate_cluster,
+                context,
+                ignore,
+                checkpoint,
+            )
+            for context in contexts
+        ]
+        for future in futures:
+            future.result()
+
+    link_identities()
+
+
+def link_identities() -> None:
+    """Link Users and Groups with the same name across clusters.
+
+    Built in `system:` identities are specific to each cluster, so are not
+    linked. Identities are only linked within the current build.
+    """
+    build = current_build()
 
-def purge_neo4j() -> None:
     with get_driver().session() as session:
-        session.run("MATCH (x)-[r]-(y) DELETE x, r, y")
-        session.run("MATCH (x) DELETE x")
+        session.run(
+            "MATCH (x) WHERE (x:User OR x:Group) AND EXISTS (x.cluster) "
+            "AND NOT x.name STARTS WITH 'system:' "
+            + ("AND x.build = $build " if build else "")
+            + "WITH x.kind AS kind, x.name AS name, collect(x) AS members "
+            "WHERE size(members) > 1 "
+            "MERGE (i:Identity { kind: kind, name: name"
+            + (", build: $build" if build else "")
+            + " }) WITH i, members UNWIND members AS x "
+            "MERGE (x)-[:SAME_IDENTITY]->(i)",
+            build=build,
+        ).consume()
@@ -0,0 +1,298 @@
+from __future__ import annotations
+
+import logging
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple, Type
+
+from icekube.attack_paths import attack_paths
+from icekube.config import config
+from icekube.kube import api_resources
+from icekube.models import Cluster, Resource, Scope, Signer
+from icekube.models.policyrule import generate_query
+from icekube.neo4j import find_query, get, get_driver
+from neo4j import Session
+from neo4j.exceptions import ClientError
+
+logger = logging.getLogger(__name__)
+
+# Kinds with nodes in the graph which are not listed from the cluster
+VIRTUAL_KINDS: List[Tuple[str, bool]] = [
+    (Cluster.__name__, False),
+    (Scope.__name__, False),
+    (Signer.__name__, False),
+    ("User", False),
+    ("Group", False),
+]
+
+# Properties of the base label matched on by unlabelled queries, see
+# `generate_query` and `match_pending`
+BASE_LABEL_PROPERTIES: List[str] = ["plural", "kind", "relationships_pending"]
+
+UNINDEXED_OPERATORS = ["AllNodesScan", "NodeByLabelScan"]
+
+# Neo4j versions adding statements used below, older servers skip them
+SHOW_CONSTRAINTS_VERSION = (4, 2)
+RELATIONSHIP_INDEX_VERSION = (4, 3)
+
+
+class IndexPlan(NamedTuple):
+    name: str
+    label: str
+    properties: Tuple[str, ...]
+    node_key: bool = False
+    relationship: bool = False
+
+    def create_index(self) -> str:
+        props = ", ".join(f"n.{x}" for x in self.properties)
+        pattern = (
+            f"()-[n:{self.label}]-()" if self.relationship else f"(n:{self.label})"
+        )
+        return f"CREATE INDEX `{self.name}` IF NOT EXISTS FOR {pattern} ON ({props})"
+
+    def create_constraint(self) -> str:
+        props = ", ".join(f"n.{x}" for x in self.properties)
+        return (
+            f"CREATE CONSTRAINT `{self.name}` IF NOT EXISTS "
+            f"ON (n:{self.label}) ASSERT ({props}) IS NODE KEY"
+        )
+
+
+def key_name(kind: str, partition: Tuple[str, ...] = ()) -> str:
+    return "_".join([kind.lower(), *partition, "key"])
+
+
+def template(kind: str, namespaced: bool) -> Resource:
+    """Build an unvalidated instance of the model class for a kind."""
+    resource_class: Type[Resource] = Resource.get_kind_class("", kind)
+    return resource_class.model_construct(
+        apiVersion="v1",
+        kind=kind,
+        name="",
+        plural="",
+        namespace="default" if namespaced else None,
+    )
+
+
+def graph_kinds() -> Dict[str, bool]:
+    kinds: Dict[str, bool] = {}
+
+    for resource in api_resources():
+        if "list" not in resource.verbs:
+            continue
+        kinds[resource.kind] = kinds.get(resource.kind, False) or resource.namespaced
+
+    for kind, namespaced in VIRTUAL_KINDS:
+        kinds.setdefault(kind, namespaced)
+
+    return kinds
+
+
+def index_plan() -> List[IndexPlan]:
+    """Derive the indices and constraints needed by the statements icekube runs.
+
+    - `get` MERGEs on the model's unique identifiers, backed by a node key.
+      Namespaced kinds use a composite index instead, as mocked references
+      may be missing their namespace, which a node key would reject
+    - `find` and `find_or_mock` match a label on name (and namespace)
+    - `generate_query` matches the base label on its plural or kind
+    - `remove_attack_paths` matches each attack path type on attack_path
+
+    When several clusters share the graph, the cluster is part of every key,
+    as is the build with blue/green builds.
+    """
+    plans: List[IndexPlan] = []
+    multi_cluster = config["graph"]["multi_cluster"]
+    blue_green = config["graph"]["blue_green"]
+
+    partition: Tuple[str, ...] = ()
+    if multi_cluster:
+        partition += ("cluster",)
+    if blue_green:
+        partition += ("build",)
+
+    for kind, namespaced in sorted(graph_kinds().items()):
+        identifiers = tuple(
+            x for x in template(kind, namespaced).unique_identifiers if x != "build"
+        )
+        identifiers += partition
+        name = key_name(kind, partition)
+        plans.append(
+            IndexPlan(name, kind, identifiers, node_key=not namespaced),
+        )
+
+        lookup = ("name", "namespace") if namespaced else ("name",)
+        plans.append(IndexPlan(kind.lower(), kind, lookup))
+
+    if multi_cluster:
+        # Identities are shared between clusters, so only keyed by build
+        plans.append(
+            IndexPlan(
+                "_".join(["identity", *partition[1:]]),
+                "Identity",
+                ("kind", "name", *partition[1:]),
+            ),
+        )
+
+    # Builds are found by property when removed, see `collect_garbage`
+    properties = BASE_LABEL_PROPERTIES + (["build"] if blue_green else [])
+    for prop in properties:
+        plans.append(
+            IndexPlan(
+                f"{Resource.__name__.lower()}_{prop}", Resource.__name__, (prop,)
+            ),
+        )
+
+    # Some attack path types are shared with other relationships
+    for relationship in sorted(attack_paths):
+        plans.append(
+            IndexPlan(
+                f"{relationship.lower()}_attack_path",
+                relationship,
+                ("attack_path",),
+                relationship=True,
+            ),
+        )
+
+    return plans
+
+
+def stale_constraints(session: Session, plans: List[IndexPlan]) -> List[str]:
+    """Node key constraints created by icekube which are no longer planned.
+
+    Keys change with the partition, so the keys of a plain run reject the
+    nodes of another cluster or build, and the reverse.
+    """
+    owned = {
+        key_name(kind, partition)
+        for kind in graph_kinds()
+        for partition in [(), ("cluster",), ("build",), ("cluster", "build")]
+    }
+    planned = {x.name for x in plans if x.node_key}
+    existing = [x["name"] for x in session.run("SHOW CONSTRAINTS")]
+
+    return [x for x in existing if x in owned and x not in planned]
+
+
+def server_version(session: Session) -> Tuple[Tuple[int, ...], str]:
+    """Version and edition of the neo4j server, e.g. ((4, 4, 12), "community")."""
+    record = session.run(
+        "CALL dbms.components() YIELD name, versions, edition "
+        "WHERE name = 'Neo4j Kernel' RETURN versions[0] AS version, edition",
+    ).single()
+    if record is None:
+        return (), ""
+
+    version = tuple(
+        int(x) for x in record["version"].split("-")[0].split(".") if x.isdigit()
+    )
+    return version, record["edition"]
+
+
+def create_indices(plans: Optional[List[IndexPlan]] = None) -> None:
+    """Create planned indices and constraints, as far as the server supports.
+
+    Node key constraints are only created on Enterprise edition, others fall
+    back to the equivalent composite index. Stale constraints are only found
+    from neo4j 4.2, and relationship indices only created from 4.3.
+    """
+    if plans is None:
+        plans = index_plan()
+
+    with get_driver().session() as session:
+        version, edition = server_version(session)
+        node_keys = edition == "enterprise"
+        if not node_keys:
+            logger.warning(
+                "Node key constraints need Neo4j Enterprise, concurrent writes "
+                "may create duplicate nodes",
+            )
+
+        if version >= SHOW_CONSTRAINTS_VERSION:
+            for name in stale_constraints(session, plans):
+                logger.info(f"Dropping constraint {name}")
+                session.run(f"DROP CONSTRAINT `{name}` IF EXISTS").consume()
+
+        if version < RELATIONSHIP_INDEX_VERSION:
+            logger.info(
+                "Relationship indices need Neo4j 4.3, removing attack paths "
+                "will scan each relationship type",
+            )
+            plans = [x for x in plans if not x.relationship]
+
+        for plan in plans:
+            if plan.node_key and node_keys:
+                try:
+                    session.run(plan.create_constraint()).consume()
+                    continue
+                except ClientError:
+                    # Such as when existing nodes lack a key property, fall
+                    # back to the equivalent composite index
+                    logger.warning(
+                        "Unable to create node key constraints, concurrent writes "
+                        "may create duplicate nodes",
+                    )
+                    node_keys = False
+
+            session.run(plan.create_index()).consume()
+
+
+def hot_statements() -> List[Tuple[str, Dict[str, Any]]]:
+    """Representative statements for each query shape issued against the graph."""
+    statements: List[Tuple[str, Dict[str, Any]]] = []
+
+    for kind, namespaced in sorted(graph_kinds().items()):
+        resource = template(kind, namespaced)
+        cmd, kwargs = get(resource, "x")
+        statements.append((cmd + "RETURN x", kwargs))
+
+        kwargs = {"name": ""}
+        if namespaced:
+            kwargs["namespace"] = ""
+        resource_class = Resource.get_kind_class("", kind)
+        if resource_class is not Resource:
+            statements.append(
+                (
+                    find_query(
+                        resource_class,
+                        raw=False,
+                        exclude=None,
+                        fields=None,
+                        hydrate=True,
+                        **kwargs,
+                    ),
+                    kwargs,
+                ),
+            )
+
+    query, filters = generate_query({"apiVersion": "v1", "plural": "pods"})
+    statements.append(
+        (
+            query.format(prefix="dst") + " RETURN dst",
+            {f"dst_{key}": value for key, value in filters.items()},
+        ),
+    )
+
+    return statements
+
+
+def plan_operators(plan: Dict[str, Any]) -> List[str]:
+    operators = [plan["operatorType"]]
+    for child in plan.get("children", []):
+        operators += plan_operators(child)
+    return operators
+
+
+def unindexed_statements() -> List[str]:
+    """EXPLAIN each hot statement, returning those not backed by an index."""
+    unindexed: List[str] = []
+
+    with get_driver().session() as session:
+        for cmd, kwargs in hot_statements():
+            plan = session.run(f"EXPLAIN {cmd}", kwargs).consume().plan
+            if not plan:
+                continue
+            operators = plan_operators(plan)
+            logger.debug(f"Plan for {cmd}: {operators}")
+            if any(x.split("@")[0] in UNINDEXED_OPERATORS for x in operators):
+                unindexed.append(cmd)
+
+    return unindexed
@@ -1,109 +1,122 @@
 import logging
 from collections.abc import Iterator
-from typing import Any, Dict, List, Optional, cast
+from typing import Any, Dict, List, NamedTuple, Optional, cast
 
+from icekube.api_client import api_client
+from icekube.config import config as icekube_config
+from icekube.discovery import Discovery, discover
 from icekube.models import APIResource, Resource
+from icekube.models.base import ResourceRecord
+from icekube.pipeline import TaskFailed
+from icekube.profiles import kind_included, namespace_included
+from icekube.ratelimit import get_rate_limiter
+from icekube.sessions import session
 from kubernetes import client, config
 from tqdm import tqdm
 
 logger = logging.getLogger(__name__)
 
-loaded_kube_config = False
-api_resources_cache: Optional[List[APIResource]] = None
-preferred_versions: Dict[str, str] = {}
-
 
 def load_kube_config():
-    global loaded_kube_config
+    current = session()
 
-    if not loaded_kube_config:
-        config.load_kube_config()
-        loaded_kube_config = True
+    if not current.loaded_kube_config:
+        if current.context is None:
+            config.load_kube_config()
+        else:
+            current.configuration = client.Configuration()
+            config.load_kube_config(
+                context=current.context,
+                client_configuration=current.configuration,
+            )
+        current.loaded_kube_config = True
 
 
 def kube_version() -> str:
     load_kube_config()
-    return cast(str, client.VersionApi().get_code().git_version)
+    version = get_rate_limiter().call(client.VersionApi(api_client()).get_code)
+    return cast(str, version.git_version)
 
 
 def context_name() -> str:
     load_kube_config()
-    return cast(str, config.list_kube_config_contexts()[1]["context"]["cluster"])
+    contexts, active = config.list_kube_config_contexts()
+    context = session().context
+    if context is not None:
+        active = next(x for x in contexts if x["name"] == context)
+    return cast(str, active["context"]["cluster"])
 
 
-def api_versions() -> List[str]:
+def context_clusters() -> Dict[str, str]:
+    """The kubeconfig cluster of each context, which names its session."""
+    contexts, _ = config.list_kube_config_contexts()
+    return {x["name"]: x["context"]["cluster"] for x in contexts}
+
+
+def discovery() -> Discovery:
+    current = session()
     load_kube_config()
-    versions = []
 
-    for version in client.CoreApi().get_api_versions().versions:
-        versions.append(f"{version}")
+    if current.discovery is None:
+        host = api_client().configuration.host
+        current.discovery = discover(host, kube_version())
+        current.preferred_versions.update(current.discovery.preferred_versions)
 
-    for api in client.ApisApi().get_api_versions().groups:
-        preferred_versions[api.name] = api.preferred_version.version
-        for v in api.versions:
-            versions.append(f"{api.name}/{v.version}")
+    return current.discovery
 
-    return sorted(versions)
+
+def api_versions() -> List[str]:
+    return sorted(discovery().versions)
 
 
 def api_resources() -> List[APIResource]:
-    global api_resources_cache
+    current = session()
     load_kube_config()
 
-    if api_resources_cache is not None:
-        return api_resources_cache
+    if current.api_resources_cache is not None:
+        return current.api_resources_cache
 
     try:
-        versions = api_versions()
+        items = discovery().resources
     except Exception:
         logger.error("Failed to access Kubernetes cluster")
-        api_resources_cache = []
-        return api_resources_cache
+        current.api_resources_cache = []
+        return current.api_resources_cache
+
+    preferred_versions = current.preferred_versions
 
     resources: List[APIResource] = []
 
-    for version in versions:
+    for item in items:
+        version = item["groupVersion"]
         if "/" in version:
             group, vers = version.split("/")
-            resp = client.CustomObjectsApi().list_cluster_custom_object(
-                group,
-                vers,
-                "",
-            )
             preferred = preferred_versions[group] == vers
         else:
-            resp = client.CoreV1Api().get_api_resources()
             preferred = True
-            resp = resp.to_dict()
-        for item in resp["resources"]:
-            # if "/" in item["name"]:
-            #     continue
-            # if not any(x in item["verbs"] for x in ["get", "list"]):
-            #     continue
-
-            additional_verbs = {
-                "roles": ["bind", "escalate"],
-                "clusterroles": ["bind", "escalate"],
-                "serviceaccounts": ["impersonate"],
-                "users": ["impersonate"],
-                "groups": ["impersonate"],
-            }
-
-            if item["name"] in additional_verbs.keys():
-                item["verbs"] = list(
-                    set(item["verbs"] + additional_verbs[item["name"]]),
-                )
-
-            resources.append(
-                APIResource(
-                    name=item["name"],
-                    namespaced=item["namespaced"],
-                    group=version,
-                    kind=item["kind"],
-                    preferred=preferred,
-                    verbs=item["verbs"],
-                ),
-            )
+
+        additional_verbs = {
+            "roles": ["bind", "escalate"],
+            "clusterroles": ["bind", "escalate"],
+            "serviceaccounts": ["impersonate"],
+            "users": ["impersonate"],
+            "groups": ["impersonate"],
+        }
+
+        verbs = item["verbs"]
+        if item["name"] in additional_verbs.keys():
+            verbs = list(set(verbs + additional_verbs[item["name"]]))
+
+        resources.append(
+            APIResource(
+                name=item["name"],
+                namespaced=item["namespaced"],
+                group=version,
+                kind=item["kind"],
+                preferred=preferred,
+                verbs=verbs,
+            ),
+        )
 
     if not any(x.name == "users" for x in resources):
         resources.append(
@@ -141,25 +154,64 @@ def api_resources() -> List[APIResource]:
             )
         )
 
-    api_resources_cache = resources
+    current.api_resources_cache = resources
     return resources
 
 
-def all_resources(
+def api_resource_for_kind(kind: str) -> Optional[APIResource]:
+    """The API resource for a kind, at its group's preferred version."""
+    current = session()
+
+    if current.kind_resources_cache is None:
+        kinds: Dict[str, APIResource] = {}
+        for x in api_resources():
+            if x.kind in kinds:
+                continue
+            if "/" in x.group:
+                group, version = x.group.split("/")
+                if current.preferred_versions[group] != version:
+                    continue
+            kinds[x.kind] = x
+        current.kind_resources_cache = kinds
+
+    return current.kind_resources_cache.get(kind)
+
+
+class ListTask(NamedTuple):
+    """A list call for a kind, within a namespace when namespaced."""
+
+    resource: APIResource
+    namespace: Optional[str] = None
+
+    def __str__(self) -> str:
+        if self.namespace:
+            return f"{self.resource.name} in {self.namespace}"
+        return self.resource.name
+
+    @property
+    def key(self) -> str:
+        return f"{self.resource.group}/{self.resource.name}/{self.namespace or ''}"
+
+
+def list_tasks(
     preferred_versions_only: bool = True,
     ignore: Optional[List[str]] = None,
-) -> Iterator[Resource]:
+) -> List[ListTask]:
+    """Every list call needed to enumerate the cluster."""
     load_kube_config()
 
     if ignore is None:
         ignore = []
 
+    namespaces = get_rate_limiter().call(
+        client.CoreV1Api(api_client()).list_namespace,
+    )
     all_namespaces: List[str] = [
-        x.metadata.name for x in client.CoreV1Api().list_namespace().items
+        x.metadata.name for x in namespaces.items if namespace_included(x.metadata.name)
     ]
 
-    print("Enumerating Kubernetes resources")
-    for resource_kind in tqdm(api_resources()):
+    tasks: List[ListTask] = []
+    for resource_kind in api_resources():
         if "list" not in resource_kind.verbs:
             continue
 
@@ -169,28 +221,67 @@ def all_resources(
         if resource_kind.name in ignore:
             continue
 
-        logger.info(f"Fetching {resource_kind.name} resources")
+        if not kind_included(resource_kind.kind):
+            continue
+
+        if resource_kind.namespaced:
+            tasks += [ListTask(resource_kind, ns) for ns in all_namespaces]
+        else:
+            tasks.append(ListTask(resource_kind))
+
+    return tasks
+
+
+def fetch_task(task: ListTask) -> Optional[bytes]:
+    """The list response for a task, or None when it is forbidden or missing.
+
+    Any other API error raises `TaskFailed`, so the task is not checkpointed
+    and is fetched again on resume.
+    """
+    logger.info(f"Fetching {task} resources")
+    resource_class = Resource.get_kind_class(task.resource.group, task.resource.kind)
+
+    try:
+        return resource_class.fetch_list(
+            task.resource.group,
+            task.resource.name,
+            task.namespace,
+            icekube_config["enumeration"]["label_selector"],
+            resource_class.fetch_mode(),
+        )
+    except client.exceptions.ApiException as e:
+        logger.error(f"Failed to retrieve {task}: {e.status}")
+        if e.status in (403, 404):
+            return None
+        raise TaskFailed(str(task)) from e
+
+
+def parse_task(task: ListTask, body: bytes) -> List[ResourceRecord]:
+    resource_class = Resource.get_kind_class(task.resource.group, task.resource.kind)
+    records = resource_class.records_from_list(
+        task.resource.group,
+        task.resource.kind,
+        task.resource.name,
+        task.namespace,
+        resource_class.parse_list(body),
+    )
+    return [x for x in records if x.kind != "Namespace" or namespace_included(x.name)]
+
+
+def all_resources(
+    preferred_versions_only: bool = True,
+    ignore: Optional[List[str]] = None,
+) -> Iterator[ResourceRecord]:
+    tasks = list_tasks(preferred_versions_only, ignore)
+
+    print("Enumerating Kubernetes resources")
+    for task in tqdm(tasks):
         try:
-            resource_class = Resource.get_kind_class(
-                resource_kind.group,
-                resource_kind.kind,
-            )
-            if resource_kind.namespaced:
-                for ns in all_namespaces:
-                    yield from resource_class.list(
-                        resource_kind.group,
-                        resource_kind.kind,
-                        resource_kind.name,
-                        ns,
-                    )
-            else:
-                yield from resource_class.list(
-                    resource_kind.group,
-                    resource_kind.kind,
-                    resource_kind.name,
-                )
-        except client.exceptions.ApiException:
-            logger.error(f"Failed to retrieve {resource_kind.name}")
+            body = fetch_task(task)
+        except TaskFailed:
+            continue
+        if body is not None:
+            yield from parse_task(task, body)
     print("")
 
 
@@ -199,6 +290,6 @@ def metadata_download() -> Dict[str, Any]:
         "kube_version": kube_version(),
         "context_name": context_name(),
         "api_versions": api_versions(),
-        "preferred_versions": preferred_versions,
+        "preferred_versions": session().preferred_versions,
         "api_resources": [x.dict() for x in api_resources()],
     }
@@ -1,6 +1,26 @@
 import logging
+from typing import TextIO
 
-from tqdm.contrib.logging import _TqdmLoggingHandler, std_tqdm
+
+class TqdmLoggingHandler(logging.Handler):
+    # Same as tqdm.contrib.logging's handler, which pulls in asyncio through
+    # tqdm.auto and adds ~25ms to every command's startup
+    def __init__(self, stream: TextIO):
+        super().__init__()
+        self.stream = stream
+
+    def emit(self, record: logging.LogRecord) -> None:
+        # Only imported once something is logged, as commands not showing
+        # progress otherwise never need it
+        from tqdm import tqdm
+
+        try:
+            tqdm.write(self.format(record), file=self.stream)
+            self.stream.flush()
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except Exception:
+            self.handleError(record)
 
 
 def build_logger(debug_level=logging.DEBUG):
@@ -15,9 +35,8 @@ def build_logger(debug_level=logging.DEBUG):
     ch.setFormatter(formatter)
 
     # tell tqdm about the handler
-    tqdm_handler = _TqdmLoggingHandler(std_tqdm)
+    tqdm_handler = TqdmLoggingHandler(ch.stream)
     tqdm_handler.setFormatter(formatter)
-    tqdm_handler.stream = ch.stream
 
     # add the handlers to the logger
     logger.addHandler(tqdm_handler)
@@ -5,11 +5,13 @@ from icekube.models.base import Resource
 from icekube.models.cluster import Cluster
 from icekube.models.clusterrole import ClusterRole
 from icekube.models.clusterrolebinding import ClusterRoleBinding
+from icekube.models.configmap import ConfigMap
 from icekube.models.group import Group
 from icekube.models.namespace import Namespace
 from icekube.models.pod import Pod
 from icekube.models.role import Role
 from icekube.models.rolebinding import RoleBinding
+from icekube.models.scope import Scope
 from icekube.models.secret import Secret
 from icekube.models.securitycontextconstraints import (
     SecurityContextConstraints,
@@ -39,11 +41,13 @@ __all__ = [
     "Cluster",
     "ClusterRole",
     "ClusterRoleBinding",
+    "ConfigMap",
     "Group",
     "Namespace",
     "Pod",
     "Role",
     "RoleBinding",
+    "Scope",
     "Secret",
     "SecurityContextConstraints",
     "ServiceAccount",
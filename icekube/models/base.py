@@ -2,23 +2,65 @@ from __future__ import annotations
 
 import json
 import logging
+import sys
 import traceback
-from typing import Any, Dict, List, Optional, Tuple, Type, Union
-
-from icekube.utils import to_camel_case
-from kubernetes import client
-from pydantic import BaseModel, Field, root_validator
+from typing import (
+    Any,
+    ClassVar,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+    Type,
+    Union,
+    cast,
+)
+
+from icekube.api_client import get_raw
+from icekube.builds import current_build
+from icekube.config import config
+from icekube.sessions import current_cluster
+from pydantic import BaseModel, ConfigDict, Field, root_validator
 
 logger = logging.getLogger(__name__)
 
+# Accept headers for each fetch mode, servers not supporting partial
+# responses fall back to returning full objects
+LIST_ACCEPT = {
+    "full": "application/json",
+    "metadata": "application/json;as=PartialObjectMetadataList;v=v1;g=meta.k8s.io,"
+    "application/json",
+    "table": "application/json;as=Table;v=v1;g=meta.k8s.io,application/json",
+}
+
 
 class Resource(BaseModel):
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
     apiVersion: str = Field(default=...)
     kind: str = Field(default=...)
     name: str = Field(default=...)
     plural: str = Field(default=...)
     namespace: Optional[str] = Field(default=None)
     raw: Optional[str] = Field(default=None)
+    # Only set when enumerating several clusters into one graph
+    cluster: Optional[str] = Field(default=None)
+    # Set on nodes written since relationships were last generated
+    relationships_pending: bool = Field(default=False)
+
+    # Whether the model's validators parse raw, which is otherwise not read
+    # back from neo4j unless requested
+    parses_raw: ClassVar[bool] = False
+    # Whether db_labels differ from those of the base model, requiring the
+    # model to be built for enumerated resources of this kind
+    labels_from_model: ClassVar[bool] = False
+    # Top level fields read from raw alongside metadata, or None when the
+    # full object is needed. Decides how the kind is fetched, see `fetch_mode`.
+    # Kinds are fetched in full, and so stored in full, unless their model opts
+    # in to less
+    required_fields: ClassVar[Optional[List[str]]] = None
+    # Server side table columns providing required fields, by field
+    table_columns: ClassVar[Dict[str, str]] = {}
 
     def __new__(cls, **kwargs):
         kind_class = cls.get_kind_class(
@@ -37,34 +79,33 @@ class Resource(BaseModel):
         return self.__repr__()
 
     def __eq__(self, other) -> bool:
-        comparison_points = ["apiVersion", "kind", "namespace", "name"]
+        comparison_points = ["apiVersion", "kind", "namespace", "name", "cluster"]
 
         return all(getattr(self, x) == getattr(other, x) for x in comparison_points)
 
     @root_validator(pre=True)
     def inject_missing_required_fields(cls, values):
+        if "cluster" not in values:
+            values["cluster"] = current_cluster()
+        return cls.fill_required_fields(values)
+
+    @classmethod
+    def fill_required_fields(cls, values: Dict[str, Any]) -> Dict[str, Any]:
         if not all(x in values for x in ["apiVersion", "kind", "plural"]):
-            from icekube.kube import api_resources, preferred_versions
-
-            test_kind = values.get("kind", cls.__name__)  # type: ignore
-
-            for x in api_resources():
-                if x.kind == test_kind:
-                    if "/" in x.group:
-                        group, version = x.group.split("/")
-                        if preferred_versions[group] != version:
-                            continue
-                    api_resource = x
-                    break
-            else:
+            from icekube.kube import api_resource_for_kind
+
+            test_kind = values.get("kind", cls.__name__)
+
+            api_resource = api_resource_for_kind(test_kind)
+            if api_resource is None:
                 # Nothing found, setting them to blank
 
                 def get_value(field):
                     if field in values:
                         return values[field]
 
-                    if cls.__fields__[field].default:
-                        return cls.__fields__[field].default
+                    if cls.model_fields[field].default:
+                        return cls.model_fields[field].default
 
                     if field == "kind":
                         return test_kind
@@ -88,6 +129,39 @@ class Resource(BaseModel):
 
         return values
 
+    @classmethod
+    def lookups(
+        cls,
+        values: Dict[str, Any],
+    ) -> List[Tuple[Type[Resource], Dict[str, Optional[str]]]]:
+        """Resources found by `find_or_mock` while building a model from values.
+
+        Worker processes building models are given these, found beforehand by
+        the parent, rather than each connecting to neo4j.
+        """
+        return []
+
+    @classmethod
+    def reference(cls, **kwargs: Optional[str]) -> ResourceRef:
+        """Reference a resource without building its model."""
+        kind_class = cls.get_kind_class(
+            kwargs.get("apiVersion") or "",
+            kwargs.get("kind") or cls.__name__,
+        )
+        values = kind_class.fill_required_fields(dict(kwargs))
+        identifiers = cluster_scoped(
+            kind_class.identifiers(
+                values["apiVersion"],
+                values["kind"],
+                values["name"],
+                values.get("namespace"),
+                values["plural"],
+            ),
+            values.get("cluster") or current_cluster(),
+        )
+
+        return ResourceRef(values["kind"], tuple(identifiers.items()))
+
     @classmethod
     def get_kind_class(cls, apiVersion: str, kind: str) -> Type[Resource]:
         subclasses = {x.__name__: x for x in cls.__subclasses__()}
@@ -111,18 +185,38 @@ class Resource(BaseModel):
         else:
             return self.plural
 
-    @property
-    def unique_identifiers(self) -> Dict[str, str]:
+    @classmethod
+    def identifiers(
+        cls,
+        apiVersion: str,
+        kind: str,
+        name: str,
+        namespace: Optional[str],
+        plural: str,
+    ) -> Dict[str, str]:
         ident = {
-            "apiGroup": self.api_group,
-            "apiVersion": self.apiVersion,
-            "kind": self.kind,
-            "name": self.name,
+            "apiGroup": apiVersion.split("/")[0] if "/" in apiVersion else "",
+            "apiVersion": apiVersion,
+            "kind": kind,
+            "name": name,
         }
-        if self.namespace:
-            ident["namespace"] = self.namespace
+        if namespace:
+            ident["namespace"] = namespace
         return ident
 
+    @property
+    def unique_identifiers(self) -> Dict[str, str]:
+        return cluster_scoped(
+            self.identifiers(
+                self.apiVersion,
+                self.kind,
+                self.name,
+                self.namespace,
+                self.plural,
+            ),
+            self.cluster,
+        )
+
     @property
     def db_labels(self) -> Dict[str, Any]:
         return {
@@ -139,47 +233,45 @@ class Resource(BaseModel):
         name: str,
         namespace: Optional[str] = None,
     ) -> List[Resource]:
-        try:
-            group, version = apiVersion.split("/")
-        except ValueError:
-            # Core v1 API
-            group = None
-            version = apiVersion
-        resources: List[Resource] = []
-        if group:
-            if namespace:
-                resp = client.CustomObjectsApi().list_namespaced_custom_object(
-                    group,
-                    version,
-                    namespace,
-                    name,
-                )
-            else:
-                resp = client.CustomObjectsApi().list_cluster_custom_object(
-                    group,
-                    version,
-                    name,
-                )
-        else:
-            if namespace:
-                func = f"list_namespaced_{to_camel_case(kind)}"
-                resp = json.loads(
-                    getattr(client.CoreV1Api(), func)(
-                        namespace, _preload_content=False
-                    ).data
-                )
-            else:
-                func = f"list_{to_camel_case(kind)}"
-                resp = json.loads(
-                    getattr(client.CoreV1Api(), func)(_preload_content=False).data
-                )
+        return [
+            x.to_model() for x in cls.list_records(apiVersion, kind, name, namespace)
+        ]
+
+    @classmethod
+    def list_records(
+        cls: Type[Resource],
+        apiVersion: str,
+        kind: str,
+        name: str,
+        namespace: Optional[str] = None,
+        label_selector: Optional[str] = None,
+    ) -> List[ResourceRecord]:
+        resp = cls.list_raw(
+            apiVersion,
+            name,
+            namespace,
+            label_selector,
+            cls.fetch_mode(),
+        )
+        return cls.records_from_list(apiVersion, kind, name, namespace, resp)
+
+    @classmethod
+    def records_from_list(
+        cls: Type[Resource],
+        apiVersion: str,
+        kind: str,
+        name: str,
+        namespace: Optional[str],
+        resp: Dict[str, Any],
+    ) -> List[ResourceRecord]:
+        resources: List[ResourceRecord] = []
 
         for item in resp.get("items", []):
             item["apiVersion"] = apiVersion
             item["kind"] = kind
             try:
                 resources.append(
-                    Resource(
+                    ResourceRecord.build(
                         apiVersion=apiVersion,
                         kind=kind,
                         name=item["metadata"]["name"],
@@ -198,6 +290,78 @@ class Resource(BaseModel):
 
         return resources
 
+    @classmethod
+    def fetch_mode(cls) -> str:
+        """How resources of this kind are listed.
+
+        - `full` - complete objects
+        - `metadata` - only metadata, as a `PartialObjectMetadataList`
+        - `table` - metadata, with required fields taken from table columns
+        """
+        if cls.required_fields is None or config["enumeration"]["full_objects"]:
+            return "full"
+        if not cls.required_fields:
+            return "metadata"
+        if all(x in cls.table_columns for x in cls.required_fields):
+            return "table"
+        return "full"
+
+    @classmethod
+    def list_raw(
+        cls: Type[Resource],
+        apiVersion: str,
+        name: str,
+        namespace: Optional[str],
+        label_selector: Optional[str],
+        mode: str,
+    ) -> Dict[str, Any]:
+        return cls.parse_list(
+            cls.fetch_list(apiVersion, name, namespace, label_selector, mode),
+        )
+
+    @classmethod
+    def fetch_list(
+        cls: Type[Resource],
+        apiVersion: str,
+        name: str,
+        namespace: Optional[str],
+        label_selector: Optional[str],
+        mode: str,
+    ) -> bytes:
+        """List resources, returning the response body undecoded."""
+        path = f"/apis/{apiVersion}" if "/" in apiVersion else f"/api/{apiVersion}"
+        if namespace:
+            path += f"/namespaces/{namespace}"
+        path += f"/{name}"
+
+        query: List[Tuple[str, str]] = []
+        if label_selector:
+            query.append(("labelSelector", label_selector))
+        if mode == "table":
+            query.append(("includeObject", "Metadata"))
+
+        return get_raw(path, query, LIST_ACCEPT[mode])
+
+    @classmethod
+    def parse_list(cls: Type[Resource], body: bytes) -> Dict[str, Any]:
+        """Decode a list response, converting tables to items."""
+        data = json.loads(body)
+
+        if data.get("kind") != "Table":
+            # Either a PartialObjectMetadataList or full objects
+            return cast(Dict[str, Any], data)
+
+        columns = [x["name"] for x in data.get("columnDefinitions", [])]
+        items = []
+        for row in data.get("rows") or []:
+            item = {"metadata": (row.get("object") or {}).get("metadata", {})}
+            for field, column in cls.table_columns.items():
+                if column in columns:
+                    item[field] = row["cells"][columns.index(column)]
+            items.append(item)
+
+        return {"items": items}
+
     def relationships(
         self,
         initial: bool = True,
@@ -205,12 +369,12 @@ class Resource(BaseModel):
         logger.debug(
             f"Generating {'initial' if initial else 'second'} set of relationships",
         )
-        from icekube.neo4j import mock
+        from icekube.neo4j import ref
 
         relationships: List[RELATIONSHIP] = []
 
         if self.namespace is not None:
-            ns = mock(Resource, name=self.namespace, kind="Namespace")
+            ns = ref(Resource, name=self.namespace, kind="Namespace")
             relationships += [
                 (
                     self,
@@ -222,10 +386,189 @@ class Resource(BaseModel):
         return relationships
 
 
+def cluster_scoped(
+    identifiers: Dict[str, str],
+    cluster: Optional[str],
+) -> Dict[str, str]:
+    """Add the cluster to unique identifiers, when enumerating several clusters.
+
+    The build is also added, when writing blue/green builds.
+    """
+    if cluster:
+        identifiers["cluster"] = cluster
+    build = current_build()
+    if build:
+        identifiers["build"] = build
+    return identifiers
+
+
+class ResourceRecord:
+    """Compact record of an enumerated resource.
+
+    Records are used in place of models through enumeration. Models are only
+    built for kinds with `labels_from_model`, with their labels kept on the
+    record.
+    """
+
+    __slots__ = (
+        "apiVersion",
+        "kind",
+        "name",
+        "namespace",
+        "plural",
+        "raw",
+        "cluster",
+        "labels",
+    )
+
+    def __init__(
+        self,
+        apiVersion: str,
+        kind: str,
+        name: str,
+        plural: str,
+        namespace: Optional[str] = None,
+        raw: Optional[str] = None,
+        cluster: Optional[str] = None,
+    ):
+        self.apiVersion = sys.intern(apiVersion)
+        self.kind = sys.intern(kind)
+        self.name = name
+        self.plural = sys.intern(plural)
+        self.namespace = sys.intern(namespace) if namespace else None
+        self.raw = raw
+        self.cluster = cluster
+        self.labels: Optional[Dict[str, Any]] = None
+
+    @classmethod
+    def build(
+        cls,
+        apiVersion: str,
+        kind: str,
+        name: str,
+        plural: str,
+        namespace: Optional[str] = None,
+        raw: Optional[str] = None,
+    ) -> ResourceRecord:
+        record = cls(apiVersion, kind, name, plural, namespace, raw, current_cluster())
+
+        if Resource.get_kind_class(apiVersion, kind).labels_from_model:
+            model = record.to_model()
+            record.labels = model.db_labels
+            record.raw = model.raw
+
+        return record
+
+    def __repr__(self) -> str:
+        if self.namespace:
+            return f"{self.kind}(namespace='{self.namespace}', name='{self.name}')"
+        else:
+            return f"{self.kind}(name='{self.name}')"
+
+    def to_model(self) -> Resource:
+        return Resource(
+            apiVersion=self.apiVersion,
+            kind=self.kind,
+            name=self.name,
+            namespace=self.namespace,
+            plural=self.plural,
+            raw=self.raw,
+            cluster=self.cluster,
+        )
+
+    @property
+    def api_group(self) -> str:
+        if "/" in self.apiVersion:
+            return self.apiVersion.split("/")[0]
+        else:
+            return ""
+
+    @property
+    def resource_definition_name(self) -> str:
+        if self.api_group:
+            return f"{self.plural}.{self.api_group}"
+        else:
+            return self.plural
+
+    @property
+    def unique_identifiers(self) -> Dict[str, str]:
+        kind_class = Resource.get_kind_class(self.apiVersion, self.kind)
+        return cluster_scoped(
+            kind_class.identifiers(
+                self.apiVersion,
+                self.kind,
+                self.name,
+                self.namespace,
+                self.plural,
+            ),
+            self.cluster,
+        )
+
+    @property
+    def db_labels(self) -> Dict[str, Any]:
+        if self.labels is not None:
+            return self.labels
+
+        return {
+            **self.unique_identifiers,
+            "plural": self.plural,
+            "raw": self.raw,
+        }
+
+
+class ResourceRef:
+    """Immutable, hashable reference to a resource by its unique identifiers.
+
+    Used for relationship targets in place of a model, see
+    `Resource.reference`.
+    """
+
+    __slots__ = ("kind", "identifiers")
+
+    kind: str
+    identifiers: Tuple[Tuple[str, str], ...]
+
+    def __init__(self, kind: str, identifiers: Tuple[Tuple[str, str], ...]):
+        object.__setattr__(self, "kind", kind)
+        object.__setattr__(self, "identifiers", identifiers)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __reduce__(self) -> Tuple[Any, ...]:
+        return (type(self), (self.kind, self.identifiers))
+
+    def __hash__(self) -> int:
+        return hash((self.kind, self.identifiers))
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, ResourceRef):
+            return (self.kind, self.identifiers) == (other.kind, other.identifiers)
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        if self.namespace:
+            return f"{self.kind}(namespace='{self.namespace}', name='{self.name}')"
+        else:
+            return f"{self.kind}(name='{self.name}')"
+
+    @property
+    def unique_identifiers(self) -> Dict[str, str]:
+        return dict(self.identifiers)
+
+    @property
+    def name(self) -> str:
+        return self.unique_identifiers["name"]
+
+    @property
+    def namespace(self) -> Optional[str]:
+        return self.unique_identifiers.get("namespace")
+
+
 QUERY_RESOURCE = Tuple[str, Dict[str, str]]
 
 RELATIONSHIP = Tuple[
-    Union[Resource, QUERY_RESOURCE],
+    Union[Resource, ResourceRef, QUERY_RESOURCE],
     Union[str, List[str]],
-    Union[Resource, QUERY_RESOURCE],
+    Union[Resource, ResourceRef, QUERY_RESOURCE],
 ]
@@ -1,5 +1,6 @@
-from typing import Dict, List
+from typing import ClassVar, Dict, List, Optional
 
+from icekube.config import config
 from icekube.models.base import RELATIONSHIP, Resource
 
 
@@ -8,16 +9,24 @@ class Cluster(Resource):
     kind: str = "Cluster"
     apiVersion: str = "N/A"
     plural: str = "clusters"
+    labels_from_model: ClassVar[bool] = True
 
     def __repr__(self) -> str:
         return f"Cluster(name='{self.name}', version='{self.version}')"
 
-    @property
-    def unique_identifiers(self) -> Dict[str, str]:
+    @classmethod
+    def identifiers(
+        cls,
+        apiVersion: str,
+        kind: str,
+        name: str,
+        namespace: Optional[str],
+        plural: str,
+    ) -> Dict[str, str]:
         return {
-            "name": self.name,
-            "kind": self.kind,
-            "apiVersion": self.apiVersion,
+            "name": name,
+            "kind": kind,
+            "apiVersion": apiVersion,
         }
 
     @property
@@ -30,7 +39,12 @@ class Cluster(Resource):
     ) -> List[RELATIONSHIP]:
         relationships = super().relationships()
 
-        query = "MATCH (src) WHERE NOT src:Cluster "
+        # With scoped targets, every node is implicitly within the cluster scope
+        if config["graph"]["scoped_targets"]:
+            return relationships
+
+        # Only resources, not bookkeeping nodes such as Meta, Identity or Scope
+        query = "MATCH (src:Resource) WHERE NOT src:Cluster AND NOT src:Scope "
 
         relationships += [((query, {}), "WITHIN_CLUSTER", self)]
 
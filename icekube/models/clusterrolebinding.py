@@ -1,53 +1,71 @@
 from __future__ import annotations
 
 import json
-from typing import Any, Dict, List, Optional, Union
-
-from icekube.models.base import RELATIONSHIP, Resource
+from typing import (
+    Any,
+    ClassVar,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+    Type,
+    Union,
+    cast,
+)
+
+from icekube.models.base import RELATIONSHIP, Resource, ResourceRef
 from icekube.models.clusterrole import ClusterRole
 from icekube.models.group import Group
 from icekube.models.role import Role
 from icekube.models.serviceaccount import ServiceAccount
 from icekube.models.user import User
-from icekube.neo4j import find_or_mock, get_cluster_object, mock
+from icekube.neo4j import find_or_mock, get_cluster_object, ref
 from pydantic import root_validator
 from pydantic.fields import Field
 
 
-def get_role(
+def role_identifiers(
     role_ref: Dict[str, Any],
     namespace: Optional[str] = None,
-) -> Union[ClusterRole, Role]:
+) -> Tuple[Type[Union[ClusterRole, Role]], Dict[str, Optional[str]]]:
     role_ref["kind"] = role_ref.get("kind", "ClusterRole")
     if role_ref["kind"] == "ClusterRole":
-        return find_or_mock(ClusterRole, name=role_ref["name"])
+        return ClusterRole, {"name": role_ref["name"]}
     elif role_ref["kind"] == "Role":
-        return find_or_mock(
-            Role,
-            name=role_ref["name"],
-            namespace=role_ref.get("namespace", namespace),
-        )
+        return Role, {
+            "name": role_ref["name"],
+            "namespace": role_ref.get("namespace", namespace),
+        }
     else:
         raise Exception(f"Unknown RoleRef kind: {role_ref['kind']}")
 
 
+def get_role(
+    role_ref: Dict[str, Any],
+    namespace: Optional[str] = None,
+) -> Union[ClusterRole, Role]:
+    resource, kwargs = role_identifiers(role_ref, namespace)
+    role = find_or_mock(resource, **kwargs)  # type: ignore[arg-type]
+    return cast(Union[ClusterRole, Role], role)
+
+
 def get_subjects(
     subjects: List[Dict[str, Any]],
     namespace: Optional[str] = None,
-) -> List[Union[ServiceAccount, User, Group]]:
-    results: List[Union[ServiceAccount, User, Group]] = []
+) -> List[ResourceRef]:
+    results: List[ResourceRef] = []
 
     if subjects is None:
         return results
 
     for subject in subjects:
         if subject["kind"] in ["SystemUser", "User"]:
-            results.append(User(name=subject["name"]))
+            results.append(ref(User, name=subject["name"]))
         elif subject["kind"] in ["SystemGroup", "Group"]:
-            results.append(Group(name=subject["name"]))
+            results.append(ref(Group, name=subject["name"]))
         elif subject["kind"] == "ServiceAccount":
             results.append(
-                mock(
+                ref(
                     ServiceAccount,
                     name=subject["name"],
                     namespace=subject.get("namespace", namespace),
@@ -61,7 +79,9 @@ def get_subjects(
 
 class ClusterRoleBinding(Resource):
     role: Union[ClusterRole, Role]
-    subjects: List[Union[ServiceAccount, User, Group]] = Field(default_factory=list)
+    subjects: List[ResourceRef] = Field(default_factory=list)
+    parses_raw: ClassVar[bool] = True
+    required_fields: ClassVar[Optional[List[str]]] = ["roleRef", "subjects"]
 
     @root_validator(pre=True)
     def inject_role_and_subjects(cls, values):
@@ -77,6 +97,14 @@ class ClusterRoleBinding(Resource):
 
         return values
 
+    @classmethod
+    def lookups(
+        cls,
+        values: Dict[str, Any],
+    ) -> List[Tuple[Type[Resource], Dict[str, Optional[str]]]]:
+        role_ref = json.loads(values.get("raw") or "{}").get("roleRef")
+        return [role_identifiers(role_ref)] if role_ref else []
+
     def relationships(
         self,
         initial: bool = True,
@@ -0,0 +1,10 @@
+from __future__ import annotations
+
+from typing import ClassVar, List, Optional
+
+from icekube.models.base import Resource
+
+
+class ConfigMap(Resource):
+    # Only matched by name, so their data is never downloaded
+    required_fields: ClassVar[Optional[List[str]]] = []
@@ -1,13 +1,24 @@
 from __future__ import annotations
 
-from typing import Dict
+from typing import ClassVar, Dict, Optional
 
 from icekube.models.base import Resource
 
 
 class Group(Resource):
     plural: str = "groups"
+    labels_from_model: ClassVar[bool] = True
 
-    @property
-    def unique_identifiers(self) -> Dict[str, str]:
-        return {**super().unique_identifiers, "plural": self.plural}
+    @classmethod
+    def identifiers(
+        cls,
+        apiVersion: str,
+        kind: str,
+        name: str,
+        namespace: Optional[str],
+        plural: str,
+    ) -> Dict[str, str]:
+        return {
+            **super().identifiers(apiVersion, kind, name, namespace, plural),
+            "plural": plural,
+        }
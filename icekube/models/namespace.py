@@ -1,7 +1,9 @@
 from __future__ import annotations
 
+from typing import ClassVar, List, Optional
+
 from icekube.models.base import Resource
 
 
 class Namespace(Resource):
-    ...
+    required_fields: ClassVar[Optional[List[str]]] = []
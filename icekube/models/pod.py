@@ -1,240 +1,211 @@
 from __future__ import annotations
 
 import json
-from itertools import product
-from pathlib import Path
-from typing import Any, Dict, List, Optional, cast
+from pathlib import PurePosixPath
+from typing import Any, ClassVar, Dict, Iterable, List, Optional, Set, cast
 
-from icekube.models.base import RELATIONSHIP, Resource
+from icekube.capabilities import CAPABILITIES, CAPABILITY_BITS
+from icekube.models.base import RELATIONSHIP, Resource, ResourceRef
 from icekube.models.node import Node
 from icekube.models.secret import Secret
 from icekube.models.serviceaccount import ServiceAccount
-from icekube.neo4j import mock
+from icekube.neo4j import ref
 from pydantic import root_validator
 
-CAPABILITIES = [
-    "AUDIT_CONTROL",
-    "AUDIT_READ",
-    "AUDIT_WRITE",
-    "BLOCK_SUSPEND",
-    "BPF",
-    "CHECKPOINT_RESTORE",
-    "CHOWN",
-    "DAC_OVERRIDE",
-    "DAC_READ_SEARCH",
-    "FOWNER",
-    "FSETID",
-    "IPC_LOCK",
-    "IPC_OWNER",
-    "KILL",
-    "LEASE",
-    "LINUX_IMMUTABLE",
-    "MAC_ADMIN",
-    "MAC_OVERRIDE",
-    "MKNOD",
-    "NET_ADMIN",
-    "NET_BIND_SERVICE",
-    "NET_BROADCAST",
-    "NET_RAW",
-    "PERFMON",
-    "SETFCAP",
-    "SETGID",
-    "SETPCAP",
-    "SETUID",
-    "SYSLOG",
-    "SYS_ADMIN",
-    "SYS_BOOT",
-    "SYS_CHROOT",
-    "SYS_MODULE",
-    "SYS_NICE",
-    "SYS_PACCT",
-    "SYS_PTRACE",
-    "SYS_RAWIO",
-    "SYS_RESOURCE",
-    "SYS_TIME",
-    "SYS_TTY_CONFIG",
-    "WAKE_ALARM",
+CONTAINER_TYPES = ["containers", "initContainers", "ephemeralContainers"]
+
+# Dangerous paths to check for
+# Not all of these give direct node compromise, but will grant enough
+# permissions to maybe steal certificates to help with API server
+# as the node, or the like
+DANGEROUS_HOST_PATHS = [
+    "/etc/kubernetes/admin.conf",
+    "/etc/kubernetes/kubeconfig",
+    "/etc/shadow",
+    "/proc/sys/kernel",
+    "/root/.kube/config",
+    "/root/.ssh/authorized_keys",
+    "/run/containerd/containerd.sock",
+    "/run/crio/crio.sock",
+    "/run/cri-dockerd.sock",
+    "/run/docker.sock",
+    "/run/dockershim.sock",
+    "/var/lib/kubelet/pods/",
+    "/var/lib/kubernetes/",
+    "/var/lib/minikube/certs/apiserver.key",
+    "/var/log",
+    "/var/run/containerd/containerd.sock",
+    "/var/run/crio/crio.sock",
+    "/var/run/cri-dockerd.sock",
+    "/var/run/docker.sock",
+    "/var/run/dockershim.sock",
 ]
 
 
+class PathTrie:
+    """Prefix trie of paths, by path component."""
+
+    def __init__(self, paths: Iterable[str]):
+        self.root: Dict[str, Any] = {}
+        for path in paths:
+            node = self.root
+            for part in PurePosixPath(path).parts:
+                node = node.setdefault(part, {})
+
+    def contains_prefix(self, path: str) -> bool:
+        """Whether path is, or is a parent directory of, any path in the trie.
+
+        Empty and relative paths never match, as the trie holds absolute paths.
+        """
+        parts = PurePosixPath(path).parts
+        if not parts or parts[0] != "/":
+            return False
+
+        node = self.root
+        for part in parts:
+            if part not in node:
+                return False
+            node = node[part]
+        return True
+
+
+DANGEROUS_HOST_PATH_TRIE = PathTrie(DANGEROUS_HOST_PATHS)
+
+
+class PodFeatures:
+    """Security relevant features of a pod spec, extracted in a single pass."""
+
+    def __init__(self, spec: Dict[str, Any]):
+        self.capabilities: List[str] = []
+        self.capability_mask = 0
+        self.privileged = False
+        self.host_path_volumes: List[str] = []
+        self.dangerous_host_path = False
+        self.secrets: Dict[str, None] = {}
+        # Capabilities not known to CAPABILITIES are kept, but not in the mask
+        self.unknown_capabilities: Set[str] = set()
+
+        for container_type in CONTAINER_TYPES:
+            for container in spec.get(container_type) or []:
+                self.container(container)
+
+        for volume in spec.get("volumes") or []:
+            self.volume(volume)
+
+        self.capabilities = [
+            x for x in CAPABILITIES if self.capability_mask & CAPABILITY_BITS[x]
+        ] + sorted(self.unknown_capabilities)
+
+    def container(self, container: Dict[str, Any]) -> None:
+        context = container.get("securityContext") or {}
+        if context.get("privileged", False):
+            self.privileged = True
+
+        caps = context.get("capabilities") or {}
+        for capability in caps.get("add") or []:
+            capability = capability.upper()
+            # Runtimes accept capabilities with or without the CAP_ prefix
+            if capability.startswith("CAP_"):
+                capability = capability[4:]
+
+            if capability == "ALL":
+                self.capability_mask = (1 << len(CAPABILITIES)) - 1
+            elif capability in CAPABILITY_BITS:
+                self.capability_mask |= CAPABILITY_BITS[capability]
+            else:
+                self.unknown_capabilities.add(capability)
+
+        for env in container.get("env") or []:
+            secret = ((env.get("valueFrom") or {}).get("secretKeyRef") or {}).get(
+                "name",
+            )
+            if secret:
+                self.secrets[secret] = None
+
+        for env_from in container.get("envFrom") or []:
+            secret = (env_from.get("secretRef") or {}).get("name")
+            if secret:
+                self.secrets[secret] = None
+
+    def volume(self, volume: Dict[str, Any]) -> None:
+        host_path = (volume.get("hostPath") or {}).get("path")
+        if host_path is not None:
+            self.host_path_volumes.append(host_path)
+            if DANGEROUS_HOST_PATH_TRIE.contains_prefix(host_path):
+                self.dangerous_host_path = True
+
+        secret = (volume.get("secret") or {}).get("secretName")
+        if secret:
+            self.secrets[secret] = None
+
+        for source in (volume.get("projected") or {}).get("sources") or []:
+            secret = (source.get("secret") or {}).get("name")
+            if secret:
+                self.secrets[secret] = None
+
+        # Secrets passed to CSI drivers, such as the secrets store driver
+        csi = volume.get("csi") or {}
+        secret = (csi.get("nodePublishSecretRef") or {}).get("name")
+        if secret:
+            self.secrets[secret] = None
+
+
 class Pod(Resource):
-    service_account: Optional[ServiceAccount]
-    node: Optional[Node]
+    service_account: Optional[ResourceRef]
+    node: Optional[ResourceRef]
     containers: List[Dict[str, Any]]
     capabilities: List[str]
+    capability_mask: int
     host_path_volumes: List[str]
+    dangerous_host_path: bool
+    mounted_secrets: List[str]
     privileged: bool
     hostPID: bool
     hostNetwork: bool
+    parses_raw: ClassVar[bool] = True
+    required_fields: ClassVar[Optional[List[str]]] = ["spec"]
+    labels_from_model: ClassVar[bool] = True
 
     @root_validator(pre=True)
-    def inject_service_account(cls, values):
-        data = json.loads(values.get("raw", "{}"))
-        sa = data.get("spec", {}).get("serviceAccountName")
+    def inject_spec_features(cls, values):
+        data = json.loads(values.get("raw") or "{}")
+        spec = data.get("spec") or {}
+
+        sa = spec.get("serviceAccountName")
         if sa:
-            values["service_account"] = mock(
+            values["service_account"] = ref(
                 ServiceAccount,
                 name=sa,
                 namespace=values.get("namespace"),
             )
         else:
             values["service_account"] = None
-        return values
 
-    @root_validator(pre=True)
-    def inject_node(cls, values):
-        data = json.loads(values.get("raw", "{}"))
-        node = data.get("spec", {}).get("nodeName")
+        node = spec.get("nodeName")
         if node:
-            values["node"] = mock(Node, name=node)
+            values["node"] = ref(Node, name=node)
         else:
             values["node"] = None
 
-        return values
-
-    @root_validator(pre=True)
-    def inject_containers(cls, values):
-        data = json.loads(values.get("raw", "{}"))
-
-        values["containers"] = data.get("spec", {}).get("containers", [])
-
-        return values
-
-    @root_validator(pre=True)
-    def inject_capabilities(cls, values):
-        data = json.loads(values.get("raw", "{}"))
-
-        containers = data.get("spec", {}).get("containers", [])
-        capabilities = set()
-
-        for container in containers:
-            security_context = container.get("securityContext") or {}
-            caps = security_context.get("capabilities") or {}
-            addl = caps.get("add") or []
-            addl = [x.upper() for x in addl]
-            add = set(addl)
-
-            if "ALL" in add:
-                add.remove("ALL")
-                add.update(set(CAPABILITIES))
-
-            capabilities.update(add)
-
-        values["capabilities"] = list(capabilities)
-
-        return values
-
-    @root_validator(pre=True)
-    def inject_privileged(cls, values):
-        data = json.loads(values.get("raw", "{}"))
-
-        containers = data.get("spec", {}).get("containers", [])
-        privileged = False
-        for container in containers:
-            context = container.get("securityContext") or {}
-
-            if context.get("privileged", False):
-                privileged = True
-
-        values["privileged"] = privileged
-
-        return values
-
-    @root_validator(pre=True)
-    def inject_host_path_volumes(cls, values):
-        data = json.loads(values.get("raw", "{}"))
-        volumes = data.get("spec", {}).get("volumes") or []
-        host_volumes = [x for x in volumes if "hostPath" in x and x["hostPath"]]
-
-        values["host_path_volumes"] = [x["hostPath"]["path"] for x in host_volumes]
-
-        return values
-
-    @root_validator(pre=True)
-    def inject_host_pid(cls, values):
-        data = json.loads(values.get("raw", "{}"))
-
-        values["hostPID"] = data.get("spec", {}).get("hostPID") or False
-
-        return values
-
-    @root_validator(pre=True)
-    def inject_host_network(cls, values):
-        data = json.loads(values.get("raw", "{}"))
-
-        values["hostNetwork"] = data.get("spec", {}).get("hostNetwork") or False
+        features = PodFeatures(spec)
+        values["containers"] = spec.get("containers", [])
+        values["capabilities"] = features.capabilities
+        values["capability_mask"] = features.capability_mask
+        values["privileged"] = features.privileged
+        values["host_path_volumes"] = features.host_path_volumes
+        values["dangerous_host_path"] = features.dangerous_host_path
+        values["mounted_secrets"] = list(features.secrets)
+        values["hostPID"] = spec.get("hostPID") or False
+        values["hostNetwork"] = spec.get("hostNetwork") or False
 
         return values
 
-    @property
-    def dangerous_host_path(self) -> bool:
-        # Dangerous paths to check for
-        # Not all of these give direct node compromise, but will grant enough
-        # permissions to maybe steal certificates to help with API server
-        # as the node, or the like
-        dangerous_paths = [
-            "/etc/kubernetes/admin.conf",
-            "/etc/kubernetes/kubeconfig",
-            "/etc/shadow",
-            "/proc/sys/kernel",
-            "/root/.kube/config",
-            "/root/.ssh/authorized_keys",
-            "/run/containerd/containerd.sock",
-            "/run/containerd/containerd.sock",
-            "/run/crio/crio.sock",
-            "/run/cri-dockerd.sock",
-            "/run/docker.sock",
-            "/run/dockershim.sock",
-            "/var/lib/kubelet/pods/",
-            "/var/lib/kubernetes/",
-            "/var/lib/minikube/certs/apiserver.key",
-            "/var/log",
-            "/var/run/containerd/containerd.sock",
-            "/var/run/containerd/containerd.sock",
-            "/var/run/crio/crio.sock",
-            "/var/run/cri-dockerd.sock",
-            "/var/run/docker.sock",
-            "/var/run/dockershim.sock",
-        ]
-        for volume, test_path in product(self.host_path_volumes, dangerous_paths):
-            try:
-                Path(test_path).relative_to(Path(volume))
-                return True
-            except ValueError:
-                pass
-        return False
-
-    @property
-    def mounted_secrets(self) -> List[str]:
-        if self.raw:
-            data = json.loads(self.raw)
-        else:
-            return []
-
-        secrets = []
-
-        volumes = data.get("spec", {}).get("volumes") or []
-
-        for volume in volumes:
-            if volume.get("secret"):
-                secrets.append(volume["secret"]["secretName"])
-
-        for container in data.get("spec", {}).get("containers") or []:
-            if not container.get("env"):
-                continue
-            for env in container["env"]:
-                try:
-                    secrets.append(env["valueFrom"]["secretKeyRef"]["name"])
-                except (KeyError, TypeError):
-                    pass
-
-        return secrets
-
     @property
     def db_labels(self) -> Dict[str, Any]:
         return {
             **super().db_labels,
             "capabilities": self.capabilities,
+            "capability_mask": self.capability_mask,
             "host_path_volumes": self.host_path_volumes,
             "dangerous_host_path": self.dangerous_host_path,
             "privileged": self.privileged,
@@ -257,7 +228,7 @@ class Pod(Resource):
                 (
                     self,
                     "MOUNTS_SECRET",
-                    mock(Secret, namespace=cast(str, self.namespace), name=secret),
+                    ref(Secret, namespace=cast(str, self.namespace), name=secret),
                 ),
             ]
 
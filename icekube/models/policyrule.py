@@ -6,24 +6,34 @@ from typing import Dict, Iterator, List, Optional, Tuple, Union
 from pydantic import BaseModel
 from pydantic.fields import Field
 
+REGEX_CHARACTERS = set(".^$*+?{}[]\\|()")
+
+
+def is_pattern(value: str) -> bool:
+    return any(x in REGEX_CHARACTERS for x in value)
+
 
 def generate_query(
-    filters: Dict[str, Union[str, List[str]]]
+    filters: Dict[str, Union[str, List[str]]],
 ) -> Tuple[str, Dict[str, str]]:
-    query = "MATCH ({prefix}) WHERE"
+    # Every node carries the base Resource label, allowing its indices to be
+    # used. Literal values are matched by equality for the same reason.
+    query = "MATCH ({prefix}:Resource) WHERE"
     final_filters = {}
     query_parts = []
     for key, value in filters.items():
         if isinstance(value, list):
             part = " OR ".join(
-                f"{{prefix}}.{key} =~ ${{prefix}}_{key}_{idx}"
-                for idx in range(len(value))
+                f"{{prefix}}.{key} {'=~' if is_pattern(v) else '='} "
+                f"${{prefix}}_{key}_{idx}"
+                for idx, v in enumerate(value)
             )
             query_parts.append(f" ({part}) ")
             for idx, v in enumerate(value):
                 final_filters[f"{key}_{idx}"] = v
         else:
-            query_parts.append(f" {{prefix}}.{key} =~ ${{prefix}}_{key} ")
+            operator = "=~" if is_pattern(value) else "="
+            query_parts.append(f" {{prefix}}.{key} {operator} ${{prefix}}_{key} ")
             final_filters[key] = value
     query += "AND".join(query_parts)
     return query, final_filters
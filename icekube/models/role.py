@@ -1,7 +1,7 @@
 from __future__ import annotations
 
 import json
-from typing import List
+from typing import ClassVar, List, Optional
 
 from icekube.models.base import Resource
 from icekube.models.policyrule import PolicyRule
@@ -11,6 +11,8 @@ from pydantic.fields import Field
 
 class Role(Resource):
     rules: List[PolicyRule] = Field(default_factory=list)
+    parses_raw: ClassVar[bool] = True
+    required_fields: ClassVar[Optional[List[str]]] = ["rules"]
 
     @root_validator(pre=True)
     def inject_role(cls, values):
@@ -1,22 +1,25 @@
 from __future__ import annotations
 
 import json
-from typing import List, Union
+from typing import Any, ClassVar, Dict, List, Optional, Tuple, Type, Union
 
-from icekube.models.base import RELATIONSHIP, Resource
+from icekube.models.base import RELATIONSHIP, Resource, ResourceRef
 from icekube.models.clusterrole import ClusterRole
-from icekube.models.clusterrolebinding import get_role, get_subjects
-from icekube.models.group import Group
+from icekube.models.clusterrolebinding import (
+    get_role,
+    get_subjects,
+    role_identifiers,
+)
 from icekube.models.role import Role
-from icekube.models.serviceaccount import ServiceAccount
-from icekube.models.user import User
 from pydantic import root_validator
 from pydantic.fields import Field
 
 
 class RoleBinding(Resource):
     role: Union[ClusterRole, Role]
-    subjects: List[Union[ServiceAccount, User, Group]] = Field(default_factory=list)
+    subjects: List[ResourceRef] = Field(default_factory=list)
+    parses_raw: ClassVar[bool] = True
+    required_fields: ClassVar[Optional[List[str]]] = ["roleRef", "subjects"]
 
     @root_validator(pre=True)
     def inject_role_and_subjects(cls, values):
@@ -34,6 +37,16 @@ class RoleBinding(Resource):
 
         return values
 
+    @classmethod
+    def lookups(
+        cls,
+        values: Dict[str, Any],
+    ) -> List[Tuple[Type[Resource], Dict[str, Optional[str]]]]:
+        role_ref = json.loads(values.get("raw") or "{}").get("roleRef")
+        if not role_ref:
+            return []
+        return [role_identifiers(role_ref, values.get("namespace"))]
+
     def relationships(
         self,
         initial: bool = True,
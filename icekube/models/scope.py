@@ -0,0 +1,26 @@
+from typing import ClassVar, Dict
+
+from icekube.models.base import Resource
+
+
+class Scope(Resource):
+    """A named set of resources targeted as a whole by scoped attack paths.
+
+    Members are not linked to the scope, they are matched when paths are read
+    (see ``icekube.attack_paths.target_scopes``).
+    """
+
+    apiVersion: str = "N/A"
+    kind: str = "Scope"
+    plural: str = "scopes"
+    labels_from_model: ClassVar[bool] = True
+
+    def __repr__(self) -> str:
+        return f"Scope(name={self.name})"
+
+    @property
+    def db_labels(self) -> Dict[str, str]:
+        return {
+            **self.unique_identifiers,
+            "plural": self.plural,
+        }
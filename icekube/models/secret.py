@@ -1,16 +1,20 @@
 from __future__ import annotations
 
 import json
-from typing import Any, Dict, List, cast
+from typing import Any, ClassVar, Dict, List, Optional, cast
 
 from icekube.models.base import RELATIONSHIP, Resource
-from icekube.neo4j import mock
+from icekube.neo4j import ref
 from pydantic import root_validator
 
 
 class Secret(Resource):
     secret_type: str
     annotations: Dict[str, Any]
+    parses_raw: ClassVar[bool] = True
+    labels_from_model: ClassVar[bool] = True
+    required_fields: ClassVar[Optional[List[str]]] = ["type"]
+    table_columns: ClassVar[Dict[str, str]] = {"type": "Type"}
 
     @root_validator(pre=True)
     def remove_secret_data(cls, values):
@@ -44,7 +48,7 @@ class Secret(Resource):
 
             sa = self.annotations.get("kubernetes.io/service-account.name")
             if sa:
-                account = mock(
+                account = ref(
                     ServiceAccount,
                     name=sa,
                     namespace=cast(str, self.namespace),
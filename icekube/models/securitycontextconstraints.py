@@ -1,21 +1,23 @@
 from __future__ import annotations
 
 import json
-from typing import List, Union
+from typing import ClassVar, List, Optional
 
-from icekube.models.base import RELATIONSHIP, Resource
+from icekube.models.base import RELATIONSHIP, Resource, ResourceRef
 from icekube.models.group import Group
 from icekube.models.serviceaccount import ServiceAccount
 from icekube.models.user import User
-from icekube.neo4j import mock
+from icekube.neo4j import ref
 from pydantic import root_validator
 from pydantic.fields import Field
 
 
 class SecurityContextConstraints(Resource):
     plural: str = "securitycontextconstraints"
-    users: List[Union[User, ServiceAccount]] = Field(default_factory=list)
-    groups: List[Group]
+    users: List[ResourceRef] = Field(default_factory=list)
+    groups: List[ResourceRef]
+    parses_raw: ClassVar[bool] = True
+    required_fields: ClassVar[Optional[List[str]]] = ["users", "groups"]
 
     @root_validator(pre=True)
     def inject_users_and_groups(cls, values):
@@ -27,19 +29,19 @@ class SecurityContextConstraints(Resource):
             if user.startswith("system:serviceaccount:"):
                 ns, name = user.split(":")[2:]
                 values["users"].append(
-                    mock(
+                    ref(
                         ServiceAccount,
                         name=name,
                         namespace=ns,
                     ),
                 )
             else:
-                values["users"].append(mock(User, name=user))
+                values["users"].append(ref(User, name=user))
 
         groups = data.get("groups", [])
         values["groups"] = []
         for group in groups:
-            values["groups"].append(mock(Group, name=group))
+            values["groups"].append(ref(Group, name=group))
 
         return values
 
@@ -1,17 +1,19 @@
 from __future__ import annotations
 
 import json
-from typing import List
+from typing import ClassVar, List, Optional
 
-from icekube.models.base import RELATIONSHIP, Resource
+from icekube.models.base import RELATIONSHIP, Resource, ResourceRef
 from icekube.models.secret import Secret
-from icekube.neo4j import mock
+from icekube.neo4j import ref
 from pydantic import root_validator
 from pydantic.fields import Field
 
 
 class ServiceAccount(Resource):
-    secrets: List[Secret] = Field(default_factory=list)
+    secrets: List[ResourceRef] = Field(default_factory=list)
+    parses_raw: ClassVar[bool] = True
+    required_fields: ClassVar[Optional[List[str]]] = ["secrets"]
 
     @root_validator(pre=True)
     def inject_secrets(cls, values):
@@ -25,7 +27,7 @@ class ServiceAccount(Resource):
 
         for secret in data.get("secrets", []):
             values["secrets"].append(
-                mock(
+                ref(
                     Secret,
                     name=secret.get("name", ""),
                     namespace=data.get("metadata", {}).get("namespace", ""),
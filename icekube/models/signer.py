@@ -1,4 +1,4 @@
-from typing import Dict
+from typing import ClassVar, Dict
 
 from icekube.models.base import Resource
 
@@ -7,6 +7,7 @@ class Signer(Resource):
     apiVersion: str = "certificates.k8s.io/v1"
     kind: str = "Signer"
     plural: str = "signers"
+    labels_from_model: ClassVar[bool] = True
 
     def __repr__(self) -> str:
         return f"Signer(name={self.name})"
@@ -1,15 +1,43 @@
 from __future__ import annotations
 
+import json
 import logging
-from typing import Any, Dict, Generator, List, Optional, Tuple, Type, TypeVar
-
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Dict,
+    Generator,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Type,
+    TypeVar,
+    Union,
+    cast,
+)
+from uuid import uuid4
+
+from icekube.blobstore import get_blob_store, resolve_raw
 from icekube.config import config
-from icekube.models import Cluster, Resource
-from neo4j import BoltDriver, GraphDatabase
-from neo4j.io import ServiceUnavailable
+from icekube.sessions import current_cluster, session
+from icekube.utils import content_hash, normalise
+
+# Models, the neo4j driver and tqdm are imported when first used, so commands
+# only touching the graph start quickly. Models also import this module.
+if TYPE_CHECKING:
+    from tqdm import tqdm
+
+    from icekube.models import Cluster, Resource
+    from icekube.models.base import ResourceRecord, ResourceRef
+    from neo4j import BoltDriver, Transaction
 
 T = TypeVar("T")
 
+# Label of every node, the name of the base model
+RESOURCE_LABEL = "Resource"
+
 logger = logging.getLogger(__name__)
 
 
@@ -38,23 +66,13 @@ def init_connection(
     )
     encrypted = neo4j_config.get("encrypted", encrypted)
 
-    return GraphDatabase.driver(uri, auth=auth, encrypted=encrypted)
-
-
-def create_index(kind: str, namespace: bool) -> None:
-    cmd = f"CREATE INDEX {kind.lower()} FOR (n:{kind}) ON (n.name"
-    if namespace:
-        cmd += ", n.namespace"
-    cmd += ")"
+    from neo4j import GraphDatabase
 
-    driver = get_driver()
-
-    with driver.session() as session:
-        session.run(cmd)
+    return GraphDatabase.driver(uri, auth=auth, encrypted=encrypted)
 
 
 def get(
-    resource: Resource,
+    resource: Union[Resource, ResourceRecord, ResourceRef],
     identifier: str = "",
     prefix: str = "",
 ) -> Tuple[str, Dict[str, str]]:
@@ -69,12 +87,49 @@ def get(
         labels.append(f"{key}: ${prefix}{key}")
         kwargs[f"{prefix}{key}"] = value
 
-    cmd = f"MERGE ({identifier}:{resource.kind} {{ {', '.join(labels)} }}) "
+    # Every node also carries the base label, so unlabelled lookups can use
+    # its indices
+    cmd = (
+        f"MERGE ({identifier}:{resource.kind}:{RESOURCE_LABEL} "
+        f"{{ {', '.join(labels)} }}) "
+    )
 
     return cmd, kwargs
 
 
-def create(resource: Resource, prefix: str = "") -> Tuple[str, Dict[str, Any]]:
+def node_hash(db_labels: Dict[str, Any]) -> str:
+    """Hash of a node's labels, ignoring parts of raw which change on every write.
+
+    Status is kept, as raw is stored on the node and would otherwise go stale
+    when only the status of a resource changes.
+    """
+    raw = db_labels.get("raw")
+    if raw:
+        db_labels = {**db_labels, "raw": normalise(json.loads(raw), fields=[])}
+    return content_hash(db_labels)
+
+
+def existing_hashes() -> Set[str]:
+    """Content hashes of the nodes already in the graph, fetched in bulk."""
+    return {
+        x["content_hash"]
+        for x in find_fields(fields=["content_hash"])
+        if x["content_hash"]
+    }
+
+
+def create(
+    resource: Union[Resource, ResourceRecord],
+    prefix: str = "",
+    digest: Optional[str] = None,
+    raw_hash: Optional[str] = None,
+) -> Tuple[str, Dict[str, Any]]:
+    """Create or update a node, marking its relationships to be generated.
+
+    The node keeps a hash of its labels, `digest` when already calculated, so
+    unchanged resources can be skipped when ingested again. With a blob store,
+    raw JSON is stored unless `raw_hash` shows it already has been.
+    """
     cmd, kwargs = get(resource, "x", prefix)
 
     labels: List[str] = []
@@ -82,7 +137,19 @@ def create(resource: Resource, prefix: str = "") -> Tuple[str, Dict[str, Any]]:
     if prefix:
         prefix += "_"
 
-    for key, value in resource.db_labels.items():
+    db_labels = resource.db_labels
+    db_labels = {
+        **db_labels,
+        "content_hash": digest or node_hash(db_labels),
+        "relationships_pending": True,
+    }
+    store = get_blob_store()
+    if store and db_labels.get("raw"):
+        # Only keep the hash of the raw JSON on the node
+        raw_hash = raw_hash or store.put(db_labels["raw"])
+        db_labels = {**db_labels, "raw": None, "raw_hash": raw_hash}
+
+    for key, value in db_labels.items():
         labels.append(f"{key}: ${prefix}{key}")
         kwargs[f"{prefix}{key}"] = value
 
@@ -91,47 +158,195 @@ def create(resource: Resource, prefix: str = "") -> Tuple[str, Dict[str, Any]]:
     return cmd, kwargs
 
 
-def find(
+def cluster_filter(**kwargs: str) -> Dict[str, str]:
+    """Add the session's cluster, and the current build, to node properties."""
+    from icekube.builds import current_build
+
+    cluster = current_cluster()
+    if cluster and "cluster" not in kwargs:
+        kwargs["cluster"] = cluster
+    build = current_build()
+    if build and "build" not in kwargs:
+        kwargs["build"] = build
+    return kwargs
+
+
+def hydrated_kinds() -> List[str]:
+    """Kinds whose models parse their raw JSON."""
+    from icekube.models import Resource
+
+    return [x.__name__ for x in Resource.__subclasses__() if x.parses_raw]
+
+
+def find_query(
     resource: Optional[Type[Resource]] = None,
     raw: bool = False,
+    exclude: Optional[List[str]] = None,
+    fields: Optional[List[str]] = None,
+    hydrate: bool = True,
     **kwargs: str,
-) -> Generator[Resource, None, None]:
+) -> str:
     labels = [f"{key}: ${key}" for key in kwargs.keys()]
-    if resource is None or resource is Resource:
-        cmd = f"MATCH (x {{ {', '.join(labels)} }}) "
-    else:
-        cmd = f"MATCH (x:{resource.__name__} {{ {', '.join(labels)} }}) "
+    label = resource.__name__ if resource else RESOURCE_LABEL
+
+    cmd = f"MATCH (x:{label} {{ {', '.join(labels)} }}) "
 
+    conditions = []
     if raw:
-        cmd += "WHERE EXISTS (x.raw) "
+        conditions.append("(EXISTS (x.raw) OR EXISTS (x.raw_hash))")
+    if exclude:
+        conditions.append(f"NOT ({' OR '.join(f'x:{x}' for x in exclude)})")
+    if conditions:
+        cmd += f"WHERE {' AND '.join(conditions)} "
+
+    if fields:
+        cmd += "RETURN " + ", ".join(f"x.{x} AS {x}" for x in fields)
+    elif not hydrate:
+        # Only send raw JSON for the models that parse it
+        cmd += (
+            "RETURN x { .*, raw: CASE WHEN x.kind IN $hydrate_kinds "
+            "THEN x.raw END, raw_hash: CASE WHEN x.kind IN $hydrate_kinds "
+            "THEN x.raw_hash END } AS x"
+        )
+    else:
+        cmd += "RETURN x"
+
+    return cmd
+
 
-    cmd += "RETURN x"
+def find_batches(
+    resource: Optional[Type[Resource]] = None,
+    raw: bool = False,
+    exclude: Optional[List[str]] = None,
+    hydrate: bool = True,
+    **kwargs: str,
+) -> Generator[List[Dict[str, Any]], None, None]:
+    """Find resources, yielding the properties of each batch of `fetch_size`.
+
+    Raw JSON kept in the blob store is resolved for each batch, so batches
+    can be modelled elsewhere, such as in worker processes. See `find`.
+    """
+    kwargs = cluster_filter(**kwargs)
+    cmd = find_query(
+        resource, raw=raw, exclude=exclude, fields=None, hydrate=hydrate, **kwargs
+    )
+    params: Dict[str, Any] = {**kwargs}
+    if not hydrate:
+        params["hydrate_kinds"] = hydrated_kinds()
 
     driver = get_driver()
 
-    with driver.session() as session:
-        logger.debug(f"Starting neo4j query: {cmd}, {kwargs}")
-        results = session.run(cmd, kwargs)
+    with driver.session(fetch_size=config["neo4j"]["fetch_size"]) as session:
+        logger.debug(f"Starting neo4j query: {cmd}, {params}")
+        results = session.run(cmd, params)
 
+        batch: List[Dict[str, Any]] = []
         for result in results:
-            result = result[0]
-            props = result._properties
-            logger.debug(
-                f"Loading resource: {props['kind']} "
-                f"{props.get('namespace', '')} {props['name']}",
-            )
+            batch.append(dict(result[0]))
+            if len(batch) >= config["neo4j"]["fetch_size"]:
+                resolve_raw(batch)
+                yield batch
+                batch = []
+        if batch:
+            resolve_raw(batch)
+            yield batch
+
+
+def find(
+    resource: Optional[Type[Resource]] = None,
+    raw: bool = False,
+    exclude: Optional[List[str]] = None,
+    hydrate: bool = True,
+    **kwargs: str,
+) -> Generator[Resource, None, None]:
+    """Find resources, building a model for each.
+
+    Without `hydrate`, raw JSON is only fetched for models which parse it.
+    Raw JSON kept in the blob store is fetched for each batch of `fetch_size`
+    results. Only resources of the session's cluster are found, when
+    enumerating several clusters, and of the current build, see
+    `icekube.builds`.
+    """
+    for batch in find_batches(resource, raw, exclude, hydrate, **kwargs):
+        yield from load_resources(resource, batch)
+
+
+def model_props(props: Dict[str, Any]) -> Dict[str, Any]:
+    """Properties read back from neo4j, as the fields of their model."""
+    props.pop("raw_hash", None)
+    if props.get("raw") is None:
+        props.pop("raw", None)
+    return props
+
+
+def load_resources(
+    resource: Optional[Type[Resource]],
+    batch: List[Dict[str, Any]],
+) -> Generator[Resource, None, None]:
+    from icekube.models import Resource
 
-            if resource is None:
-                res = Resource(**props)
-            else:
-                res = resource(**props)
+    for props in batch:
+        model_props(props)
+        logger.debug(
+            f"Loading resource: {props['kind']} "
+            f"{props.get('namespace', '')} {props['name']}",
+        )
 
-            yield res
+        if resource is None:
+            yield Resource(**props)
+        else:
+            yield resource(**props)
+
+
+def find_fields(
+    resource: Optional[Type[Resource]] = None,
+    fields: Optional[List[str]] = None,
+    exclude: Optional[List[str]] = None,
+    **kwargs: str,
+) -> Generator[Dict[str, Any], None, None]:
+    """Find resources, streaming only the requested properties of each."""
+    kwargs = cluster_filter(**kwargs)
+    if not fields:
+        from icekube.models import Resource
+
+        fields = list(Resource.model_fields)
+        fields.remove("raw")
+
+    cmd = find_query(
+        resource, raw=False, exclude=exclude, fields=fields, hydrate=True, **kwargs
+    )
+
+    driver = get_driver()
+
+    with driver.session(fetch_size=config["neo4j"]["fetch_size"]) as session:
+        logger.debug(f"Starting neo4j query: {cmd}, {kwargs}")
+        for result in session.run(cmd, kwargs):
+            yield result.data()
+
+
+def lookup_key(resource: Type[Any], **kwargs: Optional[str]) -> Tuple[Any, ...]:
+    return (resource.__name__, *sorted(kwargs.items()))
+
+
+def find_props(resource: Type[Resource], **kwargs: str) -> Optional[Dict[str, Any]]:
+    """Properties of the first resource found, to build its model elsewhere."""
+    batches = find_batches(resource, raw=False, exclude=None, hydrate=False, **kwargs)
+    for batch in batches:
+        return model_props(batch[0])
+    return None
 
 
 def find_or_mock(resource: Type[T], **kwargs: str) -> T:
+    from neo4j.io import ServiceUnavailable
+
+    lookups = session().lookups
+    if lookups is not None:
+        # Worker processes have no connection, the parent looks resources up
+        props = lookups.get(lookup_key(resource, **kwargs))
+        return resource(**(props or kwargs))
+
     try:
-        return next(find(resource, **kwargs))  # type: ignore
+        return next(find(resource, hydrate=False, **kwargs))  # type: ignore
     except (StopIteration, IndexError, ServiceUnavailable):
         return resource(**kwargs)
 
@@ -140,15 +355,132 @@ def mock(resource: Type[T], **kwargs: str) -> T:
     return resource(**kwargs)
 
 
-cluster: Optional[Cluster] = None
+def ref(resource: Type[Resource], **kwargs: Optional[str]) -> ResourceRef:
+    """Reference a resource by its identifiers, without building a model."""
+    return resource.reference(**kwargs)
 
 
 def get_cluster_object() -> Cluster:
-    global cluster
+    from icekube.models import Cluster
+
+    current = session()
+
+    if current.cluster:
+        return current.cluster
+
+    current.cluster = find_or_mock(Cluster, kind="Cluster")
+
+    return current.cluster
+
+
+def graph_generation() -> Optional[str]:
+    """Marker changed whenever attack paths are regenerated, if any."""
+    with get_driver().session() as session:
+        result = session.run(
+            "MATCH (m:Meta {name: 'graph'}) RETURN m.generation AS generation",
+        ).single()
+
+    return cast(Optional[str], result["generation"]) if result else None
+
+
+def new_generation() -> str:
+    generation = uuid4().hex
+
+    with get_driver().session() as session:
+        session.run(
+            "MERGE (m:Meta {name: 'graph'}) SET m.generation = $generation",
+            generation=generation,
+        ).consume()
+
+    return generation
+
+
+def count_matches(match: str, var: str, **kwargs: Any) -> int:
+    with get_driver().session() as session:
+        result = session.run(f"{match} RETURN count({var}) AS total", **kwargs)
+        record = result.single()
+
+    return cast(int, record["total"]) if record else 0
+
+
+def _delete_batch(tx: Transaction, cmd: str, kwargs: Dict[str, Any]) -> int:
+    record = tx.run(cmd, **kwargs).single()
+    return cast(int, record["deleted"]) if record else 0
+
+
+def delete_batched(
+    match: str,
+    var: str,
+    detach: bool = False,
+    progress: Optional[tqdm] = None,
+    carry: Sequence[str] = (),
+    update: str = "",
+    **kwargs: Any,
+) -> int:
+    """Delete `var` of everything `match` matches, in bounded transactions.
+
+    Each transaction deletes at most `delete_batch_size` nodes or
+    relationships, so neo4j's memory use doesn't grow with the graph. Each
+    batch may first run `update`, on `var` and the variables in `carry`.
+    """
+    cmd = (
+        f"{match} WITH {', '.join([var, *carry])} LIMIT $limit {update} "
+        f"{'DETACH ' if detach else ''}DELETE {var} RETURN count(*) AS deleted"
+    )
+    kwargs["limit"] = config["graph"]["delete_batch_size"]
+
+    total = 0
+    with get_driver().session() as session:
+        while True:
+            deleted: int = session.write_transaction(_delete_batch, cmd, kwargs)
+            total += deleted
+            if progress is not None:
+                progress.update(deleted)
+            if not deleted:
+                return total
+
+
+def relationship_types() -> List[str]:
+    with get_driver().session() as session:
+        result = session.run("CALL db.relationshipTypes()")
+        return [x["relationshipType"] for x in result]
+
+
+def purge_neo4j() -> None:
+    """Delete every node and relationship.
+
+    Relationships are deleted first, a type at a time, so each batch is found
+    by a typed scan and nodes with many relationships, such as the cluster,
+    are never detached within a single transaction.
+    """
+    from tqdm import tqdm
+
+    relationships = [f"MATCH ()-[r:`{x}`]->()" for x in relationship_types()]
+    total = count_matches("MATCH (x)", "x") + sum(
+        count_matches(x, "r") for x in relationships
+    )
+
+    with tqdm(total=total) as progress:
+        for match in relationships:
+            delete_batched(match, "r", progress=progress)
+        delete_batched("MATCH (x)", "x", detach=True, progress=progress)
+
+    store = get_blob_store()
+    if store:
+        store.clear()
+
 
-    if cluster:
-        return cluster
+def prune_blobs() -> None:
+    """Remove raw JSON no node references, such as that of rewritten nodes."""
+    store = get_blob_store()
+    if not store:
+        return
 
-    cluster = find_or_mock(Cluster, kind="Cluster")
+    with get_driver().session(fetch_size=config["neo4j"]["fetch_size"]) as session:
+        result = session.run(
+            f"MATCH (x:{RESOURCE_LABEL}) WHERE EXISTS (x.raw_hash) "
+            "RETURN x.raw_hash AS hash",
+        )
+        removed = store.prune(x["hash"] for x in result)
 
-    return cluster
+    logger.info(f"Removed {removed} unreferenced raw payloads")
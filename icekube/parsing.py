@@ -0,0 +1,106 @@
+from __future__ import annotations
+
+from concurrent.futures import Future, ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Generator,
+    Iterable,
+    List,
+    Tuple,
+    TypeVar,
+)
+
+from icekube.builds import current_build
+from icekube.config import config
+from icekube.models.base import ResourceRecord
+from icekube.neo4j import get_cluster_object, node_hash
+from icekube.sessions import ClusterSession, current_session, session
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+def worker_state() -> Dict[str, Any]:
+    """State of the parent process needed to build models in a worker."""
+    from icekube import kube
+
+    # Looked up before the config is copied, rather than in each worker
+    current_build()
+    current = session()
+    return {
+        "config": config,
+        "context": current.context,
+        "name": current.name,
+        "preferred_versions": current.preferred_versions,
+        # Looked up through the module, so snapshots are used when loaded
+        "api_resources": kube.api_resources(),
+        "cluster": get_cluster_object(),
+    }
+
+
+def init_worker(state: Dict[str, Any]) -> None:
+    """Initialise a worker process once, rather than for each task."""
+    config.update(state["config"])
+
+    current = ClusterSession(state["context"], state["name"])
+    # Workers only build models, discovery and resources they look up come
+    # from the parent process, so they never connect to neo4j
+    current.loaded_kube_config = True
+    current.preferred_versions = state["preferred_versions"]
+    current.api_resources_cache = state["api_resources"]
+    current.cluster = state["cluster"]
+    current.lookups = {}
+    current_session.set(current)
+
+
+def process_pool(processes: int) -> ProcessPoolExecutor:
+    """Worker processes building models for the current cluster session.
+
+    Workers are spawned, rather than forked, as the parent process has
+    threads and open neo4j connections.
+    """
+    return ProcessPoolExecutor(
+        processes,
+        mp_context=get_context("spawn"),
+        initializer=init_worker,
+        initargs=(worker_state(),),
+    )
+
+
+def parse_hashed(
+    parse: Callable[[T, Any], Iterable[ResourceRecord]],
+    task: T,
+    body: Any,
+) -> List[Tuple[ResourceRecord, str]]:
+    """Parse a fetched page into records, each with its content hash."""
+    return [(record, node_hash(record.db_labels)) for record in parse(task, body)]
+
+
+def bounded_map(
+    pool: ProcessPoolExecutor,
+    func: Callable[..., R],
+    items: Iterable[Tuple[Any, ...]],
+    in_flight: int,
+) -> Generator[R, None, None]:
+    """Results of func for each item, in order, with a bounded number pending.
+
+    Unlike `ProcessPoolExecutor.map`, items are only read as results are
+    consumed, so large inputs are never held in memory at once. Items still
+    queued are cancelled when the generator is closed.
+    """
+    pending: List[Future[R]] = []
+
+    try:
+        for args in items:
+            pending.append(pool.submit(func, *args))
+            if len(pending) >= in_flight:
+                yield pending.pop(0).result()
+
+        while pending:
+            yield pending.pop(0).result()
+    finally:
+        for future in pending:
+            future.cancel()
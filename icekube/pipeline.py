@@ -0,0 +1,252 @@
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from queue import Empty, Full, Queue
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Generic,
+    Iterable,
+    List,
+    Optional,
+    Set,
+    TypeVar,
+)
+
+from icekube.sessions import bound
+from tqdm import tqdm
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+F = TypeVar("F")
+P = TypeVar("P")
+
+# Marks the end of a queue's input, one per consuming worker
+DONE = object()
+
+# How often blocked workers check whether another stage failed
+POLL_INTERVAL = 0.1
+
+
+class PipelineAborted(Exception):
+    pass
+
+
+class TaskFailed(Exception):
+    """Raised by a stage to skip a task without marking it complete."""
+
+
+class Pipeline(Generic[T, F, P]):
+    """Fetch, parse and write stages connected by bounded queues.
+
+    Each stage runs in its own threads, so waiting on the Kubernetes API,
+    building models and writing to neo4j overlap. Full queues block the stage
+    before them, bounding memory to `queue_size` items between each stage.
+    Parsed items are written in batches of up to `batch_size`.
+
+    `on_complete` is called for each task once all of its items are written.
+    Tasks whose fetch raises `TaskFailed` are skipped, and never completed.
+    """
+
+    def __init__(
+        self,
+        fetch: Callable[[T], Optional[F]],
+        parse: Callable[[T, F], Iterable[P]],
+        write: Callable[[List[P]], None],
+        fetchers: int = 8,
+        parsers: int = 2,
+        writers: int = 4,
+        queue_size: int = 32,
+        batch_size: int = 500,
+        on_complete: Optional[Callable[[T], None]] = None,
+    ):
+        self.fetch = fetch
+        self.parse = parse
+        self.write = write
+        self.workers = {
+            "fetch": max(fetchers, 1),
+            "parse": max(parsers, 1),
+            "write": max(writers, 1),
+        }
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.on_complete = on_complete
+
+        self.failed = threading.Event()
+        self.error: Optional[BaseException] = None
+        self.lock = threading.Lock()
+        # Seconds spent working, rather than waiting on a queue, by stage
+        self.busy: Dict[str, float] = {x: 0.0 for x in self.workers}
+
+        self.tasks: List[T] = []
+        # Batches of each task not yet written, plus one until it is parsed
+        self.outstanding: Dict[int, int] = {}
+        self.incomplete: Set[int] = set()
+
+    def put(self, queue: Queue[Any], item: Any) -> None:
+        while True:
+            if self.failed.is_set():
+                raise PipelineAborted()
+            try:
+                queue.put(item, timeout=POLL_INTERVAL)
+                return
+            except Full:
+                continue
+
+    def get(self, queue: Queue[Any]) -> Any:
+        while True:
+            if self.failed.is_set():
+                raise PipelineAborted()
+            try:
+                return queue.get(timeout=POLL_INTERVAL)
+            except Empty:
+                continue
+
+    def timed(self, stage: str, start: float) -> None:
+        with self.lock:
+            self.busy[stage] += time.monotonic() - start
+
+    def release(self, idx: int) -> None:
+        with self.lock:
+            self.outstanding[idx] -= 1
+            finished = not self.outstanding[idx] and idx not in self.incomplete
+        if finished and self.on_complete is not None:
+            self.on_complete(self.tasks[idx])
+
+    def fetcher(self, tasks: Queue[Any], fetched: Queue[Any]) -> None:
+        while True:
+            idx = self.get(tasks)
+            if idx is DONE:
+                return
+
+            start = time.monotonic()
+            try:
+                data = self.fetch(self.tasks[idx])
+            except TaskFailed:
+                with self.lock:
+                    self.incomplete.add(idx)
+                data = None
+            self.timed("fetch", start)
+            self.put(fetched, (idx, data))
+
+    def parser(self, fetched: Queue[Any], parsed: Queue[Any], progress: tqdm) -> None:
+        while True:
+            item = self.get(fetched)
+            if item is DONE:
+                return
+
+            idx, data = item
+            if data is not None:
+                batch: List[P] = []
+                start = time.monotonic()
+                for result in self.parse(self.tasks[idx], data):
+                    batch.append(result)
+                    if len(batch) >= self.batch_size:
+                        self.timed("parse", start)
+                        self.send(parsed, idx, batch)
+                        batch = []
+                        start = time.monotonic()
+                self.timed("parse", start)
+                if batch:
+                    self.send(parsed, idx, batch)
+            self.release(idx)
+            progress.update(1)
+
+    def send(self, parsed: Queue[Any], idx: int, batch: List[P]) -> None:
+        with self.lock:
+            self.outstanding[idx] += 1
+        self.put(parsed, (idx, batch))
+
+    def writer(self, parsed: Queue[Any]) -> None:
+        while True:
+            item = self.get(parsed)
+            if item is DONE:
+                return
+
+            idx, batch = item
+            start = time.monotonic()
+            self.write(batch)
+            self.timed("write", start)
+            self.release(idx)
+
+    def worker(self, func: Callable[..., None], *args: Any) -> None:
+        try:
+            func(*args)
+        except PipelineAborted:
+            pass
+        except BaseException as e:
+            with self.lock:
+                if self.error is None:
+                    self.error = e
+            self.failed.set()
+
+    def run(self, tasks: List[T]) -> None:
+        pending: Queue[Any] = Queue()
+        fetched: Queue[Any] = Queue(maxsize=self.queue_size)
+        parsed: Queue[Any] = Queue(maxsize=self.queue_size)
+
+        self.tasks = list(tasks)
+        self.outstanding = {idx: 1 for idx in range(len(self.tasks))}
+        self.incomplete = set()
+        for idx in range(len(self.tasks)):
+            pending.put(idx)
+        for _ in range(self.workers["fetch"]):
+            pending.put(DONE)
+
+        progress = tqdm(total=len(tasks))
+        worker = bound(self.worker)
+
+        with ThreadPoolExecutor(max_workers=sum(self.workers.values())) as exc:
+            stages = [
+                (
+                    [
+                        exc.submit(worker, self.fetcher, pending, fetched)
+                        for _ in range(self.workers["fetch"])
+                    ],
+                    fetched,
+                    self.workers["parse"],
+                ),
+                (
+                    [
+                        exc.submit(worker, self.parser, fetched, parsed, progress)
+                        for _ in range(self.workers["parse"])
+                    ],
+                    parsed,
+                    self.workers["write"],
+                ),
+                (
+                    [
+                        exc.submit(worker, self.writer, parsed)
+                        for _ in range(self.workers["write"])
+                    ],
+                    None,
+                    0,
+                ),
+            ]
+
+            # Once a stage finishes, tell each worker of the next stage
+            for futures, outbox, consumers in stages:
+                for future in futures:
+                    future.result()
+                if outbox is None or self.failed.is_set():
+                    continue
+                for _ in range(consumers):
+                    try:
+                        self.put(outbox, DONE)
+                    except PipelineAborted:
+                        break
+
+        progress.close()
+
+        logger.info(
+            "Pipeline busy time: "
+            + ", ".join(f"{x} {y:.1f}s" for x, y in self.busy.items()),
+        )
+
+        if self.error is not None:
+            raise self.error
@@ -0,0 +1,72 @@
+from __future__ import annotations
+
+import re
+from fnmatch import fnmatch
+from functools import lru_cache
+from typing import FrozenSet, Optional
+
+from icekube.attack_paths import attack_paths, scoped_attack_paths
+from icekube.config import config
+
+# Node labels matched by a query, e.g. (dest:ServiceAccount) or
+# WHERE workload:Deployment, but not relationship types such as [:BOUND_TO]
+NODE_LABELS = re.compile(r"(?<![\[\w])\w*:([A-Z]\w*)")
+
+RBAC_KINDS: FrozenSet[str] = frozenset(
+    [
+        "ClusterRole",
+        "ClusterRoleBinding",
+        "Namespace",
+        "Role",
+        "RoleBinding",
+        "ServiceAccount",
+    ],
+)
+
+PROFILES = ["minimal", "rbac-only", "full"]
+
+
+@lru_cache(maxsize=None)
+def attack_path_kinds() -> FrozenSet[str]:
+    """Kinds with a model, or matched on by an attack path query."""
+    from icekube.models import enumerate_resource_kinds
+
+    kinds = {x.__name__ for x in enumerate_resource_kinds}
+
+    for paths in [attack_paths, scoped_attack_paths]:
+        for query in paths.values():
+            queries = [query] if isinstance(query, str) else query
+            for q in queries:
+                kinds.update(NODE_LABELS.findall(q))
+
+    return frozenset(kinds)
+
+
+def profile_kinds(profile: str) -> Optional[FrozenSet[str]]:
+    """Kinds enumerated by a profile, or None when all kinds are."""
+    if profile == "minimal":
+        return attack_path_kinds()
+    elif profile == "rbac-only":
+        return RBAC_KINDS
+    elif profile == "full":
+        return None
+    else:
+        raise Exception(f"Unknown enumeration profile: {profile}")
+
+
+def kind_included(kind: str) -> bool:
+    kinds = profile_kinds(config["enumeration"]["profile"])
+    return kinds is None or kind in kinds
+
+
+def namespace_included(namespace: Optional[str]) -> bool:
+    if namespace is None:
+        return True
+
+    include = config["enumeration"]["namespaces"]
+    exclude = config["enumeration"]["exclude_namespaces"]
+
+    if include and not any(fnmatch(namespace, x) for x in include):
+        return False
+
+    return not any(fnmatch(namespace, x) for x in exclude)
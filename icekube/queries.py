@@ -0,0 +1,403 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import re
+import shutil
+from pathlib import Path
+from typing import Any, Dict, List, NamedTuple, Optional, Set, Tuple, cast
+
+from icekube.attack_paths import scope_members, target_scopes
+from icekube.builds import current_build
+from icekube.config import config
+from icekube.formats import QUERY_TYPES
+from icekube.neo4j import get_driver, graph_generation
+
+logger = logging.getLogger(__name__)
+
+
+NODE_PROPERTIES = ["kind", "namespace", "name", "cluster"]
+
+
+class Selector(NamedTuple):
+    """Nodes selected by `Kind`, `Kind/name` or `Kind/namespace/name`.
+
+    A name or namespace of `*` matches any.
+    """
+
+    kind: str
+    namespace: Optional[str] = None
+    name: Optional[str] = None
+
+    @classmethod
+    def parse(cls, selector: str) -> Selector:
+        parts = [None if x == "*" else x for x in selector.split("/")]
+        if len(parts) > 3 or not parts[0] or not re.fullmatch(r"\w+", parts[0]):
+            raise ValueError(f"Invalid node selector: {selector}")
+
+        if len(parts) == 3:
+            return cls(cast(str, parts[0]), parts[1], parts[2])
+        elif len(parts) == 2:
+            return cls(cast(str, parts[0]), None, parts[1])
+        return cls(cast(str, parts[0]))
+
+    def match(
+        self,
+        var: str,
+        cluster: Optional[str] = None,
+    ) -> Tuple[str, Dict[str, str]]:
+        properties = {
+            key: value
+            for key, value in [
+                ("namespace", self.namespace),
+                ("name", self.name),
+                ("cluster", cluster),
+                ("build", current_build()),
+            ]
+            if value
+        }
+        labels = ", ".join(f"{key}: ${var}_{key}" for key in properties)
+        return (
+            f"MATCH ({var}:{self.kind} {{ {labels} }}) ",
+            {f"{var}_{key}": value for key, value in properties.items()},
+        )
+
+    def __str__(self) -> str:
+        return "/".join(x or "*" for x in self)
+
+
+class QueryCache:
+    """Query results on disk, for the graph generation they were read from.
+
+    Generations are kept apart for each neo4j URL, so only older generations
+    of the same graph are removed.
+    """
+
+    def __init__(self, cache_dir: str, generation: Optional[str], url: str = ""):
+        self.path: Optional[Path] = None
+        if generation:
+            graph = hashlib.sha256(url.encode()).hexdigest()[:16]
+            self.path = Path(cache_dir).expanduser() / graph / generation
+
+    def file(self, key: Dict[str, Any]) -> Path:
+        digest = hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+        return cast(Path, self.path) / f"{digest}.json"
+
+    def get(self, key: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        if self.path is None:
+            return None
+
+        try:
+            return cast(Dict[str, Any], json.loads(self.file(key).read_text()))
+        except (OSError, ValueError):
+            return None
+
+    def put(self, key: Dict[str, Any], result: Dict[str, Any]) -> None:
+        if self.path is None:
+            return
+
+        try:
+            # Results for older generations will never be read again
+            if self.path.parent.exists():
+                for path in self.path.parent.iterdir():
+                    if path != self.path:
+                        shutil.rmtree(path, ignore_errors=True)
+            self.path.mkdir(parents=True, exist_ok=True)
+            self.file(key).write_text(json.dumps(result))
+        except OSError:
+            logger.warning(f"Unable to write query cache {self.path}")
+
+
+def node_properties(ids: List[int]) -> Dict[int, Dict[str, Any]]:
+    properties = ", ".join(f".{x}" for x in NODE_PROPERTIES)
+
+    with get_driver().session() as session:
+        result = session.run(
+            "UNWIND $ids AS id MATCH (n) WHERE id(n) = id "
+            f"RETURN id(n) AS id, n {{ {properties} }} AS node",
+            ids=ids,
+        )
+        return {x["id"]: dict(x["node"]) for x in result}
+
+
+def start_nodes(selector: Selector, cluster: Optional[str], scopes: bool) -> Set[int]:
+    """Nodes matching a selector, and with `scopes` the scopes containing them."""
+    cmd, kwargs = selector.match("target", cluster)
+    if scopes:
+        cmd += target_scopes("target", "scope") + "RETURN DISTINCT id(scope) AS id"
+    else:
+        cmd += "RETURN id(target) AS id"
+
+    with get_driver().session() as session:
+        return {x["id"] for x in session.run(cmd, kwargs)}
+
+
+def expand(
+    start: Set[int],
+    inbound: bool,
+    max_hops: int,
+    limit: int,
+) -> Tuple[Dict[int, int], List[Tuple[int, str, int]], bool]:
+    """Breadth first search along attack paths, one query per hop.
+
+    Scoped attack paths are expanded at every hop: outbound, a scoped edge
+    also reaches each member of its scope, and inbound, a node is also reached
+    by the scoped edges to each scope containing it. The relationships found
+    are reported to the members.
+
+    Returns the distance to each node found, the relationships first reaching
+    each of them, and whether the search stopped at `limit` nodes.
+    """
+    if inbound:
+        cmd = (
+            "UNWIND $ids AS id MATCH (a) WHERE id(a) = id "
+            + target_scopes("a", "scope")
+            + "MATCH (scope)<-[r]-(b) WHERE r.attack_path = 1 "
+            "AND (scope = a OR r.scoped = true) "
+            "RETURN DISTINCT id(b) AS node, id(b) AS src, type(r) AS type, "
+            "id(a) AS dst"
+        )
+    else:
+        cmd = (
+            "UNWIND $ids AS id MATCH (a) WHERE id(a) = id "
+            "MATCH (a)-[r]->(b) WHERE r.attack_path = 1 "
+            "CALL { WITH b RETURN b AS member UNION "
+            "WITH r, b WHERE r.scoped = true "
+            + scope_members("b", "member")
+            + "RETURN member } "
+            "RETURN DISTINCT id(member) AS node, id(a) AS src, type(r) AS type, "
+            "id(member) AS dst"
+        )
+
+    distances = dict.fromkeys(start, 0)
+    edges: List[Tuple[int, str, int]] = []
+    frontier = list(start)
+
+    with get_driver().session(fetch_size=config["neo4j"]["fetch_size"]) as session:
+        for hop in range(1, max_hops + 1):
+            if not frontier:
+                break
+
+            found: List[int] = []
+            for record in session.run(cmd, ids=frontier):
+                node = record["node"]
+                if node not in distances:
+                    if len(distances) >= limit:
+                        return distances, edges, True
+                    distances[node] = hop
+                    found.append(node)
+                elif distances[node] < hop:
+                    continue
+                edges.append((record["src"], record["type"], record["dst"]))
+            frontier = found
+
+    return distances, edges, False
+
+
+def shortest_paths(
+    source: Selector,
+    target: Selector,
+    cluster: Optional[str],
+    max_hops: int,
+    limit: int,
+) -> Tuple[List[Tuple[List[int], List[str]]], bool]:
+    """Shortest attack path to each target, from the nearest source.
+
+    Paths are read back from a search out of every source, see `expand`, so
+    pass through the members of scoped attack paths. Returns the paths, and
+    whether the search stopped at `limit` nodes.
+    """
+    start = start_nodes(source, cluster, False)
+    distances, edges, truncated = expand(start, False, max_hops, limit)
+
+    # Relationships from a node one hop closer to the sources, by node
+    previous: Dict[int, Tuple[int, str]] = {}
+    for src, rel_type, dst in edges:
+        if dst not in previous and distances.get(src) == distances[dst] - 1:
+            previous[dst] = (src, rel_type)
+
+    paths: List[Tuple[List[int], List[str]]] = []
+    targets = start_nodes(target, cluster, False)
+    for node in sorted(targets & set(previous), key=lambda x: (distances[x], x)):
+        nodes: List[int] = [node]
+        types: List[str] = []
+        while nodes[0] in previous:
+            src, rel_type = previous[nodes[0]]
+            nodes.insert(0, src)
+            types.insert(0, rel_type)
+        paths.append((nodes, types))
+
+    return paths[:limit], truncated or len(paths) > limit
+
+
+def run_query(
+    query_type: str,
+    source: Optional[Selector] = None,
+    target: Optional[Selector] = None,
+    cluster: Optional[str] = None,
+    max_hops: int = 6,
+    limit: int = 1000,
+) -> Dict[str, Any]:
+    """Run a path query against the attack path graph.
+
+    * shortest - shortest paths from `source` to `target`
+    * reachable - everything reachable from `source`, optionally only the
+      nodes matching `target`
+    * blast-radius - everything able to reach `target`, optionally only the
+      nodes matching `source`
+
+    Paths pass through, and end at, the members of scoped attack paths, see
+    `expand`.
+    """
+    if query_type not in QUERY_TYPES:
+        raise ValueError(f"Unknown query type: {query_type}")
+
+    result: Dict[str, Any] = {"nodes": [], "relationships": [], "paths": []}
+    distances: Dict[int, int] = {}
+    edges: List[Tuple[int, str, int]] = []
+    truncated = False
+
+    if query_type == "shortest":
+        if source is None or target is None:
+            raise ValueError("Shortest paths need a source and a target")
+        paths, truncated = shortest_paths(source, target, cluster, max_hops, limit)
+        for nodes, types in paths:
+            result["paths"].append({"nodes": nodes, "relationships": types})
+            for idx, node in enumerate(nodes):
+                distances[node] = min(distances.get(node, idx), idx)
+            edges += [(x, y, z) for x, y, z in zip(nodes, types, nodes[1:])]
+    elif query_type == "reachable":
+        if source is None:
+            raise ValueError("Reachable targets need a source")
+        start = start_nodes(source, cluster, False)
+        distances, edges, truncated = expand(start, False, max_hops, limit)
+    else:
+        if target is None:
+            raise ValueError("Blast radius needs a target")
+        start = start_nodes(target, cluster, True)
+        distances, edges, truncated = expand(start, True, max_hops, limit)
+
+    properties = node_properties(list(distances))
+    for node, distance in sorted(distances.items(), key=lambda x: (x[1], x[0])):
+        result["nodes"].append({"id": node, "distance": distance, **properties[node]})
+    result["relationships"] = [
+        {"source": src, "type": rel_type, "target": dst}
+        for src, rel_type, dst in dict.fromkeys(edges)
+    ]
+
+    # Filter the nodes found down to those selected, once searched through
+    selected = target if query_type == "reachable" else source
+    if query_type != "shortest" and selected is not None:
+        result["matches"] = [
+            x["id"]
+            for x in result["nodes"]
+            if x["distance"]
+            and x["kind"] == selected.kind
+            and (selected.namespace is None or x["namespace"] == selected.namespace)
+            and (selected.name is None or x["name"] == selected.name)
+        ]
+
+    result["truncated"] = truncated
+    return result
+
+
+def cached_query(
+    query_type: str,
+    source: Optional[Selector] = None,
+    target: Optional[Selector] = None,
+    cluster: Optional[str] = None,
+    max_hops: int = 6,
+    limit: int = 1000,
+    cache_dir: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Run a query, or return its result for the current graph generation.
+
+    The generation is changed by `setup_attack_paths`, so results are never
+    read from a graph with different attack paths.
+    """
+    generation = graph_generation() if cache_dir else None
+    cache = QueryCache(cache_dir or "", generation, config["neo4j"]["url"])
+    key = {
+        "url": config["neo4j"]["url"],
+        "build": current_build(),
+        "query_type": query_type,
+        "source": str(source) if source else None,
+        "target": str(target) if target else None,
+        "cluster": cluster,
+        "max_hops": max_hops,
+        "limit": limit,
+    }
+
+    result = cache.get(key)
+    if result is not None:
+        logger.info("Returning cached query result")
+        return result
+
+    result = {
+        "query": key,
+        "generation": generation,
+        **run_query(query_type, source, target, cluster, max_hops, limit),
+    }
+    cache.put(key, result)
+    return result
+
+
+def node_label(node: Dict[str, Any]) -> str:
+    label = "/".join(x for x in [node["namespace"], node["name"]] if x)
+    if node.get("cluster"):
+        label = f"{node['cluster']}:{label}"
+    return f"{node['kind']}/{label}"
+
+
+def format_table(result: Dict[str, Any]) -> str:
+    nodes = {x["id"]: x for x in result["nodes"]}
+
+    if result["paths"]:
+        lines = []
+        for path in result["paths"]:
+            line = node_label(nodes[path["nodes"][0]])
+            for rel_type, node in zip(path["relationships"], path["nodes"][1:]):
+                line += f" -[{rel_type}]-> {node_label(nodes[node])}"
+            lines.append(line)
+        return "\n".join(lines)
+
+    rows = result["nodes"]
+    if "matches" in result:
+        rows = [nodes[x] for x in result["matches"]]
+
+    columns = ["distance", *NODE_PROPERTIES]
+    table = [[c.upper() for c in columns]] + [
+        [str(x.get(c) if x.get(c) is not None else "") for c in columns] for x in rows
+    ]
+    widths = [max(len(row[idx]) for row in table) for idx in range(len(columns))]
+    return "\n".join(
+        "  ".join(value.ljust(width) for value, width in zip(row, widths)).rstrip()
+        for row in table
+    )
+
+
+def format_dot(result: Dict[str, Any]) -> str:
+    def quote(value: str) -> str:
+        return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+    lines = ["digraph icekube {"]
+    for node in result["nodes"]:
+        lines.append(f"  n{node['id']} [label={quote(node_label(node))}];")
+    for rel in result["relationships"]:
+        lines.append(
+            f"  n{rel['source']} -> n{rel['target']} [label={quote(rel['type'])}];",
+        )
+    lines.append("}")
+    return "\n".join(lines)
+
+
+def format_result(result: Dict[str, Any], output_format: str) -> str:
+    if output_format == "json":
+        return json.dumps(result, indent=2)
+    elif output_format == "dot":
+        return format_dot(result)
+    elif output_format == "table":
+        return format_table(result)
+    else:
+        raise ValueError(f"Unknown output format: {output_format}")
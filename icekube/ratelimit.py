@@ -0,0 +1,192 @@
+from __future__ import annotations
+
+import logging
+import random
+import threading
+import time
+from typing import Callable, Optional, TypeVar
+
+from icekube.config import config
+from icekube.sessions import session
+from kubernetes.client.exceptions import ApiException
+
+T = TypeVar("T")
+
+logger = logging.getLogger(__name__)
+
+# Responses worth retrying, the API server returns 429 when throttling with
+# API Priority and Fairness. Each is also treated as a sign of an overloaded
+# server, as is a Retry-After header
+RETRY_STATUSES = [429, 500, 502, 503, 504]
+
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 30.0
+
+# A successful request taking LATENCY_FACTOR times the running average latency
+# is taken as a sign of requests queueing at the server. The average follows
+# sustained changes, such as paging through large lists, and requests under
+# LATENCY_MIN seconds or made before LATENCY_WARMUP samples never count
+LATENCY_FACTOR = 3.0
+LATENCY_SMOOTHING = 0.1
+LATENCY_MIN = 1.0
+LATENCY_WARMUP = 10
+
+
+class TokenBucket:
+    """Allow `qps` requests per second on average, in bursts of up to `burst`."""
+
+    def __init__(self, qps: float, burst: int):
+        self.qps = qps
+        self.burst = max(burst, 1)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        if self.qps <= 0:
+            return
+
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.burst,
+                    self.tokens + (now - self.updated) * self.qps,
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.qps
+            time.sleep(wait)
+
+
+class AdaptiveLimiter:
+    """Limit concurrent requests, adjusting the limit with AIMD.
+
+    The limit grows by one for every window of successful requests, and is
+    halved whenever the server throttles a request, fails with a 5xx, or
+    responds well above its usual latency.
+    """
+
+    def __init__(self, maximum: int):
+        self.maximum = max(maximum, 1)
+        self.limit = float(self.maximum)
+        self.active = 0
+        self.condition = threading.Condition()
+        self.baseline: Optional[float] = None
+        self.samples = 0
+
+    def acquire(self) -> None:
+        with self.condition:
+            while self.active >= int(self.limit):
+                self.condition.wait()
+            self.active += 1
+
+    def slow(self, latency: float) -> bool:
+        """Record a request's latency, returning whether it is well above usual."""
+        slow = (
+            self.baseline is not None
+            and self.samples >= LATENCY_WARMUP
+            and latency > max(LATENCY_MIN, LATENCY_FACTOR * self.baseline)
+        )
+
+        if self.baseline is None:
+            self.baseline = latency
+        else:
+            self.baseline += LATENCY_SMOOTHING * (latency - self.baseline)
+        self.samples += 1
+
+        return slow
+
+    def release(self, congested: bool, latency: Optional[float] = None) -> None:
+        with self.condition:
+            self.active -= 1
+            if latency is not None and self.slow(latency):
+                congested = True
+
+            if congested:
+                self.limit = max(1.0, self.limit / 2)
+                logger.info(f"Reduced Kubernetes request concurrency to {self.limit}")
+            else:
+                self.limit = min(float(self.maximum), self.limit + 1 / self.limit)
+            self.condition.notify_all()
+
+
+def retry_after(e: ApiException) -> Optional[float]:
+    value = (e.headers or {}).get("Retry-After")
+    if value is None:
+        return None
+
+    try:
+        return max(float(value), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff(attempt: int) -> float:
+    """Exponential backoff with full jitter."""
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2**attempt))
+
+
+class RateLimiter:
+    def __init__(self, qps: float, burst: int, concurrency: int, max_retries: int):
+        self.bucket = TokenBucket(qps, burst)
+        self.concurrency = AdaptiveLimiter(concurrency)
+        self.max_retries = max_retries
+
+    def call(self, func: Callable[[], T]) -> T:
+        """Call func once permitted, retrying throttled and failed requests."""
+        attempt = 0
+
+        while True:
+            self.bucket.acquire()
+            self.concurrency.acquire()
+            start = time.monotonic()
+            try:
+                result = func()
+            except ApiException as e:
+                delay = retry_after(e)
+                self.concurrency.release(
+                    e.status in RETRY_STATUSES or delay is not None,
+                )
+                if e.status not in RETRY_STATUSES or attempt >= self.max_retries:
+                    raise
+
+                if delay is None:
+                    delay = backoff(attempt)
+                else:
+                    # Spread out clients told to retry at the same time
+                    delay += random.uniform(0, BACKOFF_BASE)
+                attempt += 1
+                logger.warning(
+                    f"Kubernetes request failed with {e.status}, retrying in "
+                    f"{delay:.1f}s ({attempt}/{self.max_retries})",
+                )
+                time.sleep(delay)
+                continue
+            except BaseException:
+                self.concurrency.release(False)
+                raise
+
+            self.concurrency.release(False, time.monotonic() - start)
+            return result
+
+
+rate_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter() -> RateLimiter:
+    """The rate limiter for the session's cluster."""
+    current = session()
+
+    with rate_limiter_lock:
+        if current.rate_limiter is None:
+            current.rate_limiter = RateLimiter(
+                config["kube"]["qps"],
+                config["kube"]["burst"],
+                config["kube"]["concurrency"],
+                config["kube"]["max_retries"],
+            )
+
+    return current.rate_limiter
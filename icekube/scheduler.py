@@ -0,0 +1,318 @@
+from __future__ import annotations
+
+import logging
+import re
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Future,
+    ThreadPoolExecutor,
+    wait,
+)
+from typing import TYPE_CHECKING, Any, Dict, List, NamedTuple, Optional, Set
+
+from icekube.attack_paths import (
+    ANY_ATTACK_PATH,
+    attack_path_dependencies,
+    attack_paths,
+    scoped_attack_paths,
+)
+from icekube.builds import current_build
+from icekube.checkpoint import Checkpoint
+from icekube.config import config
+from icekube.neo4j import (
+    count_matches,
+    delete_batched,
+    get_driver,
+    new_generation,
+)
+
+# tqdm is imported when progress is first shown, see benchmarks/import_time.py
+if TYPE_CHECKING:
+    from neo4j import Transaction
+
+logger = logging.getLogger(__name__)
+
+# Relationship types read by a query, e.g. -[:GRANTS_GET|GRANTS_LIST]->, to
+# find the neighbourhood of a change, see `icekube.diff`
+RELATIONSHIP_TYPES = re.compile(r"\[\w*:([\w|]+)")
+
+
+class Task(NamedTuple):
+    relationship: str
+    part: int
+    query: str
+    scoped: bool = False
+
+    def __str__(self) -> str:
+        return f"{self.relationship}[{self.part}]"
+
+
+class IdChunk(NamedTuple):
+    """Source nodes of an attack path transaction.
+
+    Either every node with an id between `first` and `last`, or only `ids`.
+    """
+
+    first: int
+    last: int
+    ids: Optional[List[int]] = None
+
+
+def rule_tasks() -> List[Task]:
+    tasks: List[Task] = []
+    scoped_targets = config["graph"]["scoped_targets"]
+
+    for relationship, query in attack_paths.items():
+        scoped = scoped_targets and relationship in scoped_attack_paths
+        if scoped:
+            query = scoped_attack_paths[relationship]
+        if isinstance(query, str):
+            query = [query]
+        for idx, q in enumerate(query):
+            tasks.append(Task(relationship, idx, q, scoped))
+
+    return tasks
+
+
+def read_relationships(task: Task) -> Set[str]:
+    types: Set[str] = set()
+    for match in RELATIONSHIP_TYPES.findall(task.query):
+        types.update(match.split("|"))
+    return types
+
+
+def declared_dependencies(relationship: str) -> Set[str]:
+    return set(attack_path_dependencies.get(relationship, []))
+
+
+def task_dependencies(tasks: List[Task]) -> Dict[Task, Set[Task]]:
+    """Which attack path queries must complete before another runs.
+
+    A query depends on every query of the rules declared for it in
+    `attack_path_dependencies`. Those depending on ANY_ATTACK_PATH depend on
+    every rule that does not itself.
+    """
+    rules = {x.relationship for x in tasks}
+    dependencies: Dict[Task, Set[Task]] = {}
+
+    for task in tasks:
+        declared = declared_dependencies(task.relationship)
+        unknown = declared - rules - {ANY_ATTACK_PATH}
+        if unknown:
+            raise Exception(
+                f"Attack path {task.relationship} depends on unknown rules: "
+                f"{', '.join(sorted(unknown))}",
+            )
+
+        deps = {
+            x
+            for x in tasks
+            if x.relationship != task.relationship and x.relationship in declared
+        }
+        if ANY_ATTACK_PATH in declared:
+            deps.update(
+                x
+                for x in tasks
+                if x.relationship != task.relationship
+                and ANY_ATTACK_PATH not in declared_dependencies(x.relationship)
+            )
+        dependencies[task] = deps
+
+    # Fail fast on a cycle rather than deadlocking the scheduler
+    remaining = {task: set(deps) for task, deps in dependencies.items()}
+    while remaining:
+        ready = [task for task, deps in remaining.items() if not deps]
+        if not ready:
+            raise Exception(
+                "Cyclic attack path dependencies: "
+                f"{', '.join(str(x) for x in remaining)}",
+            )
+        for task in ready:
+            del remaining[task]
+        for deps in remaining.values():
+            deps.difference_update(ready)
+
+    return dependencies
+
+
+def node_id_chunks(
+    chunk_size: int,
+    ids: Optional[List[int]] = None,
+) -> List[IdChunk]:
+    """Ranges of up to `chunk_size` node ids, or chunks of `ids` when given.
+
+    Ranges are paged through on the server, each page only returning its
+    first and last id, so node ids are never held in memory.
+    """
+    if ids is not None:
+        ids = sorted(ids)
+        return [
+            IdChunk(chunk[0], chunk[-1], chunk)
+            for chunk in (
+                ids[idx : idx + chunk_size] for idx in range(0, len(ids), chunk_size)
+            )
+        ]
+
+    build = current_build()
+    cmd = (
+        "MATCH (n) WHERE id(n) > $last "
+        + ("AND n.build = $build " if build else "")
+        + "WITH id(n) AS id ORDER BY id LIMIT $size "
+        "RETURN min(id) AS first, max(id) AS last"
+    )
+
+    chunks: List[IdChunk] = []
+    last = -1
+    with get_driver().session() as session:
+        while True:
+            record = session.run(cmd, last=last, size=chunk_size, build=build).single()
+            if record is None or record["first"] is None:
+                return chunks
+            chunks.append(IdChunk(record["first"], record["last"]))
+            last = record["last"]
+
+
+def chunked_query(task: Task) -> str:
+    properties = "attack_path: 1"
+    if task.scoped:
+        properties += ", scoped: true"
+
+    # Ranges are sought an id at a time, rather than scanned for, and also
+    # hold nodes of other builds. Attack paths never cross clusters or builds,
+    # when several share the graph
+    return (
+        "UNWIND coalesce($ids, range($first, $last)) AS id "
+        "MATCH (src) WHERE id(src) = id "
+        "AND coalesce(src.build, '') = coalesce($build, '') WITH src "
+        + task.query
+        + " WITH src, dest WHERE coalesce(src.cluster, '') = coalesce(dest.cluster, '')"
+        + " AND coalesce(src.build, '') = coalesce(dest.build, '')"
+        + f" MERGE (src)-[:{task.relationship} {{ {properties} }}]->(dest)"
+    )
+
+
+def _run(tx: Transaction, cmd: str, kwargs: Dict[str, Any]) -> None:
+    tx.run(cmd, **kwargs).consume()
+
+
+def run_chunk(task: Task, chunk: IdChunk) -> None:
+    cmd = chunked_query(task)
+    logger.debug(f"Starting neo4j query: {cmd}, nodes {chunk.first}-{chunk.last}")
+    kwargs = {**chunk._asdict(), "build": current_build()}
+    with get_driver().session() as session:
+        # write_transaction retries transient errors such as deadlocks
+        session.write_transaction(_run, cmd, kwargs)
+
+
+def run_attack_paths(
+    workers: Optional[int] = None,
+    chunk_size: Optional[int] = None,
+    source_ids: Optional[List[int]] = None,
+    checkpoint: Optional[Checkpoint] = None,
+) -> None:
+    """Run every attack path rule, from all nodes or only from `source_ids`.
+
+    Each chunk of each rule completed is recorded in `checkpoint`, and
+    skipped when resuming.
+    """
+    workers = workers or config["attack_paths"]["workers"]
+    chunk_size = chunk_size or config["attack_paths"]["chunk_size"]
+
+    tasks = rule_tasks()
+    dependencies = task_dependencies(tasks)
+    chunks = node_id_chunks(chunk_size, source_ids)
+
+    pending: Dict[Task, int] = {task: len(chunks) for task in tasks}
+    waiting = {task: set(deps) for task, deps in dependencies.items()}
+    running: Dict[Future[None], Task] = {}
+
+    from tqdm import tqdm
+
+    progress = tqdm(total=len(tasks) * len(chunks))
+
+    def chunk_done(task: Task, chunk: IdChunk) -> bool:
+        return bool(
+            checkpoint and checkpoint.done("attack_paths", f"{task}:{chunk.first}")
+        )
+
+    def run_recorded(task: Task, chunk: IdChunk) -> None:
+        run_chunk(task, chunk)
+        # Recorded as each chunk completes, even after another has failed
+        if checkpoint:
+            checkpoint.complete("attack_paths", f"{task}:{chunk.first}")
+
+    def complete(task: Task) -> None:
+        del pending[task]
+        logger.info(f"Completed attack path query {task}")
+        for deps in waiting.values():
+            deps.discard(task)
+
+    with ThreadPoolExecutor(max_workers=workers) as exc:
+        while pending:
+            ready = [task for task, deps in waiting.items() if not deps]
+            for task in ready:
+                del waiting[task]
+                for chunk in chunks:
+                    if chunk_done(task, chunk):
+                        progress.update(1)
+                        pending[task] -= 1
+                    else:
+                        running[exc.submit(run_recorded, task, chunk)] = task
+                if not pending[task]:
+                    complete(task)
+
+            if not running:
+                continue
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                task = running.pop(future)
+                future.result()
+                progress.update(1)
+                pending[task] -= 1
+                if not pending[task]:
+                    complete(task)
+
+    progress.close()
+
+
+def remove_attack_paths(checkpoint: Optional[Checkpoint] = None) -> None:
+    # Attack paths generated before a failure are kept when resuming
+    if checkpoint and checkpoint.done("remove_attack_paths"):
+        return
+
+    # Typed and directed, so each type is found through its attack_path index
+    # rather than scanning every relationship twice
+    build = current_build()
+    matches = [
+        f"MATCH (src)-[r:{x}]->() WHERE EXISTS (r.attack_path)"
+        + (" AND src.build = $build" if build else "")
+        for x in attack_paths
+    ]
+    total = sum(count_matches(x, "r", build=build) for x in matches)
+
+    from tqdm import tqdm
+
+    print("Removing attack paths")
+    with tqdm(total=total) as progress:
+        for match in matches:
+            delete_batched(match, "r", progress=progress, build=build)
+    print("")
+
+    new_generation()
+    if checkpoint:
+        checkpoint.complete("remove_attack_paths")
+
+
+def setup_attack_paths(checkpoint: Optional[Checkpoint] = None) -> None:
+    if checkpoint and checkpoint.done("attack_paths"):
+        return
+
+    print("Generating attack paths")
+    run_attack_paths(checkpoint=checkpoint)
+    print("")
+
+    # Invalidates cached query results, see `icekube.queries`
+    new_generation()
+    if checkpoint:
+        checkpoint.complete("attack_paths")
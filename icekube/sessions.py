@@ -0,0 +1,84 @@
+from __future__ import annotations
+
+from contextvars import ContextVar
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+    TypeVar,
+)
+
+if TYPE_CHECKING:
+    from kubernetes import client
+
+    from icekube.discovery import Discovery
+    from icekube.models import APIResource, Cluster
+    from icekube.ratelimit import RateLimiter
+
+T = TypeVar("T")
+
+
+class ClusterSession:
+    """State for the cluster being enumerated.
+
+    The default session uses the current kubeconfig context and leaves the
+    cluster out of unique identifiers. Named sessions, used when enumerating
+    several clusters at once, add their cluster to every node's identifiers.
+    """
+
+    def __init__(self, context: Optional[str] = None, name: Optional[str] = None):
+        self.context = context
+        self.name = name
+
+        self.loaded_kube_config = False
+        self.configuration: Optional[client.Configuration] = None
+        self.api_client: Optional[client.ApiClient] = None
+        self.rate_limiter: Optional[RateLimiter] = None
+
+        self.discovery: Optional[Discovery] = None
+        self.preferred_versions: Dict[str, str] = {}
+        self.api_resources_cache: Optional[List[APIResource]] = None
+        self.kind_resources_cache: Optional[Dict[str, APIResource]] = None
+
+        self.cluster: Optional[Cluster] = None
+        # Resources `find_or_mock` finds by lookup_key, rather than in neo4j,
+        # within worker processes. See `Resource.lookups`
+        self.lookups: Optional[Dict[Tuple[Any, ...], Dict[str, Any]]] = None
+
+    def __repr__(self) -> str:
+        return f"ClusterSession(context={self.context!r}, name={self.name!r})"
+
+
+default_session = ClusterSession()
+
+current_session: ContextVar[ClusterSession] = ContextVar(
+    "current_session",
+    default=default_session,
+)
+
+
+def session() -> ClusterSession:
+    return current_session.get()
+
+
+def current_cluster() -> Optional[str]:
+    """Name of the cluster added to unique identifiers, if any."""
+    return session().name
+
+
+def bound(func: Callable[..., T]) -> Callable[..., T]:
+    """Bind func to the current session, for calls in other threads."""
+    bound_session = session()
+
+    def wrapper(*args: Any, **kwargs: Any) -> T:
+        token = current_session.set(bound_session)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            current_session.reset(token)
+
+    return wrapper
@@ -0,0 +1,167 @@
+from __future__ import annotations
+
+import json
+import logging
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, TextIO, Tuple, cast
+
+from icekube.models import APIResource
+from icekube.models.base import ResourceRecord
+from icekube.profiles import kind_included, namespace_included
+from icekube.sessions import session
+from tqdm import tqdm
+
+logger = logging.getLogger(__name__)
+
+METADATA_FILE = "_metadata.json"
+
+
+def read_metadata(path: Path) -> Dict[str, Any]:
+    with open(path / METADATA_FILE) as fs:
+        return cast(Dict[str, Any], json.load(fs))
+
+
+def snapshot_files(path: Path) -> Dict[str, Path]:
+    """Resource files within a snapshot, keyed by resource type."""
+    return {
+        x.name.split(".json")[0]: x
+        for x in sorted(path.glob("*"))
+        if x.name != METADATA_FILE and x.is_file()
+    }
+
+
+def iter_json_array(fs: TextIO, chunk_size: int = 1 << 16) -> Iterator[Any]:
+    """Decode the elements of a JSON array one at a time."""
+    decoder = json.JSONDecoder()
+    buffer = fs.read(chunk_size).lstrip()
+    if not buffer.startswith("["):
+        raise ValueError("Not a JSON array")
+    buffer = buffer[1:]
+    eof = False
+
+    while True:
+        buffer = buffer.lstrip()
+        if buffer.startswith(","):
+            buffer = buffer[1:].lstrip()
+        if buffer.startswith("]"):
+            return
+
+        try:
+            value, end = decoder.raw_decode(buffer)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            chunk = fs.read(chunk_size)
+            eof = not chunk
+            buffer += chunk
+            continue
+
+        yield value
+        buffer = buffer[end:]
+
+
+def is_download(file: Path) -> bool:
+    """Whether a resource file was written by `icekube download`, as an array."""
+    with open(file) as fs:
+        return fs.read(1024).lstrip().startswith("[")
+
+
+def read_objects(file: Path) -> Iterator[Dict[str, Any]]:
+    """Objects within a resource file.
+
+    Files written by `icekube download` are decoded an object at a time,
+    those downloaded via `kubectl get -A -o json` are read in full.
+    """
+    streamed = is_download(file)
+    with open(file) as fs:
+        if streamed:
+            yield from iter_json_array(fs)
+        else:
+            yield from json.load(fs)["items"]
+
+
+def included(obj: Dict[str, Any]) -> bool:
+    """Whether an object is within the enumeration profile and namespaces."""
+    if not kind_included(obj["kind"]):
+        return False
+    if not namespace_included(obj["metadata"].get("namespace")):
+        return False
+    if obj["kind"] == "Namespace":
+        return namespace_included(obj["metadata"]["name"])
+    return True
+
+
+def object_key(obj: Dict[str, Any]) -> Tuple[str, str]:
+    return obj["metadata"].get("namespace") or "", obj["metadata"]["name"]
+
+
+def file_resources(file: Path) -> Iterator[ResourceRecord]:
+    for obj in read_objects(file):
+        if not included(obj):
+            continue
+        yield ResourceRecord.build(
+            apiVersion=obj["apiVersion"],
+            kind=obj["kind"],
+            name=obj["metadata"]["name"],
+            namespace=obj["metadata"].get("namespace"),
+            plural=file.name.split(".")[0],
+            raw=json.dumps(obj, default=str),
+        )
+
+
+def parse_file(file: Path, _: Any) -> Iterator[ResourceRecord]:
+    """Parse a resource file, as a task of the ingest pipeline.
+
+    Records are yielded as each object is decoded, and written in batches, so
+    a file is never held in memory at once. Worker processes return a file's
+    records together, see `parse_hashed`.
+    """
+    yield from file_resources(file)
+
+
+def snapshot_resources(path: Path) -> Iterator[ResourceRecord]:
+    print("Loading files from disk")
+
+    for file in tqdm(snapshot_files(path).values()):
+        yield from file_resources(file)
+    print("")
+
+
+def use_snapshot(path: Path) -> Dict[str, Any]:
+    """Enumerate from a snapshot written by `icekube download`, not a cluster."""
+    metadata = read_metadata(path)
+
+    from icekube import icekube, indices, kube
+
+    kube.kube_version = lambda: cast(str, metadata["kube_version"])
+    kube.context_name = lambda: cast(str, metadata["context_name"])
+    kube.api_versions = lambda: cast(List[str], metadata["api_versions"])
+    session().preferred_versions.update(metadata["preferred_versions"])
+    kube.api_resources = lambda: cast(
+        List[APIResource],
+        [APIResource(**x) for x in metadata["api_resources"]],
+    )
+
+    indices.api_resources = kube.api_resources
+    icekube.context_name = kube.context_name
+    icekube.kube_version = kube.kube_version
+
+    def all_resources(
+        preferred_versions_only: bool = True,
+        ignore: Optional[List[str]] = None,
+    ) -> Iterator[ResourceRecord]:
+        return snapshot_resources(path)
+
+    def list_tasks(
+        preferred_versions_only: bool = True,
+        ignore: Optional[List[str]] = None,
+    ) -> List[Path]:
+        return list(snapshot_files(path).values())
+
+    kube.all_resources = all_resources
+    # Each file is a task for the ingest pipeline, streamed by its parsers
+    icekube.list_tasks = list_tasks  # type: ignore[assignment]
+    icekube.fetch_task = lambda file: file  # type: ignore
+    icekube.parse_task = parse_file  # type: ignore[assignment]
+
+    return metadata
@@ -1,4 +1,11 @@
+import hashlib
+import json
 import re
+from typing import Any, Dict, Sequence
+
+# Fields which change without the object itself changing
+VOLATILE_METADATA = ["resourceVersion", "managedFields"]
+VOLATILE_FIELDS = ["status"]
 
 
 def to_camel_case(string: str) -> str:
@@ -6,3 +13,28 @@ def to_camel_case(string: str) -> str:
     string = re.sub(r"([a-z\d])([A-Z])", r"\1_\2", string)
     string = string.replace("-", "_")
     return string.lower()
+
+
+def normalise(
+    obj: Dict[str, Any],
+    fields: Sequence[str] = VOLATILE_FIELDS,
+) -> Dict[str, Any]:
+    """Strip the fields of an object which change on every write or status update.
+
+    Status updates are kept when `fields` doesn't include `status`.
+    """
+    metadata = {
+        key: value
+        for key, value in obj.get("metadata", {}).items()
+        if key not in VOLATILE_METADATA
+    }
+    return {
+        **{key: value for key, value in obj.items() if key not in fields},
+        "metadata": metadata,
+    }
+
+
+def content_hash(value: Any) -> str:
+    """Stable hash of a JSON serialisable value."""
+    data = json.dumps(value, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.blake2b(data.encode(), digest_size=16).hexdigest()
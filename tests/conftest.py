@@ -0,0 +1,16 @@
+import copy
+from typing import Any, Dict, Iterator, cast
+
+import pytest
+from icekube.config import config
+
+
+@pytest.fixture(autouse=True)
+def restore_config() -> Iterator[None]:
+    """Commands set the global config from their options, reset it after."""
+    sections = cast(Dict[str, Dict[str, Any]], config)
+    original = copy.deepcopy(sections)
+    yield
+    for key, value in original.items():
+        sections[key].clear()
+        sections[key].update(value)
@@ -0,0 +1,96 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List
+
+import pytest
+from icekube import ratelimit
+from icekube.api_client import api_client, get_raw
+from icekube.config import config
+from icekube.sessions import ClusterSession, bound, current_session
+from kubernetes import client
+from kubernetes.client.exceptions import ApiException
+
+
+@pytest.fixture
+def cluster() -> Iterator[ClusterSession]:
+    current = ClusterSession("a", "cluster-a")
+    current.configuration = client.Configuration()
+    current.configuration.host = "https://a"
+    token = current_session.set(current)
+    try:
+        yield current
+    finally:
+        current_session.reset(token)
+
+
+def test_shared_within_a_session(cluster):
+    # Created once, however many threads ask for it first
+    get = bound(api_client)
+    with ThreadPoolExecutor(max_workers=8) as exc:
+        clients = list(exc.map(lambda _: get(), range(32)))
+
+    shared = api_client()
+    assert all(x is shared for x in clients)
+    assert cluster.api_client is shared
+    assert shared.configuration.host == "https://a"
+
+    other = ClusterSession("b", "cluster-b")
+    other.configuration = client.Configuration()
+    token = current_session.set(other)
+    try:
+        assert api_client() is not shared
+    finally:
+        current_session.reset(token)
+
+
+@pytest.mark.parametrize("configured,expected", [(None, 32), (4, 32), (64, 64)])
+def test_pool_sized_to_concurrency(cluster, configured, expected):
+    config["kube"]["concurrency"] = 32
+    cluster.configuration.connection_pool_maxsize = configured
+
+    shared = api_client()
+
+    assert shared.configuration.connection_pool_maxsize == expected
+    pool_kw = shared.rest_client.pool_manager.connection_pool_kw
+    assert pool_kw["maxsize"] == expected
+
+
+def test_requests_compressed(cluster):
+    assert api_client().default_headers["Accept-Encoding"] == "gzip"
+
+
+class Response:
+    def __init__(self, data: bytes):
+        self.data = data
+
+
+class FakeApiClient:
+    def __init__(self, failures: int = 0):
+        self.failures = failures
+        self.calls: List[Dict[str, Any]] = []
+
+    def call_api(self, path: str, method: str, **kwargs: Any) -> Response:
+        self.calls.append({"path": path, "method": method, **kwargs})
+        if self.failures:
+            self.failures -= 1
+            raise ApiException(status=503)
+        return Response(bytearray(b'{"items": []}'))
+
+
+def test_get_raw(cluster, monkeypatch):
+    config["kube"]["max_retries"] = 1
+    monkeypatch.setattr(ratelimit.time, "sleep", lambda seconds: None)
+    fake = FakeApiClient(failures=1)
+    cluster.api_client = fake
+
+    body = get_raw("/api/v1/pods", [("limit", "500")], "application/json;as=Table")
+
+    assert body == b'{"items": []}'
+    assert isinstance(body, bytes)
+    # Retried by the session's rate limiter
+    assert len(fake.calls) == 2
+    call = fake.calls[-1]
+    assert call["path"] == "/api/v1/pods"
+    assert call["method"] == "GET"
+    assert call["query_params"] == [("limit", "500")]
+    assert call["header_params"] == {"Accept": "application/json;as=Table"}
+    assert call["_preload_content"] is False
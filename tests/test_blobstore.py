@@ -0,0 +1,102 @@
+import json
+from typing import Any, Dict, Iterator, List
+
+import pytest
+from icekube import blobstore, neo4j
+from icekube.blobstore import BlobStore
+from icekube.neo4j import find
+
+
+def pod(name: str, owner: str = "rs-1") -> str:
+    return json.dumps(
+        {
+            "apiVersion": "v1",
+            "kind": "Pod",
+            "metadata": {
+                "name": name,
+                "namespace": "default",
+                "ownerReferences": [{"uid": owner}],
+                "labels": {"app": "web", "tier": "frontend"},
+            },
+            "spec": {"containers": [{"name": "web", "image": "nginx:1.25"}]},
+        },
+    )
+
+
+def count(store: BlobStore, table: str) -> int:
+    return int(store.connection.execute(f"SELECT count(*) FROM {table}").fetchone()[0])
+
+
+@pytest.fixture
+def store(tmp_path) -> BlobStore:
+    return BlobStore(str(tmp_path / "blobs.db"))
+
+
+def test_put_deduplicates(store):
+    first = store.put_many([pod("a"), pod("a"), pod("b")])
+    second = store.put_many([pod("b"), pod("c")])
+
+    assert first[0] == first[1]
+    assert second[0] == first[2]
+    assert count(store, "blobs") == 3
+
+
+def test_template_round_trip(store, tmp_path):
+    # Replicas of the same owner are compressed against the first stored
+    raws = [pod(f"web-{x}") for x in range(3)] + [pod("x", "rs-2")]
+    digests = store.put_many(raws)
+    assert count(store, "templates") == 2
+
+    # Templates are loaded again when the store is reopened
+    reopened = BlobStore(str(tmp_path / "blobs.db"))
+    assert reopened.get_many(digests) == dict(zip(digests, raws))
+
+
+def test_prune_keeps_referenced(store):
+    kept, removed, other = store.put_many([pod("a"), pod("b"), pod("c", "rs-2")])
+
+    assert store.prune(iter([kept])) == 2
+    assert store.get_many([kept, removed, other]) == {kept: pod("a")}
+    # The template of the other owner is no longer used
+    assert count(store, "templates") == 1
+
+
+class FakeSession:
+    def __init__(self, records: List[Dict[str, Any]]):
+        self.records = records
+
+    def __enter__(self) -> "FakeSession":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        pass
+
+    def run(self, cmd: str, params: Dict[str, Any]) -> Iterator[List[Dict[str, Any]]]:
+        return iter([dict(x)] for x in self.records)
+
+
+class FakeDriver:
+    def __init__(self, records: List[Dict[str, Any]]):
+        self.records = records
+
+    def session(self, **kwargs: Any) -> FakeSession:
+        return FakeSession(self.records)
+
+
+def test_find_resolves_raw_hashes(store, monkeypatch):
+    monkeypatch.setattr(blobstore, "get_blob_store", lambda: store)
+
+    (digest,) = store.put_many([pod("a")])
+    node = {
+        "apiVersion": "v1",
+        "kind": "Pod",
+        "plural": "pods",
+        "namespace": "default",
+        "name": "a",
+        "raw": None,
+        "raw_hash": digest,
+    }
+    monkeypatch.setattr(neo4j, "get_driver", lambda: FakeDriver([node]))
+
+    (resource,) = find(raw=True)
+    assert resource.raw == pod("a")
@@ -0,0 +1,131 @@
+from typing import Any, Dict, List, Optional
+
+import pytest
+from icekube import builds
+from icekube.builds import (
+    BuildSwitchFailed,
+    build_pointers,
+    collect_garbage,
+    start_build,
+    switch_build,
+)
+from icekube.cli import app
+from typer.testing import CliRunner
+
+
+class Record(Dict[str, Any]):
+    def data(self) -> Dict[str, Any]:
+        return dict(self)
+
+
+class FakeResult(List[Record]):
+    def single(self) -> Optional[Record]:
+        return self[0] if self else None
+
+    def consume(self) -> None:
+        pass
+
+
+class FakeSession:
+    """Applies the statements of `icekube.builds` to a `Meta` node."""
+
+    def __init__(self, meta: Dict[str, Any]):
+        self.meta = meta
+
+    def __enter__(self) -> "FakeSession":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        pass
+
+    def run(self, cmd: str, **params: Any) -> FakeResult:
+        meta = self.meta
+        if "RETURN m.serving_build" in cmd:
+            if not meta:
+                return FakeResult()
+            return FakeResult(
+                [
+                    Record(
+                        serving=meta.get("serving_build"),
+                        pending=meta.get("pending_build"),
+                        builds=meta.get("builds", []),
+                    ),
+                ],
+            )
+        if cmd.startswith("MERGE (m:Meta"):
+            meta["pending_build"] = params["build"]
+            builds = [x for x in meta.get("builds", []) if x != params["build"]]
+            meta["builds"] = builds + [params["build"]]
+        elif "WHERE m.pending_build = $build" in cmd:
+            if meta.get("pending_build") != params["build"]:
+                return FakeResult()
+            meta["serving_build"] = params["build"]
+            meta["pending_build"] = None
+            meta["generation"] = params["generation"]
+            return FakeResult([Record(m=meta)])
+        elif "SET m.builds" in cmd:
+            meta["builds"] = [x for x in meta["builds"] if x != params["build"]]
+        return FakeResult()
+
+
+class FakeDriver:
+    def __init__(self, meta: Dict[str, Any]):
+        self.meta = meta
+
+    def session(self, **kwargs: Any) -> FakeSession:
+        return FakeSession(self.meta)
+
+
+@pytest.fixture
+def meta(monkeypatch) -> Dict[str, Any]:
+    meta: Dict[str, Any] = {}
+    monkeypatch.setattr(builds, "get_driver", lambda: FakeDriver(meta))
+    monkeypatch.setattr(builds, "count_matches", lambda *args, **kwargs: 0)
+    monkeypatch.setattr(builds, "prune_blobs", lambda: None)
+    return meta
+
+
+def test_build_lifecycle(meta, monkeypatch):
+    deleted: List[str] = []
+    monkeypatch.setattr(
+        builds,
+        "delete_batched",
+        lambda match, var, **kwargs: deleted.append(kwargs["build"]),
+    )
+
+    first = start_build()
+    switch_build(first)
+    generation = meta["generation"]
+
+    # A second run is abandoned when a third starts
+    abandoned = start_build()
+    assert build_pointers() == {
+        "serving": first,
+        "pending": abandoned,
+        "builds": [first, abandoned],
+    }
+    latest = start_build()
+    with pytest.raises(BuildSwitchFailed):
+        switch_build(abandoned)
+
+    switch_build(latest)
+    assert meta["generation"] != generation
+
+    assert collect_garbage() == [first, abandoned]
+    assert set(deleted) == {first, abandoned}
+    assert build_pointers() == {"serving": latest, "pending": None, "builds": [latest]}
+
+
+def test_resume_continues_pending_build(meta):
+    pending = start_build()
+
+    assert start_build(resume=True) == pending
+    assert start_build(resume=False) != pending
+
+
+@pytest.mark.parametrize("command", ["enumerate", "relationships"])
+def test_blue_green_requires_run(command):
+    result = CliRunner().invoke(app, ["--blue-green", command])
+
+    assert result.exit_code == 2
+    assert "icekube --blue-green run" in result.output
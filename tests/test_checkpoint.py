@@ -0,0 +1,146 @@
+from typing import Any, Dict, List
+
+import pytest
+from icekube import icekube, kube
+from icekube.checkpoint import Checkpoint, CheckpointMismatch
+from icekube.config import config
+from icekube.icekube import enumerate_resource_kind, run_deferred
+from icekube.models import APIResource
+from icekube.pipeline import TaskFailed
+from icekube.sessions import ClusterSession, current_session
+
+RUN = {"url": "bolt://localhost:7687", "contexts": None, "ignore": ""}
+
+
+def commands(*names: str) -> List[Any]:
+    return [(name, {}) for name in names]
+
+
+class FakeSession:
+    def __init__(self, statements: List[str], fail: str):
+        self.statements = statements
+        self.fail = fail
+
+    def __enter__(self) -> "FakeSession":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        pass
+
+    def run(self, cmd: str, kwargs: Dict[str, Any]) -> None:
+        if cmd == self.fail:
+            raise Exception("neo4j restarted")
+        self.statements.append(cmd)
+
+
+class FakeDriver:
+    def __init__(self, fail: str = ""):
+        self.statements: List[str] = []
+        self.fail = fail
+
+    def session(self, **kwargs: Any) -> FakeSession:
+        return FakeSession(self.statements, self.fail)
+
+
+def test_resume_skips_recorded_steps(tmp_path):
+    path = str(tmp_path / "checkpoint.json")
+    checkpoint = Checkpoint(path, RUN)
+    checkpoint.complete("enumerate", "pods")
+    # A step being written when the run failed
+    with open(path, "a") as fs:
+        fs.write('"|enumerate|secrets"')
+
+    resumed = Checkpoint(path, RUN, resume=True)
+    assert resumed.done("enumerate", "pods")
+    assert not resumed.done("enumerate", "secrets")
+
+    with pytest.raises(CheckpointMismatch):
+        Checkpoint(path, {**RUN, "ignore": "events"}, resume=True)
+    # Without resuming, the run starts again
+    assert not Checkpoint(path, RUN).done("enumerate", "pods")
+
+
+@pytest.mark.parametrize("path", [None, "checkpoint.json"])
+def test_deferred_chunks(tmp_path, path):
+    checkpoint = Checkpoint(str(tmp_path / path) if path else None, RUN)
+    checkpoint.add_deferred(commands("a", "b", "c"))
+    checkpoint.add_deferred(commands("d", "e"))
+
+    other = ClusterSession("other")
+    other.name = "other"
+    token = current_session.set(other)
+    try:
+        checkpoint.add_deferred(commands("x"))
+        assert list(checkpoint.deferred(2)) == [commands("x")]
+    finally:
+        current_session.reset(token)
+
+    assert list(checkpoint.deferred(2)) == [
+        commands("a", "b"),
+        commands("c", "d"),
+        commands("e"),
+    ]
+
+    checkpoint.clear()
+    assert list(checkpoint.deferred(2)) == []
+
+
+def test_resume_deferred_chunks(tmp_path, monkeypatch):
+    monkeypatch.setattr(icekube, "DEFERRED_CHUNK_SIZE", 2)
+    path = str(tmp_path / "checkpoint.json")
+    checkpoint = Checkpoint(path, RUN)
+    checkpoint.add_deferred(commands("a", "b", "c", "d", "e"))
+
+    with pytest.raises(Exception):
+        run_deferred(FakeDriver(fail="d"), checkpoint)
+
+    driver = FakeDriver()
+    run_deferred(driver, Checkpoint(path, RUN, resume=True))
+    # The chunk which failed is run again in full
+    assert driver.statements == ["c", "d", "e"]
+
+
+@pytest.mark.parametrize("pipeline", [True, False])
+def test_failed_tasks_are_not_recorded(tmp_path, monkeypatch, pipeline):
+    config["ingest"]["pipeline"] = pipeline
+    fetched: List[str] = []
+    failing = {"secrets"}
+
+    def fetch_task(task: str) -> bytes:
+        fetched.append(task)
+        if task in failing:
+            raise TaskFailed(task)
+        return b""
+
+    monkeypatch.setattr(icekube, "existing_hashes", lambda: set())
+    monkeypatch.setattr(icekube, "context_name", lambda: "test")
+    monkeypatch.setattr(icekube, "kube_version", lambda: "v1.29.0")
+    monkeypatch.setattr(
+        kube,
+        "api_resource_for_kind",
+        lambda kind: APIResource(
+            name=f"{kind.lower()}s",
+            namespaced=False,
+            group="v1",
+            kind=kind,
+            verbs=[],
+        ),
+    )
+    monkeypatch.setattr(icekube, "list_tasks", lambda ignore: ["pods", "secrets"])
+    monkeypatch.setattr(icekube, "fetch_task", fetch_task)
+    monkeypatch.setattr(icekube, "parse_task", lambda task, body: [])
+    monkeypatch.setattr(icekube, "write_resources", lambda batch: None)
+
+    path = str(tmp_path / "checkpoint.json")
+    checkpoint = Checkpoint(path, RUN)
+    with pytest.raises(Exception, match="1 list calls failed"):
+        enumerate_resource_kind(checkpoint=checkpoint)
+
+    assert checkpoint.done("enumerate", "pods")
+    assert not checkpoint.done("enumerate", "secrets")
+    assert not checkpoint.done("enumerate")
+
+    fetched.clear()
+    failing.clear()
+    enumerate_resource_kind(checkpoint=Checkpoint(path, RUN, resume=True))
+    assert fetched == ["secrets"]
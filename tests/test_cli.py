@@ -0,0 +1,49 @@
+import pytest
+import typer
+from icekube import kube
+from icekube.cli import app, resolve_contexts
+from typer.testing import CliRunner
+
+CONTEXTS = {
+    "prod-eu": "prod-eu",
+    "prod-us": "prod-us",
+    "prod-us-admin": "prod-us",
+    "staging": "staging",
+}
+
+
+@pytest.fixture(autouse=True)
+def kubeconfig(monkeypatch):
+    monkeypatch.setattr(kube, "context_clusters", lambda: dict(CONTEXTS))
+
+
+@pytest.mark.parametrize(
+    "contexts,resolved",
+    [
+        ("staging", ["staging"]),
+        ("prod-eu,staging", ["prod-eu", "staging"]),
+        # Globs are expanded in kubeconfig order, each context only once
+        ("prod-??,staging", ["prod-eu", "prod-us", "staging"]),
+        ("staging,prod-e*,*-eu", ["staging", "prod-eu"]),
+    ],
+)
+def test_resolve_contexts(contexts, resolved):
+    assert resolve_contexts(contexts) == resolved
+
+
+def test_unmatched_pattern():
+    with pytest.raises(typer.BadParameter, match="No kubeconfig contexts match dev-*"):
+        resolve_contexts("staging,dev-*")
+
+
+@pytest.mark.parametrize("contexts", ["prod-us,prod-us-admin", "prod-*"])
+def test_contexts_of_the_same_cluster(contexts):
+    with pytest.raises(typer.BadParameter, match="both use cluster prod-us"):
+        resolve_contexts(contexts)
+
+
+def test_clash_rejected_before_enumerating():
+    result = CliRunner().invoke(app, ["enumerate", "--contexts", "prod-*"])
+
+    assert result.exit_code == 2
+    assert "prod-us-admin" in result.output
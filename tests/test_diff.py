@@ -0,0 +1,144 @@
+import json
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import pytest
+from icekube import diff
+from icekube.diff import ObjectChange, diff_objects
+
+A = "diff:a:old"
+B = "diff:b:new"
+
+
+class Record(Dict[str, Any]):
+    def data(self) -> Dict[str, Any]:
+        return dict(self)
+
+
+class FakeResult(List[Record]):
+    def single(self) -> Optional[Record]:
+        return self[0] if self else None
+
+
+def node(kind: str, name: str, namespace: Optional[str] = None) -> Record:
+    return Record(apiVersion="v1", kind=kind, namespace=namespace, name=name)
+
+
+# Node ids of each snapshot. An existing pod shares the node with a new one
+NODES: Dict[int, Tuple[str, Record]] = {
+    1: (A, node("Pod", "existing", "default")),
+    2: (A, node("Node", "node-1")),
+    3: (A, node("ServiceAccount", "existing", "default")),
+    11: (B, node("Pod", "existing", "default")),
+    12: (B, node("Node", "node-1")),
+    13: (B, node("ServiceAccount", "existing", "default")),
+    14: (B, node("Pod", "new", "default")),
+    15: (B, node("ServiceAccount", "new", "default")),
+}
+
+EDGES = [(1, 3), (11, 13), (14, 15)]
+
+
+class FakeSession:
+    def __enter__(self) -> "FakeSession":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        pass
+
+    def run(self, cmd: str, **params: Any) -> FakeResult:
+        if "UNWIND $changes" in cmd:
+            # The new pod's neighbourhood, through its node, in its snapshot
+            assert [x["cluster"] for x in params["changes"]] == [B]
+            return FakeResult(NODES[x][1] for x in [14, 12, 11, 15])
+        if "UNWIND $keys" in cmd:
+            return FakeResult(
+                Record(id=id)
+                for id, (cluster, data) in NODES.items()
+                if cluster in params["clusters"] and data in params["keys"]
+            )
+        if "UNWIND $ids" in cmd:
+            return FakeResult(
+                Record(
+                    cluster=NODES[src][0],
+                    relationship="USES_ACCOUNT",
+                    source=NODES[src][1],
+                    target=NODES[dest][1],
+                )
+                for src, dest in EDGES
+                if src in params["ids"]
+            )
+        return FakeResult()
+
+
+class FakeDriver:
+    def session(self, **kwargs: Any) -> FakeSession:
+        return FakeSession()
+
+
+def test_new_pod_reports_only_its_own_edges(monkeypatch, tmp_path):
+    monkeypatch.setattr(diff, "get_driver", FakeDriver)
+    monkeypatch.setattr(diff, "clear_cluster", lambda cluster: None)
+    monkeypatch.setattr(diff, "load_snapshot", lambda path, cluster: None)
+    monkeypatch.setattr(diff, "traversed_relationships", lambda: ["HOSTED_ON"])
+    sources: List[int] = []
+    monkeypatch.setattr(
+        diff,
+        "run_attack_paths",
+        lambda source_ids: sources.extend(source_ids),
+    )
+
+    (tmp_path / "old").mkdir()
+    (tmp_path / "new").mkdir()
+    change = ObjectChange("added", "pods", "v1", "Pod", "default", "new")
+    delta = diff.diff_attack_paths(tmp_path / "old", tmp_path / "new", [change])
+
+    # Attack paths are generated for the neighbourhood in both snapshots
+    assert sorted(sources) == [1, 2, 11, 12, 14, 15]
+    assert [(x.change, x.source["name"], x.target["name"]) for x in delta] == [
+        ("added", "new", "new"),
+    ]
+
+
+def config_map(name: str, data: str = "") -> Dict[str, Any]:
+    return {
+        "apiVersion": "v1",
+        "kind": "ConfigMap",
+        "metadata": {"name": name, "namespace": "default", "resourceVersion": "1"},
+        "data": {"value": data},
+    }
+
+
+def write_snapshot(path: Path, objects: List[Dict[str, Any]], kubectl: bool) -> None:
+    path.mkdir()
+    data: Any = {"kind": "List", "items": objects} if kubectl else objects
+    (path / "configmaps.json").write_text(json.dumps(data))
+
+
+@pytest.mark.parametrize("kubectl", [False, True])
+def test_diff_objects(tmp_path, kubectl):
+    old = [config_map("a"), config_map("b"), config_map("c")]
+    new = [config_map("b", "changed"), config_map("c"), config_map("d")]
+    if kubectl:
+        # Not necessarily in key order, so sorted
+        old.reverse()
+    write_snapshot(tmp_path / "old", old, kubectl)
+    write_snapshot(tmp_path / "new", new, kubectl)
+
+    changes = diff_objects(tmp_path / "old", tmp_path / "new")
+    assert [(x.change, x.name) for x in changes] == [
+        ("removed", "a"),
+        ("modified", "b"),
+        ("added", "d"),
+    ]
+
+
+def test_diff_objects_streams_downloads(tmp_path):
+    write_snapshot(tmp_path / "old", [config_map("b"), config_map("a")], False)
+    write_snapshot(tmp_path / "new", [], False)
+
+    changes = diff_objects(tmp_path / "old", tmp_path / "new")
+    # The first entry is yielded before the rest of the file is read
+    assert next(changes).name == "b"
+    with pytest.raises(ValueError, match="not ordered"):
+        next(changes)
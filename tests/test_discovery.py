@@ -0,0 +1,193 @@
+import json
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import pytest
+from icekube.config import config
+from icekube.discovery import discover
+from icekube.sessions import ClusterSession, current_session
+from kubernetes.client.exceptions import ApiException
+
+AGGREGATED = {
+    "/api": {
+        "kind": "APIGroupDiscoveryList",
+        "items": [
+            {
+                "metadata": {},
+                "versions": [
+                    {
+                        "version": "v1",
+                        "resources": [
+                            {
+                                "resource": "pods",
+                                "scope": "Namespaced",
+                                "responseKind": {"kind": "Pod"},
+                                "verbs": ["get", "list"],
+                                "subresources": [
+                                    {"subresource": "exec", "verbs": ["create"]},
+                                ],
+                            },
+                        ],
+                    },
+                ],
+            },
+        ],
+    },
+    "/apis": {
+        "kind": "APIGroupDiscoveryList",
+        "items": [
+            {
+                "metadata": {"name": "apps"},
+                "versions": [
+                    {"version": "v1", "resources": []},
+                    {"version": "v1beta1", "resources": []},
+                ],
+            },
+        ],
+    },
+}
+
+PER_GROUP = {
+    "/api": {"kind": "APIVersions", "versions": ["v1"]},
+    "/apis": {
+        "kind": "APIGroupList",
+        "groups": [
+            {
+                "name": "apps",
+                "preferredVersion": {"version": "v1"},
+                "versions": [{"groupVersion": "apps/v1"}],
+            },
+            {
+                "name": "metrics.k8s.io",
+                "preferredVersion": {"version": "v1beta1"},
+                "versions": [{"groupVersion": "metrics.k8s.io/v1beta1"}],
+            },
+        ],
+    },
+    "/api/v1": {"resources": [{"name": "pods", "kind": "Pod"}]},
+    "/apis/apps/v1": {"resources": [{"name": "deployments", "kind": "Deployment"}]},
+}
+
+
+class Response:
+    def __init__(self, data: bytes):
+        self.data = data
+
+
+class FakeApiClient:
+    def __init__(self, bodies: Dict[str, Any], etags: bool = True):
+        self.bodies = bodies
+        self.etags = etags
+        # Path, and the ETag the request was revalidated with
+        self.requests: List[Tuple[str, Optional[str]]] = []
+
+    def call_api(
+        self,
+        path: str,
+        method: str,
+        header_params: Dict[str, str],
+        **kwargs: Any,
+    ) -> Tuple[Response, int, Dict[str, str]]:
+        etag = header_params.get("If-None-Match")
+        self.requests.append((path, etag))
+        if path not in self.bodies:
+            # e.g. an aggregated API server which is unavailable
+            raise ApiException(status=404)
+
+        body = self.bodies[path]
+        headers = {"ETag": f'"{path}"'} if self.etags else {}
+        if etag is not None and etag == headers.get("ETag"):
+            raise ApiException(status=304)
+        return Response(json.dumps(body).encode()), 200, headers
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path) -> Iterator[None]:
+    config["discovery"]["cache_dir"] = str(tmp_path)
+    yield
+
+
+def run_discover(client: FakeApiClient, host: str = "https://a") -> Any:
+    current = ClusterSession()
+    current.api_client = client
+    token = current_session.set(current)
+    try:
+        return discover(host, "v1.29.0")
+    finally:
+        current_session.reset(token)
+
+
+def test_aggregated_discovery():
+    client = FakeApiClient(AGGREGATED)
+
+    discovery = run_discover(client)
+
+    assert [x for x, _ in client.requests] == ["/api", "/apis"]
+    assert discovery.versions == ["v1", "apps/v1", "apps/v1beta1"]
+    assert discovery.preferred_versions == {"apps": "v1"}
+    assert discovery.resources == [
+        {
+            "name": "pods",
+            "namespaced": True,
+            "kind": "Pod",
+            "verbs": ["get", "list"],
+            "groupVersion": "v1",
+        },
+        {
+            "name": "pods/exec",
+            "namespaced": True,
+            "kind": "Pod",
+            "verbs": ["create"],
+            "groupVersion": "v1",
+        },
+    ]
+
+
+def test_per_group_fallback():
+    client = FakeApiClient(PER_GROUP)
+
+    discovery = run_discover(client)
+
+    assert discovery.versions == ["v1", "apps/v1", "metrics.k8s.io/v1beta1"]
+    assert discovery.preferred_versions == {
+        "apps": "v1",
+        "metrics.k8s.io": "v1beta1",
+    }
+    # A group version which fails is skipped, keeping the rest
+    assert discovery.resources == [
+        {"name": "pods", "kind": "Pod", "groupVersion": "v1"},
+        {"name": "deployments", "kind": "Deployment", "groupVersion": "apps/v1"},
+    ]
+    assert ("/apis/metrics.k8s.io/v1beta1", None) in client.requests
+
+
+@pytest.mark.parametrize("bodies", [AGGREGATED, PER_GROUP])
+def test_revalidated_with_etags(bodies):
+    first = run_discover(FakeApiClient(bodies))
+
+    client = FakeApiClient(bodies)
+    assert run_discover(client) == first
+    # Every cached response is revalidated, and reused as unchanged
+    assert all(etag == f'"{path}"' for path, etag in client.requests if path in bodies)
+
+    # Clusters, and their server versions, have their own cache
+    client = FakeApiClient(bodies)
+    run_discover(client, "https://b")
+    assert all(etag is None for _, etag in client.requests)
+
+
+def test_uncached_without_etags():
+    run_discover(FakeApiClient(PER_GROUP, etags=False))
+
+    client = FakeApiClient(PER_GROUP)
+    run_discover(client)
+    assert all(etag is None for _, etag in client.requests)
+
+
+def test_cache_disabled(tmp_path):
+    config["discovery"]["cache"] = False
+    run_discover(FakeApiClient(AGGREGATED))
+
+    client = FakeApiClient(AGGREGATED)
+    run_discover(client)
+    assert all(etag is None for _, etag in client.requests)
+    assert not list(tmp_path.iterdir())
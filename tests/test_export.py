@@ -0,0 +1,93 @@
+import json
+from typing import Any, Dict, List
+
+from icekube import export
+from icekube.cli import app
+from typer.testing import CliRunner
+
+
+class Record(Dict[str, Any]):
+    def data(self) -> Dict[str, Any]:
+        return dict(self)
+
+
+def edge(source: int, target: int, scoped: bool = False) -> Record:
+    return Record(
+        source_id=source,
+        source_kind="ClusterRoleBinding",
+        source_namespace=None,
+        source_name=f"crb-{source}",
+        source_cluster=None,
+        type="RBAC_ESCALATE_TO" if scoped else "BOUND_TO",
+        scoped=scoped,
+        target_id=target,
+        target_kind="Cluster" if scoped else "Pod",
+        target_namespace=None,
+        target_name=f"node-{target}",
+        target_cluster=None,
+    )
+
+
+class FakeSession:
+    def __init__(self, edges: List[Record], scopes: List[int]):
+        self.edges = edges
+        self.scopes = scopes
+        self.source_batches: List[List[int]] = []
+
+    def __enter__(self) -> "FakeSession":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        pass
+
+    def run(self, cmd: str, params: Dict[str, Any]) -> List[Record]:
+        if "scope <> target" in cmd:
+            return [Record(id=x) for x in self.scopes]
+        self.source_batches.append(params["ids"])
+        return [x for x in self.edges if x["source_id"] in params["ids"]]
+
+
+class FakeDriver:
+    def __init__(self, session: FakeSession):
+        self._session = session
+
+    def session(self, **kwargs: Any) -> FakeSession:
+        return self._session
+
+
+def test_export_source_keeps_scoped_edges(monkeypatch, tmp_path):
+    # Source 1 reaches pod 2, and the cluster scope 10 containing it. Scope 11
+    # contains none of the exported nodes
+    session = FakeSession(
+        [edge(1, 2), edge(1, 10, scoped=True), edge(1, 11, scoped=True), edge(2, 99)],
+        scopes=[10],
+    )
+    monkeypatch.setattr(export, "get_driver", lambda: FakeDriver(session))
+    monkeypatch.setattr(
+        export,
+        "subgraph_nodes",
+        lambda *args: {1, 2},
+    )
+
+    output = tmp_path / "edges.jsonl"
+    result = CliRunner().invoke(
+        app,
+        [
+            "--neo4j-fetch-size",
+            "1",
+            "export",
+            "--source",
+            "ClusterRoleBinding",
+            "-o",
+            str(output),
+        ],
+    )
+    assert result.exit_code == 0, result.output
+
+    edges = [json.loads(x) for x in output.read_text().splitlines()]
+    assert {(x["source_id"], x["target_id"], x["scoped"]) for x in edges} == {
+        (1, 2, False),
+        (1, 10, True),
+    }
+    # Source ids are read a range at a time, rather than in one parameter
+    assert session.source_batches == [[1], [2]]
@@ -0,0 +1,60 @@
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+import pytest
+from icekube import kube
+from icekube.kube import ListTask, fetch_task, parse_task
+from icekube.models import APIResource
+from icekube.models import base as models_base
+from icekube.models.base import LIST_ACCEPT
+
+
+def list_body(kind: str, accept: str) -> bytes:
+    item: Dict[str, Any] = {"metadata": {"name": "app", "namespace": "default"}}
+    if accept == LIST_ACCEPT["full"]:
+        item["spec"] = {"replicas": 3}
+    return json.dumps({"kind": f"{kind}List", "items": [item]}).encode()
+
+
+@pytest.fixture
+def requests(monkeypatch):
+    requests: List[Tuple[str, str]] = []
+
+    def get_raw(path: str, query: List[Tuple[str, str]], accept: str) -> bytes:
+        requests.append((path, accept))
+        return list_body(path.split("/")[-1], accept)
+
+    monkeypatch.setattr(models_base, "get_raw", get_raw)
+    monkeypatch.setattr(kube, "namespace_included", lambda namespace: True)
+    return requests
+
+
+def task(group: str, name: str, kind: str, namespace: Optional[str]) -> ListTask:
+    resource = APIResource(
+        name=name,
+        namespaced=namespace is not None,
+        group=group,
+        kind=kind,
+        verbs=["list"],
+    )
+    return ListTask(resource, namespace)
+
+
+def test_kind_without_model_keeps_spec(requests):
+    deployments = task("apps/v1", "deployments", "Deployment", "default")
+
+    body = fetch_task(deployments)
+    assert body is not None
+    records = parse_task(deployments, body)
+
+    assert requests == [
+        ("/apis/apps/v1/namespaces/default/deployments", LIST_ACCEPT["full"]),
+    ]
+    assert [json.loads(x.raw or "{}")["spec"] for x in records] == [{"replicas": 3}]
+
+
+def test_opted_in_kind_fetches_metadata(requests):
+    fetch_task(task("v1", "configmaps", "ConfigMap", "default"))
+    fetch_task(task("v1", "namespaces", "Namespace", None))
+
+    assert [x for _, x in requests] == [LIST_ACCEPT["metadata"]] * 2
@@ -0,0 +1,123 @@
+import json
+from typing import Any, Dict, List
+
+import pytest
+from icekube import neo4j
+from icekube.models import ConfigMap, Pod
+from icekube.neo4j import find, find_fields, find_query
+from icekube.sessions import ClusterSession, current_session
+
+NODES: List[Dict[str, Any]] = [
+    {
+        "apiVersion": "v1",
+        "kind": "Pod",
+        "plural": "pods",
+        "namespace": "default",
+        "name": "web",
+        "raw": json.dumps({"spec": {"hostPID": True}}),
+    },
+    {
+        "apiVersion": "v1",
+        "kind": "ConfigMap",
+        "plural": "configmaps",
+        "namespace": "default",
+        "name": "settings",
+        "raw": json.dumps({"data": {"large": "x" * 1000}}),
+    },
+]
+
+
+class Record(Dict[str, Any]):
+    def data(self) -> Dict[str, Any]:
+        return dict(self)
+
+
+class FakeSession:
+    """Evaluates the projections of `find_query` over NODES."""
+
+    def __init__(self, queries: List[Any]):
+        self.queries = queries
+
+    def __enter__(self) -> "FakeSession":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        pass
+
+    def run(self, cmd: str, params: Dict[str, Any]) -> List[Any]:
+        self.queries.append((cmd, params))
+        if "RETURN x." in cmd:
+            fields = [x.split(" AS ")[1] for x in cmd.split("RETURN ")[1].split(", ")]
+            return [Record({x: node.get(x) for x in fields}) for node in NODES]
+        if "$hydrate_kinds" in cmd:
+            kinds = params["hydrate_kinds"]
+            return [
+                [{**x, "raw": x["raw"] if x["kind"] in kinds else None}] for x in NODES
+            ]
+        return [[dict(x)] for x in NODES]
+
+
+class FakeDriver:
+    def __init__(self) -> None:
+        self.queries: List[Any] = []
+
+    def session(self, **kwargs: Any) -> FakeSession:
+        return FakeSession(self.queries)
+
+
+@pytest.fixture
+def driver(monkeypatch) -> FakeDriver:
+    driver = FakeDriver()
+    monkeypatch.setattr(neo4j, "get_driver", lambda: driver)
+    return driver
+
+
+def test_find_query_projections():
+    assert find_query(Pod, fields=["name", "kind"], name="web") == (
+        "MATCH (x:Pod { name: $name }) RETURN x.name AS name, x.kind AS kind"
+    )
+    assert "RETURN x { .*, raw: CASE WHEN x.kind IN $hydrate_kinds" in find_query(
+        hydrate=False,
+    )
+    assert find_query(raw=True, exclude=["Pod"]).endswith(
+        "WHERE (EXISTS (x.raw) OR EXISTS (x.raw_hash)) AND NOT (x:Pod) RETURN x",
+    )
+
+
+def test_find_without_hydrating(driver):
+    pod, config_map = find(hydrate=False)
+
+    # Models which parse raw JSON still receive it
+    ((_, params),) = driver.queries
+    assert "Pod" in params["hydrate_kinds"]
+    assert "ConfigMap" not in params["hydrate_kinds"]
+    assert isinstance(pod, Pod) and pod.hostPID
+    assert isinstance(config_map, ConfigMap) and config_map.raw is None
+
+
+def test_find_hydrated(driver):
+    _, config_map = find()
+
+    assert config_map.raw == NODES[1]["raw"]
+
+
+def test_find_fields(driver):
+    fields = list(find_fields())
+
+    assert fields[0]["name"] == "web"
+    assert "raw" not in fields[0]
+    kinds = find_fields(fields=["kind"])
+    assert list(kinds) == [{"kind": "Pod"}, {"kind": "ConfigMap"}]
+
+
+def test_find_within_cluster(driver):
+    current = ClusterSession("a", "cluster-a")
+    token = current_session.set(current)
+    try:
+        list(find_fields(fields=["name"], kind="Pod"))
+    finally:
+        current_session.reset(token)
+
+    ((cmd, params),) = driver.queries
+    assert params == {"kind": "Pod", "cluster": "cluster-a"}
+    assert cmd.startswith("MATCH (x:Resource { kind: $kind, cluster: $cluster })")
@@ -0,0 +1,198 @@
+from typing import Any, Dict, List, Optional
+
+import pytest
+from icekube import indices
+from icekube.config import config
+from icekube.indices import IndexPlan, create_indices, index_plan, stale_constraints
+from icekube.models import APIResource
+
+
+class Result(List[Dict[str, Any]]):
+    def __init__(self, records: List[Dict[str, Any]], plan: Optional[Any] = None):
+        super().__init__(records)
+        self.plan = plan
+
+    def single(self) -> Optional[Dict[str, Any]]:
+        return self[0] if self else None
+
+    def consume(self) -> "Result":
+        return self
+
+
+class FakeSession:
+    def __init__(
+        self,
+        version: str = "4.4.12",
+        edition: str = "enterprise",
+        constraints: Optional[List[str]] = None,
+        plans: Optional[Dict[str, Any]] = None,
+    ):
+        self.version = version
+        self.edition = edition
+        self.constraints = constraints or []
+        self.plans = plans or {}
+        self.statements: List[str] = []
+
+    def __enter__(self) -> "FakeSession":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        pass
+
+    def run(self, cmd: str, *args: Any, **kwargs: Any) -> Result:
+        self.statements.append(cmd)
+        if cmd.startswith("CALL dbms.components()"):
+            return Result([{"version": self.version, "edition": self.edition}])
+        if cmd == "SHOW CONSTRAINTS":
+            return Result([{"name": x} for x in self.constraints])
+        if cmd.startswith("EXPLAIN "):
+            return Result([], self.plans.get(cmd[len("EXPLAIN ") :]))
+        return Result([])
+
+
+class FakeDriver:
+    def __init__(self, session: FakeSession):
+        self._session = session
+
+    def session(self, **kwargs: Any) -> FakeSession:
+        return self._session
+
+
+@pytest.fixture(autouse=True)
+def kinds(monkeypatch):
+    resources = [
+        APIResource(
+            name="pods",
+            namespaced=True,
+            group="v1",
+            kind="Pod",
+            verbs=["list"],
+        ),
+        APIResource(
+            name="clusterroles",
+            namespaced=False,
+            group="rbac.authorization.k8s.io/v1",
+            kind="ClusterRole",
+            verbs=["list"],
+        ),
+        APIResource(
+            name="bindings",
+            namespaced=True,
+            group="v1",
+            kind="Binding",
+            verbs=[],
+        ),
+    ]
+    monkeypatch.setattr(indices, "api_resources", lambda: resources)
+
+
+def plans_by_name() -> Dict[str, IndexPlan]:
+    return {x.name: x for x in index_plan()}
+
+
+def test_index_statements():
+    plan = IndexPlan("pod_key", "Pod", ("name", "namespace"), node_key=True)
+    assert plan.create_index() == (
+        "CREATE INDEX `pod_key` IF NOT EXISTS FOR (n:Pod) ON (n.name, n.namespace)"
+    )
+    assert plan.create_constraint() == (
+        "CREATE CONSTRAINT `pod_key` IF NOT EXISTS "
+        "ON (n:Pod) ASSERT (n.name, n.namespace) IS NODE KEY"
+    )
+
+    plan = IndexPlan(
+        "bound_to_attack_path",
+        "BOUND_TO",
+        ("attack_path",),
+        relationship=True,
+    )
+    assert plan.create_index() == (
+        "CREATE INDEX `bound_to_attack_path` IF NOT EXISTS "
+        "FOR ()-[n:BOUND_TO]-() ON (n.attack_path)"
+    )
+
+
+def test_index_plan():
+    plans = plans_by_name()
+
+    # Kinds which cannot be listed have no nodes
+    assert "binding_key" not in plans
+    # Namespaced kinds use a composite index, as references may lack one
+    assert not plans["pod_key"].node_key
+    assert plans["clusterrole_key"].node_key
+    assert plans["pod"].properties == ("name", "namespace")
+    assert plans["cluster_key"].node_key
+    assert plans["bound_to_attack_path"].relationship
+    assert "identity" not in plans
+
+
+def test_index_plan_partitions():
+    config["graph"]["multi_cluster"] = True
+    config["graph"]["blue_green"] = True
+    config["graph"]["build"] = "b1"
+    plans = plans_by_name()
+
+    key = plans["clusterrole_cluster_build_key"]
+    assert key.properties[-2:] == ("cluster", "build")
+    assert "build" not in key.properties[:-2]
+    assert plans["identity_build"].properties == ("kind", "name", "build")
+    assert "resource_build" in plans
+
+
+def test_stale_constraints():
+    session = FakeSession(
+        constraints=["clusterrole_key", "clusterrole_cluster_key", "someone_elses"],
+    )
+    config["graph"]["multi_cluster"] = True
+
+    plans = index_plan()
+    assert stale_constraints(session, plans) == ["clusterrole_key"]
+
+
+def test_create_indices_enterprise(monkeypatch):
+    session = FakeSession(constraints=["clusterrole_cluster_key"])
+    monkeypatch.setattr(indices, "get_driver", lambda: FakeDriver(session))
+
+    create_indices()
+
+    assert "DROP CONSTRAINT `clusterrole_cluster_key` IF EXISTS" in session.statements
+    assert plans_by_name()["clusterrole_key"].create_constraint() in session.statements
+    assert plans_by_name()["bound_to_attack_path"].create_index() in session.statements
+
+
+def test_create_indices_gated_on_version(monkeypatch):
+    session = FakeSession(version="4.1.3", edition="community")
+    monkeypatch.setattr(indices, "get_driver", lambda: FakeDriver(session))
+
+    create_indices()
+
+    assert "SHOW CONSTRAINTS" not in session.statements
+    assert not [x for x in session.statements if "CONSTRAINT" in x]
+    assert not [x for x in session.statements if "()-[n:" in x]
+    assert plans_by_name()["clusterrole_key"].create_index() in session.statements
+
+
+def test_unindexed_statements(monkeypatch):
+    session = FakeSession(
+        plans={
+            "MATCH (x:Pod) RETURN x": {
+                "operatorType": "ProduceResults@neo4j",
+                "children": [{"operatorType": "NodeByLabelScan@neo4j"}],
+            },
+            "MATCH (x:Pod {name: $name}) RETURN x": {
+                "operatorType": "ProduceResults@neo4j",
+                "children": [{"operatorType": "NodeIndexSeek@neo4j"}],
+            },
+        },
+    )
+    monkeypatch.setattr(indices, "get_driver", lambda: FakeDriver(session))
+    monkeypatch.setattr(
+        indices,
+        "hot_statements",
+        lambda: [
+            ("MATCH (x:Pod) RETURN x", {}),
+            ("MATCH (x:Pod {name: $name}) RETURN x", {"name": ""}),
+        ],
+    )
+
+    assert indices.unindexed_statements() == ["MATCH (x:Pod) RETURN x"]
@@ -0,0 +1,151 @@
+from typing import Any, Callable, Dict, List
+
+import pytest
+import tqdm
+from icekube import neo4j
+from icekube.config import config
+from icekube.neo4j import delete_batched, purge_neo4j
+
+
+class FakeResult(List[Dict[str, Any]]):
+    def single(self) -> Dict[str, Any]:
+        return self[0]
+
+
+class FakeTransaction:
+    def __init__(self, graph: "FakeGraph"):
+        self.graph = graph
+
+    def run(self, cmd: str, limit: int, **kwargs: Any) -> FakeResult:
+        self.graph.statements.append((cmd, {"limit": limit, **kwargs}))
+        match = cmd.split(" WITH ")[0]
+        deleted = min(limit, self.graph.remaining[match])
+        self.graph.remaining[match] -= deleted
+        return FakeResult([{"deleted": deleted}])
+
+
+class FakeGraph:
+    def __init__(self, remaining: Dict[str, int]):
+        # Matches of each statement not yet deleted
+        self.remaining = remaining
+        self.statements: List[Any] = []
+        self.transactions = 0
+
+    def __enter__(self) -> "FakeGraph":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        pass
+
+    def session(self, **kwargs: Any) -> "FakeGraph":
+        return self
+
+    def run(self, cmd: str, **kwargs: Any) -> FakeResult:
+        if cmd == "CALL db.relationshipTypes()":
+            return FakeResult({"relationshipType": x} for x in ["HOSTED_ON", "OWNS"])
+        match = cmd.split(" RETURN ")[0]
+        return FakeResult([{"total": self.remaining[match]}])
+
+    def write_transaction(self, func: Callable[..., int], *args: Any) -> int:
+        self.transactions += 1
+        return func(FakeTransaction(self), *args)
+
+
+class Progress:
+    def __init__(self, total: int = 0) -> None:
+        self.total = total
+        self.updates: List[int] = []
+
+    def __enter__(self) -> "Progress":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        pass
+
+    def update(self, n: int) -> None:
+        self.updates.append(n)
+
+
+@pytest.fixture
+def graph(monkeypatch) -> FakeGraph:
+    graph = FakeGraph(
+        {
+            "MATCH (x)": 25,
+            "MATCH ()-[r:`HOSTED_ON`]->()": 4,
+            "MATCH ()-[r:`OWNS`]->()": 12,
+        },
+    )
+    monkeypatch.setattr(neo4j, "get_driver", lambda: graph)
+    config["graph"]["delete_batch_size"] = 10
+    return graph
+
+
+def test_deleted_in_bounded_transactions(graph):
+    progress = Progress()
+
+    assert delete_batched("MATCH (x)", "x", progress=progress, build="b1") == 25
+
+    # Batches are deleted until one deletes nothing
+    assert graph.transactions == 4
+    assert progress.updates == [10, 10, 5, 0]
+    assert graph.remaining["MATCH (x)"] == 0
+    cmd, params = graph.statements[0]
+    assert " ".join(cmd.split()) == (
+        "MATCH (x) WITH x LIMIT $limit DELETE x RETURN count(*) AS deleted"
+    )
+    assert params == {"limit": 10, "build": "b1"}
+
+
+def test_nothing_to_delete(graph):
+    graph.remaining["MATCH (x)"] = 0
+
+    assert delete_batched("MATCH (x)", "x") == 0
+    assert graph.transactions == 1
+
+
+def test_detach_and_update(graph):
+    graph.remaining["MATCH (x)-[r]-(y)"] = 1
+    delete_batched(
+        "MATCH (x)-[r]-(y)",
+        "r",
+        detach=True,
+        carry=["y"],
+        update="SET y.stale = true",
+    )
+
+    cmd, _ = graph.statements[0]
+    assert cmd == (
+        "MATCH (x)-[r]-(y) WITH r, y LIMIT $limit SET y.stale = true "
+        "DETACH DELETE r RETURN count(*) AS deleted"
+    )
+
+
+def test_purge_deletes_relationships_by_type_first(graph, monkeypatch):
+    bars: List[Progress] = []
+
+    def progress_bar(total: int) -> Progress:
+        bars.append(Progress(total))
+        return bars[-1]
+
+    monkeypatch.setattr(tqdm, "tqdm", progress_bar)
+    monkeypatch.setattr(neo4j, "get_blob_store", lambda: None)
+
+    purge_neo4j()
+
+    # Nodes are only detached once their relationships are gone
+    matches = [cmd.split(" WITH ")[0] for cmd, _ in graph.statements]
+    assert matches == [
+        "MATCH ()-[r:`HOSTED_ON`]->()",
+        "MATCH ()-[r:`HOSTED_ON`]->()",
+        "MATCH ()-[r:`OWNS`]->()",
+        "MATCH ()-[r:`OWNS`]->()",
+        "MATCH ()-[r:`OWNS`]->()",
+        "MATCH (x)",
+        "MATCH (x)",
+        "MATCH (x)",
+        "MATCH (x)",
+    ]
+    assert "DETACH DELETE x" in graph.statements[-1][0]
+    assert not any(graph.remaining.values())
+    (progress,) = bars
+    assert progress.total == sum(progress.updates) == 41
@@ -0,0 +1,52 @@
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from contextlib import closing
+from multiprocessing import get_context
+from typing import Any, Callable, Iterator, List, Tuple
+
+import pytest
+from icekube.parsing import bounded_map
+
+
+@pytest.fixture
+def pool() -> Iterator[ProcessPoolExecutor]:
+    # Spawned, as process_pool does
+    pool = ProcessPoolExecutor(1, mp_context=get_context("spawn"))
+    yield pool
+    pool.shutdown()
+
+
+def test_results_in_order(pool):
+    items = [(x,) for x in [-3, 1, -2]]
+
+    assert list(bounded_map(pool, abs, items, 2)) == [3, 1, 2]
+
+
+def test_close_cancels_queued_items(pool, monkeypatch):
+    submitted: List["Future[Any]"] = []
+    read: List[int] = []
+    submit: Callable[..., "Future[Any]"] = pool.submit
+
+    def recorded_submit(*args: Any) -> "Future[Any]":
+        future = submit(*args)
+        submitted.append(future)
+        return future
+
+    def items() -> Iterator[Tuple[float]]:
+        for idx in range(20):
+            read.append(idx)
+            yield (0.2,)
+
+    monkeypatch.setattr(pool, "submit", recorded_submit)
+
+    with closing(bounded_map(pool, time.sleep, items(), 8)) as results:
+        next(results)
+
+    # Items are only read as results are consumed
+    assert len(read) == 8
+    # The pool sends a worker up to two calls ahead, those queued behind them
+    # are cancelled and never run
+    assert sum(x.cancelled() for x in submitted) >= 4
+    start = time.monotonic()
+    pool.shutdown()
+    assert time.monotonic() - start < 0.2 * 5
@@ -0,0 +1,135 @@
+import threading
+import time
+from typing import Any, Callable, List
+
+import pytest
+from icekube.pipeline import Pipeline, TaskFailed
+
+
+def run_in_thread(func: Callable[[], None]) -> threading.Thread:
+    thread = threading.Thread(target=func, daemon=True)
+    thread.start()
+    return thread
+
+
+def settled(value: Callable[[], int], interval: float = 0.3) -> int:
+    """The value once it stops changing."""
+    previous = value()
+    while True:
+        time.sleep(interval)
+        current = value()
+        if current == previous:
+            return current
+        previous = current
+
+
+def test_tasks_are_completed_once_written():
+    written: List[int] = []
+    completed: List[int] = []
+
+    def fetch(task: int) -> int:
+        if task == 3:
+            raise TaskFailed(str(task))
+        return task
+
+    pipeline: Pipeline[int, int, int] = Pipeline(
+        fetch,
+        lambda task, data: [data] * data,
+        written.extend,
+        fetchers=2,
+        parsers=2,
+        writers=2,
+        queue_size=2,
+        batch_size=2,
+        on_complete=completed.append,
+    )
+    pipeline.run(list(range(6)))
+
+    assert sorted(written) == [1, 2, 2, 4, 4, 4, 4, 5, 5, 5, 5, 5]
+    assert sorted(completed) == [0, 1, 2, 4, 5]
+    assert pipeline.incomplete == {3}
+
+
+@pytest.mark.parametrize("stage", ["fetch", "parse", "write"])
+def test_stage_failure_stops_every_thread(stage):
+    fetched: List[int] = []
+    baseline = threading.active_count()
+
+    def fail(name: str) -> None:
+        if name == stage:
+            raise ValueError(name)
+
+    def fetch(task: int) -> int:
+        fetched.append(task)
+        if task == 5:
+            fail("fetch")
+        return task
+
+    def parse(task: int, data: int) -> List[int]:
+        if task == 5:
+            fail("parse")
+        return [data]
+
+    def write(batch: List[int]) -> None:
+        if 5 in batch:
+            fail("write")
+
+    pipeline: Pipeline[int, int, int] = Pipeline(
+        fetch,
+        parse,
+        write,
+        fetchers=2,
+        parsers=2,
+        writers=2,
+        queue_size=1,
+        batch_size=1,
+    )
+    errors: List[BaseException] = []
+
+    def run() -> None:
+        try:
+            pipeline.run(list(range(1000)))
+        except BaseException as e:
+            errors.append(e)
+
+    run_in_thread(run).join(timeout=30)
+
+    assert [str(x) for x in errors] == [stage]
+    # Every worker exited, without working through the remaining tasks
+    assert threading.active_count() == baseline
+    assert len(fetched) < 1000
+
+
+def test_back_pressure_bounds_fetched_tasks():
+    fetched: List[int] = []
+    written: List[int] = []
+    unblocked = threading.Event()
+
+    def fetch(task: int) -> int:
+        fetched.append(task)
+        return task
+
+    def write(batch: List[Any]) -> None:
+        unblocked.wait()
+        written.extend(batch)
+
+    pipeline: Pipeline[int, int, int] = Pipeline(
+        fetch,
+        lambda task, data: [data],
+        write,
+        fetchers=1,
+        parsers=1,
+        writers=1,
+        queue_size=2,
+        batch_size=1,
+    )
+    thread = run_in_thread(lambda: pipeline.run(list(range(100))))
+
+    # With the writer blocked, one task is held by each worker and two by
+    # each queue between stages
+    assert settled(lambda: len(fetched)) == 7
+
+    unblocked.set()
+    thread.join(timeout=30)
+    assert not thread.is_alive()
+    assert sorted(written) == list(range(100))
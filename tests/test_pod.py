@@ -0,0 +1,121 @@
+from icekube.capabilities import CAPABILITIES
+from icekube.models.pod import DANGEROUS_HOST_PATH_TRIE, PodFeatures
+
+POD_SPEC = {
+    "serviceAccountName": "app",
+    "initContainers": [
+        {
+            "name": "init",
+            "image": "busybox",
+            "securityContext": {"capabilities": {"add": ["cap_sys_admin"]}},
+            "envFrom": [{"secretRef": {"name": "init-env"}}],
+        },
+    ],
+    "containers": [
+        {
+            "name": "app",
+            "image": "nginx",
+            "securityContext": {
+                "capabilities": {"add": ["NET_ADMIN", "CAP_NET_RAW", "SYS_MAGIC"]},
+            },
+            "env": [
+                {"name": "PLAIN", "value": "x"},
+                {
+                    "name": "TOKEN",
+                    "valueFrom": {"secretKeyRef": {"name": "api", "key": "token"}},
+                },
+            ],
+        },
+    ],
+    "ephemeralContainers": [
+        {
+            "name": "debugger",
+            "image": "busybox",
+            "securityContext": {"privileged": True},
+        },
+    ],
+    "volumes": [
+        {"name": "logs", "hostPath": {"path": "/var/log/pods"}},
+        {"name": "data", "hostPath": {"path": "/srv/data"}},
+        {"name": "tls", "secret": {"secretName": "tls"}},
+        {
+            "name": "projected",
+            "projected": {
+                "sources": [
+                    {"secret": {"name": "projected-secret"}},
+                    {"configMap": {"name": "settings"}},
+                ],
+            },
+        },
+        {
+            "name": "vault",
+            "csi": {
+                "driver": "secrets-store.csi.k8s.io",
+                "nodePublishSecretRef": {"name": "csi-creds"},
+            },
+        },
+    ],
+}
+
+
+def test_dangerous_host_path_prefixes():
+    assert DANGEROUS_HOST_PATH_TRIE.contains_prefix("/")
+    assert DANGEROUS_HOST_PATH_TRIE.contains_prefix("/var")
+    assert DANGEROUS_HOST_PATH_TRIE.contains_prefix("/run/docker.sock")
+    assert not DANGEROUS_HOST_PATH_TRIE.contains_prefix("/var/log/pods")
+    assert not DANGEROUS_HOST_PATH_TRIE.contains_prefix("/srv")
+
+
+def test_dangerous_host_path_rejects_empty_and_relative_paths():
+    assert not DANGEROUS_HOST_PATH_TRIE.contains_prefix("")
+    assert not DANGEROUS_HOST_PATH_TRIE.contains_prefix(".")
+    assert not DANGEROUS_HOST_PATH_TRIE.contains_prefix("var/log")
+
+
+def test_pod_features():
+    features = PodFeatures(POD_SPEC)
+
+    assert features.privileged
+    assert features.capabilities == ["NET_ADMIN", "NET_RAW", "SYS_ADMIN", "SYS_MAGIC"]
+    assert features.unknown_capabilities == {"SYS_MAGIC"}
+    assert features.host_path_volumes == ["/var/log/pods", "/srv/data"]
+    # Only mounting a parent of a dangerous path, e.g. /var/log, counts
+    assert not features.dangerous_host_path
+    assert list(features.secrets) == [
+        "api",
+        "init-env",
+        "tls",
+        "projected-secret",
+        "csi-creds",
+    ]
+
+
+def test_pod_features_all_capabilities():
+    spec = {
+        "containers": [
+            {
+                "name": "app",
+                "securityContext": {"capabilities": {"add": ["CAP_ALL"]}},
+            },
+        ],
+        "volumes": [{"name": "root", "hostPath": {"path": "/"}}],
+    }
+    features = PodFeatures(spec)
+
+    assert features.capabilities == CAPABILITIES
+    assert features.capability_mask == (1 << len(CAPABILITIES)) - 1
+    assert not features.privileged
+    assert features.dangerous_host_path
+    assert not features.secrets
+
+
+def test_pod_features_empty_spec():
+    spec = {
+        "containers": None,
+        "volumes": [{"hostPath": {}}, {"hostPath": {"path": ""}}],
+    }
+    features = PodFeatures(spec)
+
+    assert features.capabilities == []
+    assert features.host_path_volumes == [""]
+    assert not features.dangerous_host_path
@@ -0,0 +1,24 @@
+import re
+
+from icekube.attack_paths import WORKLOAD_TYPES, attack_paths
+from icekube.profiles import profile_kinds
+
+
+def test_minimal_profile_includes_attack_path_kinds():
+    kinds = profile_kinds("minimal")
+    assert kinds is not None
+
+    for name, query in attack_paths.items():
+        queries = [query] if isinstance(query, str) else query
+        for q in queries:
+            for label in re.findall(r":([A-Z]\w*)", q):
+                if label.isupper():
+                    # Relationship type, e.g. [:BOUND_TO]
+                    continue
+                assert label in kinds, f"{label} from {name} not enumerated"
+
+
+def test_minimal_profile_includes_workloads():
+    kinds = profile_kinds("minimal")
+    assert kinds is not None
+    assert set(WORKLOAD_TYPES) <= kinds
@@ -0,0 +1,34 @@
+from icekube import queries
+from icekube.config import config
+from icekube.queries import QueryCache
+
+
+def test_cache_only_prunes_generations_of_its_graph(tmp_path):
+    key = {"query_type": "reachable"}
+
+    QueryCache(str(tmp_path), "old", "bolt://a").put(key, {"nodes": [1]})
+    QueryCache(str(tmp_path), "other", "bolt://b").put(key, {"nodes": [2]})
+    QueryCache(str(tmp_path), "new", "bolt://a").put(key, {"nodes": [3]})
+
+    assert QueryCache(str(tmp_path), "old", "bolt://a").get(key) is None
+    assert QueryCache(str(tmp_path), "new", "bolt://a").get(key) == {"nodes": [3]}
+    assert QueryCache(str(tmp_path), "other", "bolt://b").get(key) == {"nodes": [2]}
+
+
+def test_cached_query_is_keyed_by_build(monkeypatch, tmp_path):
+    build = {"value": "blue"}
+    monkeypatch.setattr(queries, "graph_generation", lambda: "generation")
+    monkeypatch.setattr(queries, "current_build", lambda: build["value"])
+    monkeypatch.setattr(
+        queries,
+        "run_query",
+        lambda *args: {"nodes": [build["value"]]},
+    )
+    config["neo4j"]["url"] = "bolt://a"
+
+    def query():
+        return queries.cached_query("reachable", cache_dir=str(tmp_path))
+
+    assert query()["nodes"] == ["blue"]
+    build["value"] = "green"
+    assert query()["nodes"] == ["green"]
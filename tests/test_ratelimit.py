@@ -0,0 +1,152 @@
+from typing import List
+
+import pytest
+from icekube import ratelimit
+from icekube.ratelimit import (
+    LATENCY_WARMUP,
+    AdaptiveLimiter,
+    RateLimiter,
+    TokenBucket,
+)
+from kubernetes.client.exceptions import ApiException
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ratelimit.time, "monotonic", clock.monotonic)
+    monkeypatch.setattr(ratelimit.time, "sleep", clock.sleep)
+    return clock
+
+
+def throttled(status, retry_after=None):
+    e = ApiException(status=status)
+    if retry_after is not None:
+        e.headers = {"Retry-After": retry_after}
+    return e
+
+
+def test_token_bucket_rate(clock):
+    bucket = TokenBucket(qps=8, burst=5)
+
+    for _ in range(5):
+        bucket.acquire()
+    assert clock.sleeps == []
+
+    for _ in range(20):
+        bucket.acquire()
+    assert clock.now == pytest.approx(2.5)
+
+
+def test_token_bucket_unlimited(clock):
+    bucket = TokenBucket(qps=0, burst=1)
+    for _ in range(100):
+        bucket.acquire()
+    assert clock.sleeps == []
+
+
+def test_adaptive_limiter_aimd():
+    limiter = AdaptiveLimiter(8)
+
+    limiter.acquire()
+    limiter.release(True)
+    assert limiter.limit == 4
+
+    limiter.acquire()
+    limiter.release(True)
+    assert limiter.limit == 2
+
+    # One more per window of `limit` successful requests
+    for _ in range(2):
+        limiter.acquire()
+        limiter.release(False)
+    assert limiter.limit == pytest.approx(2 + 1 / 2 + 1 / 2.5)
+
+    for _ in range(100):
+        limiter.acquire()
+        limiter.release(False)
+    assert limiter.limit == 8
+
+    for _ in range(10):
+        limiter.acquire()
+        limiter.release(True)
+    assert limiter.limit == 1
+
+
+def test_adaptive_limiter_latency():
+    limiter = AdaptiveLimiter(8)
+
+    # Slow requests are not congestion until a baseline is established
+    limiter.acquire()
+    limiter.release(False, 5.0)
+    for _ in range(LATENCY_WARMUP * 5):
+        limiter.acquire()
+        limiter.release(False, 0.1)
+    assert limiter.limit == 8
+
+    # Nor are fast ones, however many times the baseline they take
+    limiter.acquire()
+    limiter.release(False, 0.9)
+    assert limiter.limit == 8
+
+    limiter.acquire()
+    limiter.release(False, 10.0)
+    assert limiter.limit == 4
+
+
+def test_retry_after(clock, monkeypatch):
+    monkeypatch.setattr(ratelimit.random, "uniform", lambda a, b: b)
+    limiter = RateLimiter(qps=0, burst=1, concurrency=4, max_retries=3)
+    responses = [throttled(429, "2"), throttled(503), "ok"]
+
+    def request():
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    assert limiter.call(request) == "ok"
+    # Retry-After plus jitter, then exponential backoff for the second attempt
+    assert clock.sleeps == [2 + ratelimit.BACKOFF_BASE, ratelimit.BACKOFF_BASE * 2]
+    # Halved for each failure, then one more for the success
+    assert limiter.concurrency.limit == 2
+
+
+def test_retry_gives_up(clock):
+    limiter = RateLimiter(qps=0, burst=1, concurrency=4, max_retries=2)
+    calls: List[None] = []
+
+    def request():
+        calls.append(None)
+        raise throttled(429)
+
+    with pytest.raises(ApiException):
+        limiter.call(request)
+    assert len(calls) == 3
+
+
+def test_no_retry_on_client_error(clock):
+    limiter = RateLimiter(qps=0, burst=1, concurrency=4, max_retries=2)
+    calls: List[None] = []
+
+    def request():
+        calls.append(None)
+        raise throttled(404)
+
+    with pytest.raises(ApiException):
+        limiter.call(request)
+    assert len(calls) == 1
+    assert limiter.concurrency.limit == 4
@@ -0,0 +1,158 @@
+import json
+import pickle
+
+import pytest
+from icekube import kube
+from icekube.models import APIResource, ConfigMap, Pod
+from icekube.models.base import Resource, ResourceRecord, ResourceRef
+from icekube.sessions import ClusterSession, current_session
+
+
+def fresh(value: str) -> str:
+    """An equal string, which is not the same object."""
+    return "".join(list(value))
+
+
+def record(name: str = "web", raw: str = "{}", kind: str = "Pod") -> ResourceRecord:
+    return ResourceRecord.build(
+        apiVersion=fresh("v1"),
+        kind=fresh(kind),
+        name=fresh(name),
+        plural=fresh(f"{kind.lower()}s"),
+        namespace=fresh("default"),
+        raw=raw,
+    )
+
+
+def test_repeated_strings_are_interned():
+    a = record("a")
+    b = record("b")
+
+    for field in ["apiVersion", "kind", "plural", "namespace"]:
+        assert getattr(a, field) is getattr(b, field), field
+
+
+def test_records_have_slots():
+    a = record()
+
+    assert not hasattr(a, "__dict__")
+    with pytest.raises(AttributeError):
+        a.status = "Running"  # type: ignore[attr-defined]
+
+
+def test_labels_of_plain_records():
+    config_map = record("settings", '{"data": {}}', "ConfigMap")
+
+    assert config_map.labels is None
+    assert config_map.db_labels == {
+        "apiGroup": "",
+        "apiVersion": "v1",
+        "kind": "ConfigMap",
+        "name": "settings",
+        "namespace": "default",
+        "plural": "configmaps",
+        "raw": '{"data": {}}',
+    }
+    model = config_map.to_model()
+    assert isinstance(model, ConfigMap)
+    assert model.unique_identifiers == config_map.unique_identifiers
+
+
+def test_labels_from_model():
+    pod = record(raw=json.dumps({"spec": {"hostNetwork": True}}))
+
+    # Kept from the model, which is then discarded
+    assert pod.labels is not None
+    assert pod.db_labels["hostNetwork"] is True
+    assert pod.db_labels == pod.to_model().db_labels
+    assert isinstance(pod.to_model(), Pod)
+
+
+def test_records_within_a_cluster():
+    token = current_session.set(ClusterSession("a", "cluster-a"))
+    try:
+        config_map = record("settings", kind="ConfigMap")
+    finally:
+        current_session.reset(token)
+
+    assert config_map.cluster == "cluster-a"
+    assert config_map.unique_identifiers["cluster"] == "cluster-a"
+
+
+
+
+
+def ref(name: str, namespace: str = "default") -> ResourceRef:
+    return ResourceRef(
+        "Secret",
+        (
+            ("apiGroup", ""),
+            ("apiVersion", "v1"),
+            ("kind", "Secret"),
+            ("name", name),
+            ("namespace", namespace),
+        ),
+    )
+
+
+def test_references_are_hashable_values():
+    assert ref("a") == ref("a")
+    assert ref("a") != ref("b")
+    assert ref("a") != ref("a", "other")
+    assert len({ref("a"), ref("a"), ref("b")}) == 2
+    assert pickle.loads(pickle.dumps(ref("a"))) == ref("a")
+
+    with pytest.raises(AttributeError):
+        ref("a").kind = "Pod"
+
+
+def test_reference_identifiers():
+    secret = ref("tls")
+
+    assert secret.name == "tls"
+    assert secret.namespace == "default"
+    assert secret.unique_identifiers["kind"] == "Secret"
+    assert repr(secret) == "Secret(namespace='default', name='tls')"
+
+
+@pytest.fixture
+def discovery(monkeypatch):
+    # References are built without discovering the API of a cluster
+    monkeypatch.setattr(
+        kube,
+        "api_resource_for_kind",
+        lambda kind: APIResource(
+            name=f"{kind.lower()}s",
+            namespaced=True,
+            group="v1",
+            kind=kind,
+            verbs=["list"],
+        ),
+    )
+
+
+def test_reference_matches_record(discovery):
+    config_map = record("settings", kind="ConfigMap")
+    reference = Resource.reference(
+        apiVersion="v1",
+        kind="ConfigMap",
+        name="settings",
+        namespace="default",
+        plural="configmaps",
+    )
+
+    assert reference == ConfigMap.reference(name="settings", namespace="default")
+    assert reference.unique_identifiers == config_map.unique_identifiers
+
+
+def test_references_within_a_cluster(discovery):
+    kwargs = {"name": "settings", "namespace": "default"}
+    token = current_session.set(ClusterSession("a", "cluster-a"))
+    try:
+        scoped = ConfigMap.reference(**kwargs)
+    finally:
+        current_session.reset(token)
+
+    assert scoped.unique_identifiers["cluster"] == "cluster-a"
+    assert scoped != ConfigMap.reference(**kwargs)
+    assert scoped == ConfigMap.reference(cluster="cluster-a", **kwargs)
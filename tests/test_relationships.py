@@ -0,0 +1,134 @@
+import json
+from typing import Any, Dict, List, Optional, Type
+
+import pytest
+from icekube import icekube, kube
+from icekube.icekube import RELATIONSHIP_STAGES, generate_relationships
+from icekube.models import APIResource, Pod
+from icekube.models.base import Resource
+
+MOCKED = "ON CREATE SET dst.relationships_mocked = true"
+
+
+def pod() -> Pod:
+    props: Dict[str, Any] = {
+        "apiVersion": "v1",
+        "kind": "Pod",
+        "plural": "pods",
+        "namespace": "default",
+        "name": "web",
+        "raw": json.dumps({"spec": {"serviceAccountName": "app", "nodeName": "n1"}}),
+    }
+    return Pod(**props)
+
+
+def api_resource(kind: str) -> APIResource:
+    return APIResource(
+        name=f"{kind.lower()}s",
+        namespaced=kind not in ["Namespace", "Node"],
+        group="v1",
+        kind=kind,
+        verbs=["list"],
+    )
+
+
+class FakeResult(List[Dict[str, Any]]):
+    def consume(self) -> None:
+        pass
+
+
+class FakeSession:
+    """Records statements, and returns the nodes created by a MERGE as mocked."""
+
+    def __init__(self, graph: "FakeGraph"):
+        self.graph = graph
+
+    def __enter__(self) -> "FakeSession":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        pass
+
+    def run(self, cmd: str, *args: Any, **kwargs: Any) -> FakeResult:
+        self.graph.statements.append(cmd)
+        if MOCKED in cmd and "USES_ACCOUNT" in cmd:
+            self.graph.mocked = [
+                {
+                    "id": 1,
+                    "x": {
+                        "apiVersion": "v1",
+                        "kind": "ServiceAccount",
+                        "plural": "serviceaccounts",
+                        "namespace": "default",
+                        "name": "app",
+                    },
+                },
+            ]
+        if "RETURN x, id(x) AS id" in cmd:
+            return FakeResult(self.graph.mocked)
+        if "REMOVE x.relationships_mocked" in cmd:
+            self.graph.mocked = []
+        return FakeResult()
+
+
+class FakeGraph:
+    def __init__(self) -> None:
+        self.statements: List[str] = []
+        self.mocked: List[Dict[str, Any]] = []
+
+    def session(self, **kwargs: Any) -> FakeSession:
+        return FakeSession(self)
+
+
+@pytest.fixture
+def graph(monkeypatch) -> FakeGraph:
+    graph = FakeGraph()
+    # References are built without discovering the API of a cluster
+    monkeypatch.setattr(kube, "api_resource_for_kind", api_resource)
+    monkeypatch.setattr(icekube, "get_driver", lambda: graph)
+    monkeypatch.setattr(icekube, "clear_stale_relationships", lambda: None)
+    monkeypatch.setattr(icekube, "clear_pending_relationships", lambda: None)
+    monkeypatch.setattr(icekube, "remaining_kinds", lambda exclude: ["Pod"])
+    return graph
+
+
+def test_stages_in_order(graph, monkeypatch):
+    found: List[str] = []
+
+    def find(resource: Optional[Type[Resource]], **kwargs: Any) -> List[Resource]:
+        kind = resource.__name__ if resource else kwargs["kind"]
+        found.append(kind)
+        return [pod()] if kind == "Pod" else []
+
+    monkeypatch.setattr(icekube, "find", find)
+    generate_relationships(full=True, processes=0)
+
+    assert found == [x for stage in RELATIONSHIP_STAGES for x in stage] + ["Pod"]
+
+
+def test_mocked_nodes_get_relationships(graph, monkeypatch):
+    monkeypatch.setattr(
+        icekube,
+        "find",
+        lambda resource, **kwargs: [pod()] if kwargs.get("kind") == "Pod" else [],
+    )
+    generate_relationships(full=True, processes=0)
+
+    # The pod's ServiceAccount is first created by its USES_ACCOUNT
+    # relationship, after the stage ServiceAccounts would have run in
+    uses_account = next(
+        idx for idx, x in enumerate(graph.statements) if "USES_ACCOUNT" in x
+    )
+    assert MOCKED in graph.statements[uses_account]
+    assert "ON CREATE SET src.relationships_mocked = true" in next(
+        x for x in graph.statements if "HOSTS_POD" in x
+    )
+
+    within = [
+        idx
+        for idx, x in enumerate(graph.statements)
+        if "WITHIN_NAMESPACE" in x and x.startswith("MERGE (src:ServiceAccount")
+    ]
+    assert len(within) == 1
+    assert within[0] > uses_account
+    assert "REMOVE x.relationships_mocked" in graph.statements[within[0] + 1]
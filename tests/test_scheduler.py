@@ -0,0 +1,123 @@
+from typing import Any, Dict, List, Optional
+
+import pytest
+from icekube import scheduler
+from icekube.attack_paths import ANY_ATTACK_PATH, attack_path_dependencies
+from icekube.config import config
+from icekube.scheduler import (
+    IdChunk,
+    Task,
+    node_id_chunks,
+    read_relationships,
+    rule_tasks,
+    task_dependencies,
+)
+
+# Node ids of each build, interleaved as when both are written
+NODES = {x: "old" if x % 3 else "new" for x in range(2, 30)}
+
+
+class FakeResult:
+    def __init__(self, record: Dict[str, Any]):
+        self.record = record
+
+    def single(self) -> Dict[str, Any]:
+        return self.record
+
+
+class FakeSession:
+    def __init__(self, pages: List[int]):
+        self.pages = pages
+
+    def __enter__(self) -> "FakeSession":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        pass
+
+    def run(self, cmd: str, last: int, size: int, build: Optional[str]) -> FakeResult:
+        assert "WHERE id(n) > $last" in cmd
+        assert ("n.build = $build" in cmd) == (build is not None)
+        self.pages.append(last)
+        ids = sorted(x for x, y in NODES.items() if x > last and build in [None, y])
+        page: List[Optional[int]] = [*ids[:size]] or [None]
+        return FakeResult({"first": page[0], "last": page[-1]})
+
+
+class FakeDriver:
+    def __init__(self) -> None:
+        self.pages: List[int] = []
+
+    def session(self, **kwargs: Any) -> FakeSession:
+        return FakeSession(self.pages)
+
+
+@pytest.mark.parametrize("scoped_targets", [False, True])
+def test_declared_dependencies_cover_queries(scoped_targets):
+    config["graph"]["scoped_targets"] = scoped_targets
+    tasks = rule_tasks()
+    rules = {x.relationship for x in tasks}
+
+    for task in tasks:
+        declared = set(attack_path_dependencies.get(task.relationship, []))
+        # Attack paths of other rules read by the query must be declared
+        reads = read_relationships(task) & (rules - {task.relationship})
+        assert reads <= declared, task
+        if "attack_path" in task.query:
+            assert ANY_ATTACK_PATH in declared, task
+
+
+def test_task_dependencies_order(monkeypatch):
+    monkeypatch.setattr(
+        scheduler,
+        "attack_path_dependencies",
+        {"B": ["A"], "C": [ANY_ATTACK_PATH]},
+    )
+    a, b, c = (Task(x, 0, "") for x in "ABC")
+    c2 = Task("C", 1, "")
+
+    assert task_dependencies([a, b, c, c2]) == {
+        a: set(),
+        b: {a},
+        c: {a, b},
+        c2: {a, b},
+    }
+
+
+@pytest.mark.parametrize(
+    "dependencies",
+    [{"A": ["B"], "B": ["A"]}, {"A": ["D"]}],
+)
+def test_task_dependencies_invalid(monkeypatch, dependencies):
+    monkeypatch.setattr(scheduler, "attack_path_dependencies", dependencies)
+
+    with pytest.raises(Exception):
+        task_dependencies([Task("A", 0, ""), Task("B", 0, "")])
+
+
+@pytest.mark.parametrize(
+    "build,chunks",
+    [
+        (None, [IdChunk(2, 11), IdChunk(12, 21), IdChunk(22, 29)]),
+        ("new", [IdChunk(3, 12), IdChunk(15, 24), IdChunk(27, 27)]),
+    ],
+)
+def test_node_id_chunks_paged_on_server(monkeypatch, build, chunks):
+    driver = FakeDriver()
+    monkeypatch.setattr(scheduler, "get_driver", lambda: driver)
+    monkeypatch.setattr(scheduler, "current_build", lambda: build)
+
+    assert node_id_chunks(10 if build is None else 4) == chunks
+    # Each page starts after the last id of the one before
+    assert driver.pages == [-1] + [x.last for x in chunks]
+
+
+def test_node_id_chunks_of_ids():
+    assert node_id_chunks(2, [5, 1, 3]) == [IdChunk(1, 3, [1, 3]), IdChunk(5, 5, [5])]
+
+
+def test_chunked_query_within_build():
+    query = scheduler.chunked_query(Task("A", 0, "MATCH (src)-[:X]->(dest)"))
+
+    assert query.startswith("UNWIND coalesce($ids, range($first, $last)) AS id ")
+    assert "coalesce(src.build, '') = coalesce($build, '')" in query
@@ -0,0 +1,115 @@
+import json
+from typing import Any, Dict, List, Tuple
+
+import pytest
+from icekube import icekube, kube
+from icekube.config import config
+from icekube.icekube import enumerate_resource_kind
+from icekube.models import APIResource
+from icekube.models.base import Resource
+from icekube.neo4j import node_hash
+from icekube.utils import content_hash, normalise
+
+DEPLOYMENT = {
+    "apiVersion": "apps/v1",
+    "kind": "Deployment",
+    "metadata": {
+        "name": "web",
+        "namespace": "default",
+        "resourceVersion": "1",
+        "managedFields": [{"manager": "kubectl"}],
+    },
+    "spec": {"replicas": 3},
+    "status": {"readyReplicas": 3},
+}
+
+
+def deployment(**changes: Any) -> Dict[str, Any]:
+    obj: Dict[str, Any] = json.loads(json.dumps(DEPLOYMENT))
+    for key, value in changes.items():
+        obj[key].update(value)
+    return obj
+
+
+def resource(obj: Dict[str, Any]) -> Resource:
+    props: Dict[str, Any] = {
+        "apiVersion": obj["apiVersion"],
+        "kind": obj["kind"],
+        "plural": "deployments",
+        "name": obj["metadata"]["name"],
+        "namespace": obj["metadata"]["namespace"],
+        "raw": json.dumps(obj),
+    }
+    return Resource(**props)
+
+
+def test_content_hash_is_stable():
+    assert content_hash({"a": 1, "b": [1, 2]}) == content_hash({"b": [1, 2], "a": 1})
+    assert content_hash({"a": 1}) != content_hash({"a": 2})
+    assert len(content_hash(None)) == 32
+
+
+def test_normalise():
+    assert normalise(deployment()) == {
+        "apiVersion": "apps/v1",
+        "kind": "Deployment",
+        "metadata": {"name": "web", "namespace": "default"},
+        "spec": {"replicas": 3},
+    }
+    assert normalise(deployment(), fields=[])["status"] == {"readyReplicas": 3}
+    assert normalise({"kind": "Namespace"}) == {"kind": "Namespace", "metadata": {}}
+
+
+def digest(obj: Dict[str, Any]) -> str:
+    return node_hash(resource(obj).db_labels)
+
+
+def test_node_hash_keeps_status():
+    base = digest(deployment())
+
+    # Written on every update, without the resource changing
+    assert digest(deployment(metadata={"resourceVersion": "2"})) == base
+    # Stored in raw, so must not go stale
+    assert digest(deployment(status={"readyReplicas": 1})) != base
+    assert digest(deployment(spec={"replicas": 1})) != base
+
+
+@pytest.mark.parametrize("pipeline", [True, False])
+def test_existing_hashes_are_skipped(monkeypatch, pipeline):
+    config["ingest"]["pipeline"] = pipeline
+    unchanged = resource(deployment())
+    updated = resource(deployment(status={"readyReplicas": 1}))
+    written: List[str] = []
+
+    def write_resources(batch: List[Tuple[Resource, str]]) -> None:
+        for x, _ in batch:
+            if x.kind == "Deployment":
+                written.append(json.loads(x.raw or "{}")["status"]["readyReplicas"])
+
+    monkeypatch.setattr(icekube, "existing_hashes", lambda: {digest(deployment())})
+    monkeypatch.setattr(
+        kube,
+        "api_resource_for_kind",
+        lambda kind: APIResource(
+            name=f"{kind.lower()}s",
+            namespaced=False,
+            group="v1",
+            kind=kind,
+            verbs=[],
+        ),
+    )
+    monkeypatch.setattr(icekube, "context_name", lambda: "test")
+    monkeypatch.setattr(icekube, "kube_version", lambda: "v1.29.0")
+    monkeypatch.setattr(icekube, "list_tasks", lambda ignore: ["deployments"])
+    monkeypatch.setattr(icekube, "fetch_task", lambda task: b"")
+    monkeypatch.setattr(
+        icekube,
+        "parse_task",
+        lambda task, body: [unchanged, updated],
+    )
+    monkeypatch.setattr(icekube, "write_resources", write_resources)
+
+    enumerate_resource_kind()
+
+    assert written == [1]
+